@@ -0,0 +1,184 @@
+"""
+按类别过滤与分流
+
+yolov8m.pt 默认输出 COCO 全部 80 类，发布端原先不区分类别，订阅端会把车辆也计入人数。
+- 过滤（--classes person）：作为 classes 参数传给 model.predict，在 NMS 阶段就丢弃其他类别，
+  提取检测、画框、发布都不再处理这些框
+- 分流（--class-route vehicles=car,bus,truck）：指定类别写入独立的命名空间
+    哈希键 image_metadata_{路由}:{ts}，频道 image:metadata:updates:{路由}
+  未列出的类别仍走默认键名/频道，原有消费者只会收到默认路由（通常为行人）
+- 每条检测记录都带 class_id 字段（见 redis_publisher.detection_record）
+
+类别可以写名称（按模型的 names 解析）或编号。
+
+测量过滤前后的推理 / 提取 / 发布开销（发布写入独立前缀，结束后清理）：
+    python class_routing.py bench street.mp4 --classes person --frames 300 --redis-host 127.0.0.1
+"""
+
+import argparse
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+DEFAULT_ROUTE = ""
+
+
+def resolve_classes(specs: List[str], names: Dict[int, str]) -> List[int]:
+    """类别名称或编号 -> 编号列表（保持顺序、去重）"""
+    by_name = {str(v).lower(): int(k) for k, v in names.items()}
+    ids: List[int] = []
+    for spec in specs:
+        for token in spec.split(","):
+            token = token.strip()
+            if not token:
+                continue
+            if token.isdigit():
+                class_id = int(token)
+            elif token.lower() in by_name:
+                class_id = by_name[token.lower()]
+            else:
+                raise ValueError(f"未知类别: {token}")
+            if names and class_id not in names:
+                raise ValueError(f"类别编号超出模型范围: {class_id}")
+            if class_id not in ids:
+                ids.append(class_id)
+    return ids
+
+
+def parse_class_routes(specs: List[str], names: Dict[int, str]) -> Dict[int, str]:
+    """["vehicles=car,bus", "bikes=1,3"] -> {类别编号: 路由名}"""
+    routes: Dict[int, str] = {}
+    for spec in specs:
+        route, sep, classes = spec.partition("=")
+        route = route.strip()
+        if not sep or not route or not classes:
+            raise ValueError(f"路由格式应为 名称=类别,类别: {spec}")
+        for class_id in resolve_classes([classes], names):
+            if class_id in routes:
+                raise ValueError(f"类别 {class_id} 同时属于路由 {routes[class_id]} 和 {route}")
+            routes[class_id] = route
+    return routes
+
+
+class ClassRouter:
+    def __init__(self, routes: Dict[int, str]):
+        self.routes = dict(routes)
+        self.route_names = [DEFAULT_ROUTE] + sorted(set(routes.values()))
+
+    def split(self, detections: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """按路由分组；每个路由都会出现（可能为空列表），增量发布据此判断目标消失"""
+        groups: Dict[str, List[Dict[str, Any]]] = {name: [] for name in self.route_names}
+        for det in detections:
+            groups[self.routes.get(det.get("class_id", -1), DEFAULT_ROUTE)].append(det)
+        return groups
+
+
+# ========================= 基准测试 =========================
+def _read_frames(source: str, count: int) -> List[Any]:
+    import cv2
+
+    cap = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < count:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def _bench_config(model, frames: List[Any], classes: Optional[List[int]], args,
+                  publisher) -> Dict[str, float]:
+    from detect import extract_detections_from_result
+    from delta_publish import payload_bytes
+    from redis_publisher import detection_record
+
+    t_predict = t_extract = t_publish = 0.0
+    boxes = 0
+    payload = 0
+    for frame in frames:
+        t0 = time.perf_counter()
+        result = model.predict(frame, conf=args.conf, iou=args.iou, classes=classes, verbose=False,
+                               device=args.device)[0]
+        t1 = time.perf_counter()
+        detections = extract_detections_from_result(result)
+        t2 = time.perf_counter()
+        if publisher:
+            publisher.publish_detection_metadata(detections)
+        t3 = time.perf_counter()
+        t_predict += t1 - t0
+        t_extract += t2 - t1
+        t_publish += t3 - t2
+        boxes += len(detections)
+        ts = int(time.time() * 1000)
+        payload += sum(payload_bytes(detection_record(d, ts, ts)) for d in detections)
+    n = max(len(frames), 1)
+    return {"predict_ms": t_predict / n * 1000.0, "extract_ms": t_extract / n * 1000.0,
+            "publish_ms": t_publish / n * 1000.0, "boxes": boxes / n, "payload_kb": payload / n / 1024.0}
+
+
+def bench(args):
+    from ultralytics import YOLO
+    from redis_publisher import RedisDetectionPublisher, _cleanup
+
+    model = YOLO(args.model)
+    classes = resolve_classes(args.classes, model.names)
+    frames = _read_frames(args.source, args.frames)
+    if not frames:
+        raise SystemExit(f"❌ 无法读取视频: {args.source}")
+    print(f"🧪 {args.source}：{len(frames)} 帧，过滤类别 {[model.names[c] for c in classes]}")
+    publisher = None
+    if args.redis_host:
+        publisher = RedisDetectionPublisher(host=args.redis_host, port=args.redis_port, db=args.redis_db,
+                                            password=args.redis_password, key_prefix=args.key_prefix,
+                                            channel=f"{args.key_prefix}:updates", verbose=False)
+        if not publisher.redis_client:
+            publisher = None
+    # 先跑一遍预热（模型初始化、CUDA 上下文）
+    model.predict(frames[0], verbose=False, device=args.device)
+    rows: List[Tuple[str, Dict[str, float]]] = []
+    try:
+        for label, cfg in (("全部类别", None), ("过滤后", classes)):
+            rows.append((label, _bench_config(model, frames, cfg, args, publisher)))
+    finally:
+        if publisher:
+            _cleanup(publisher.redis_client, args.key_prefix)
+
+    print(f"\n  {'':<8} {'框/帧':>8} {'推理ms':>8} {'提取ms':>8} {'发布ms':>8} {'载荷KB/帧':>10}")
+    for label, r in rows:
+        publish = f"{r['publish_ms']:8.2f}" if publisher else f"{'-':>8}"
+        print(f"  {label:<8} {r['boxes']:8.1f} {r['predict_ms']:8.2f} {r['extract_ms']:8.2f} {publish} "
+              f"{r['payload_kb']:10.2f}")
+    full, filtered = rows[0][1], rows[1][1]
+    for key, label in (("extract_ms", "提取"), ("publish_ms", "发布"), ("payload_kb", "载荷")):
+        if full[key] > 0 and (publisher or key != "publish_ms"):
+            print(f"  {label}节省 {1.0 - filtered[key] / full[key]:.0%}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='按类别过滤：开销基准测试')
+    parser.add_argument('--redis-host', type=str, default=None, help='(可选) Redis服务器地址，不填则不测发布')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
+    parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p_bench = sub.add_parser('bench', help='对比全部类别 / 过滤后的推理、提取、发布开销')
+    p_bench.add_argument('source', type=str, help='视频文件（建议街景）')
+    p_bench.add_argument('--model', type=str, default='yolov8m.pt', help='模型路径')
+    p_bench.add_argument('--classes', type=str, nargs='+', default=['person'], help='保留的类别（名称或编号）')
+    p_bench.add_argument('--frames', type=int, default=300, help='测试帧数')
+    p_bench.add_argument('--conf', type=float, default=0.5, help='置信度阈值')
+    p_bench.add_argument('--iou', type=float, default=0.85, help='IOU 阈值')
+    p_bench.add_argument('--device', type=str, default='cpu', help='计算设备')
+    p_bench.add_argument('--key-prefix', type=str, default='bench_classes', help='发布测试键前缀')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    bench(args)
+
+
+if __name__ == "__main__":
+    main()
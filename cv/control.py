@@ -0,0 +1,307 @@
+"""
+运行时控制通道：不重启 detect.py 即可调整参数
+
+可调参数：
+- conf / iou     推理阈值（InferenceThread）
+- stride         每 N 帧推理一次，其余帧沿用上次的检测框（InferenceThread）
+- bitrate_k      RTMP 码率，maxrate/bufsize 按比例跟随，编码器随之重启（RtmpStreamer）
+- profile_s      触发一次采样分析，持续 N 秒（profiler.py）；profile_torch=1 时同时跟踪 model.predict
+
+两种入口（可同时开启）：
+- Redis：向频道 detect:control 发布 JSON，如 {"id": "op-1", "conf": 0.4, "stride": 2}
+         确认消息发布到 detect:control:ack，变更记录保存在列表 detect:control:log
+- HTTP： POST http://host:port/control  {"conf": 0.4}     -> 返回受理确认
+         GET  http://host:port/control                    -> 当前参数 + 最近变更记录
+
+每个变更有两次确认：accepted（已校验并受理）和 applied（所有相关线程都已生效，带生效时间）。
+线程在各自循环开头比较 control.version，发现新版本即读取快照并调用 applied()；
+推迟生效的变更（码率在 GOP 边界重启编码器）在真正生效后才确认。
+受理后无法执行的变更（编码器重启失败、已有采样在进行）由 failed() 以 rejected 结束并附原因。
+
+命令行客户端（经 Redis 下发并等待生效确认）：
+    python control.py --redis-host 124.71.162.119 set conf=0.35 stride=2
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional, List, Callable
+
+import redis
+
+CONTROL_CHANNEL = "detect:control"
+ACK_CHANNEL = "detect:control:ack"
+LOG_KEY = "detect:control:log"
+
+# 参数名 -> (类型, 校验, 负责生效的目标)
+FIELDS: Dict[str, tuple] = {
+    "conf": (float, lambda v: 0.0 < v < 1.0, "inference"),
+    "iou": (float, lambda v: 0.0 < v <= 1.0, "inference"),
+    "stride": (int, lambda v: 1 <= v <= 100, "inference"),
+    "bitrate_k": (int, lambda v: 100 <= v <= 20000, "rtmp"),
+    "profile_s": (int, lambda v: 1 <= v <= 600, "profiler"),
+    "profile_torch": (int, lambda v: v in (0, 1), "profiler"),
+}
+# 只能与另一参数一起下发的参数：参数名 -> 依赖的参数
+REQUIRES: Dict[str, str] = {
+    "profile_torch": "profile_s",
+}
+
+
+class PipelineControl:
+    def __init__(self, initial: Dict[str, Any], history_size: int = 200):
+        self.lock = threading.Lock()
+        self.values = dict(initial)
+        self.version = 0
+        self.history: List[Dict[str, Any]] = []
+        self.history_size = history_size
+        # 确认回调（Redis 发布等），签名 fn(ack: dict)
+        self.ack_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def _notify(self, ack: Dict[str, Any]):
+        for fn in self.ack_listeners:
+            try:
+                fn(ack)
+            except Exception as e:
+                print(f"⚠️ 控制确认发送失败: {e}")
+
+    def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """校验并受理一次变更，返回 accepted / rejected 确认"""
+        change_id = str(request.get("id") or uuid.uuid4().hex[:8])
+        changes: Dict[str, Any] = {}
+        errors: List[str] = []
+        for name, raw in request.items():
+            if name == "id":
+                continue
+            if name not in FIELDS:
+                errors.append(f"未知参数 {name}")
+                continue
+            typ, check, _ = FIELDS[name]
+            try:
+                value = typ(raw)
+            except (TypeError, ValueError):
+                errors.append(f"{name} 类型错误: {raw}")
+                continue
+            if not check(value):
+                errors.append(f"{name} 超出范围: {value}")
+                continue
+            changes[name] = value
+        for name, required in REQUIRES.items():
+            if name in changes and required not in changes:
+                errors.append(f"{name} 需要与 {required} 一起下发")
+        now_ms = int(time.time() * 1000)
+        if errors or not changes:
+            ack = {"id": change_id, "status": "rejected", "errors": errors or ["没有可应用的参数"], "at_ms": now_ms}
+            self._notify(ack)
+            return ack
+        with self.lock:
+            self.values.update(changes)
+            self.version += 1
+            entry = {
+                "id": change_id,
+                "version": self.version,
+                "changes": changes,
+                "requested_at_ms": now_ms,
+                "pending": sorted({FIELDS[n][2] for n in changes}),
+                "applied": {},
+                "errors": [],
+                "effective_at_ms": None,
+            }
+            self.history.append(entry)
+            del self.history[:-self.history_size]
+        print(f"🎛️ 收到控制变更 {change_id}: {changes}")
+        ack = {"id": change_id, "status": "accepted", "version": entry["version"], "changes": changes, "at_ms": now_ms}
+        self._notify(ack)
+        return ack
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, dict(self.values)
+
+    def changes_since(self, version: int):
+        """返回 (当前版本, 当前参数, version 之后变更过的参数)；用于一次性命令（如 profile_s）"""
+        with self.lock:
+            changed: Dict[str, Any] = {}
+            for entry in self.history:
+                if entry["version"] > version:
+                    changed.update(entry["changes"])
+            return self.version, dict(self.values), changed
+
+    def applied(self, target: str, version: int):
+        """target 线程已应用到 version（含）为止的所有变更"""
+        now_ms = int(time.time() * 1000)
+        done: List[Dict[str, Any]] = []
+        with self.lock:
+            for entry in self.history:
+                if entry["version"] > version or target not in entry["pending"]:
+                    continue
+                entry["pending"].remove(target)
+                entry["applied"][target] = now_ms
+                # 已有目标失败的变更已经以 rejected 确认过
+                if not entry["pending"] and not entry["errors"]:
+                    entry["effective_at_ms"] = now_ms
+                    done.append(dict(entry))
+        for entry in done:
+            print(f"✅ 控制变更 {entry['id']} 已生效（{entry['effective_at_ms'] - entry['requested_at_ms']} ms）")
+            self._notify({"id": entry["id"], "status": "applied", "version": entry["version"],
+                          "changes": entry["changes"], "applied": entry["applied"],
+                          "requested_at_ms": entry["requested_at_ms"], "at_ms": entry["effective_at_ms"]})
+
+    def failed(self, target: str, version: int, reason: str):
+        """target 无法应用 version（含）为止的变更：这些变更以 rejected 结束并附原因"""
+        now_ms = int(time.time() * 1000)
+        done: List[Dict[str, Any]] = []
+        with self.lock:
+            for entry in self.history:
+                if entry["version"] > version or target not in entry["pending"]:
+                    continue
+                entry["pending"].remove(target)
+                entry["errors"].append(f"{target}: {reason}")
+                done.append(dict(entry))
+        for entry in done:
+            print(f"❌ 控制变更 {entry['id']} 未能生效: {reason}")
+            self._notify({"id": entry["id"], "status": "rejected", "version": entry["version"],
+                          "changes": entry["changes"], "errors": entry["errors"],
+                          "requested_at_ms": entry["requested_at_ms"], "at_ms": now_ms})
+
+    def describe(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"version": self.version, "values": dict(self.values), "history": list(self.history[-20:])}
+
+
+# ========================= Redis 入口 =========================
+class RedisControlListener(threading.Thread):
+    def __init__(self, control: PipelineControl, client: redis.Redis, stop_event: threading.Event,
+                 channel: str = CONTROL_CHANNEL):
+        super().__init__(daemon=True)
+        self.control = control
+        self.client = client
+        self.stop_event = stop_event
+        self.channel = channel
+        control.ack_listeners.append(self._publish_ack)
+
+    def _publish_ack(self, ack: Dict[str, Any]):
+        payload = json.dumps(ack, ensure_ascii=False)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.publish(ACK_CHANNEL, payload)
+        pipe.lpush(LOG_KEY, payload)
+        pipe.ltrim(LOG_KEY, 0, 499)
+        pipe.execute()
+
+    def run(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        print(f"🎛️ 控制通道已订阅: {self.channel}")
+        while not self.stop_event.is_set():
+            try:
+                message = pubsub.get_message(timeout=0.5)
+            except redis.ConnectionError as e:
+                print(f"⚠️ 控制通道连接异常: {e}")
+                time.sleep(1.0)
+                continue
+            if not message:
+                continue
+            try:
+                request = json.loads(message["data"])
+                if not isinstance(request, dict):
+                    raise ValueError("需要 JSON 对象")
+            except ValueError as e:
+                self.control._notify({"status": "rejected", "errors": [f"无法解析: {e}"],
+                                      "at_ms": int(time.time() * 1000)})
+                continue
+            self.control.submit(request)
+        pubsub.close()
+
+
+# ========================= HTTP 入口 =========================
+def start_http_control(control: PipelineControl, host: str, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code: int, body: Dict[str, Any]):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/control":
+                return self._reply(404, {"error": "not found"})
+            self._reply(200, control.describe())
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/control":
+                return self._reply(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("需要 JSON 对象")
+            except ValueError as e:
+                return self._reply(400, {"status": "rejected", "errors": [f"无法解析: {e}"]})
+            ack = control.submit(request)
+            self._reply(200 if ack["status"] == "accepted" else 400, ack)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🎛️ 控制接口: http://{host}:{port}/control")
+    return server
+
+
+# ========================= 命令行客户端 =========================
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='经 Redis 下发运行时参数并等待确认')
+    parser.add_argument('--redis-host', type=str, default='124.71.162.119', help='Redis服务器地址')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
+    parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    parser.add_argument('--timeout', type=float, default=10.0, help='等待生效确认的秒数')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_set = sub.add_parser('set', help='下发参数，如 conf=0.4 stride=2')
+    p_set.add_argument('pairs', nargs='+', help='name=value')
+    sub.add_parser('log', help='查看最近的变更记录')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    pwd = None if (args.redis_password in ("", "None", None)) else args.redis_password
+    client = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db, password=pwd,
+                         decode_responses=True, socket_timeout=5)
+    if args.cmd == 'log':
+        for payload in client.lrange(LOG_KEY, 0, 19):
+            print(payload)
+        return
+
+    request: Dict[str, Any] = {"id": uuid.uuid4().hex[:8]}
+    for pair in args.pairs:
+        name, _, value = pair.partition("=")
+        request[name] = value
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(ACK_CHANNEL)
+    receivers = client.publish(CONTROL_CHANNEL, json.dumps(request))
+    if not receivers:
+        print("⚠️ 没有 detect.py 在监听控制通道")
+        return
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        message = pubsub.get_message(timeout=0.5)
+        if not message:
+            continue
+        ack = json.loads(message["data"])
+        if ack.get("id") != request["id"]:
+            continue
+        print(f"📨 {ack['status']}: {ack}")
+        if ack["status"] in ("applied", "rejected"):
+            return
+    print("⚠️ 等待生效确认超时")
+
+
+if __name__ == "__main__":
+    main()
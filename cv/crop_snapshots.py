@@ -0,0 +1,259 @@
+"""
+检测目标截图（JPEG）：线程池编码 + 稳定目标去重 + 按字节预算 LRU 淘汰
+
+主线程调用 CropSnapshotter.submit(frame, detections)：
+- 与上一轮的截图目标按 IoU 匹配，同一目标在 refresh_s 秒内沿用已有截图，不重复编码
+- 需要新截图的目标：在主线程里拷贝出裁剪区域（原始帧随后会归还缓冲区池），
+  cv2.imencode 放到线程池执行（编码期间释放 GIL，不阻塞主循环）
+- 排队中的编码超过 max_pending 时跳过本轮新截图（该目标不带截图，下一帧再试）
+- 每条检测写入 crop_key 字段，随检测记录发布（RedisDetectionPublisher 的 extra_fields），
+  consumer 按键名读取；截图在编码完成后才写入，刚发布的记录可能短暂读不到
+
+存储：
+- redis  SET crop:{ts}:{i} <jpeg>（带 TTL），键名即 crop_key
+- disk   crop_dir/{ts}_{i}.jpg，crop_key 为文件名
+两者都按写入/被引用的先后维护 LRU，总字节超过预算时删除最久未引用的截图。
+disk 启动时按修改时间把目录里已有的截图登记进 LRU，并先淘汰到预算以内，重启不会让目录无限增长。
+"""
+
+import os
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List
+
+import cv2
+import numpy as np
+import redis
+
+from delta_publish import iou_matrix, greedy_match, to_xyxy
+
+CROP_PREFIX = "crop"
+
+
+class _LruStore(ABC):
+    """按字节预算的 LRU 账本；子类实现实际的写入 / 删除"""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+
+    @abstractmethod
+    def make_key(self, ts_ms: int, idx: int) -> str:
+        """第 idx 个目标截图的键名（即 crop_key）"""
+
+    @abstractmethod
+    def _write(self, key: str, data: bytes):
+        """写入一张截图"""
+
+    @abstractmethod
+    def _delete(self, keys: List[str]):
+        """删除被淘汰的截图"""
+
+    def _evict_locked(self, keep: int) -> List[str]:
+        """调用方持有 lock；从最久未引用的一端淘汰到预算以内（至少保留 keep 条）"""
+        victims: List[str] = []
+        while self.total_bytes > self.budget_bytes and len(self.entries) > keep:
+            old_key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            victims.append(old_key)
+        self.evicted += len(victims)
+        return victims
+
+    def put(self, key: str, data: bytes):
+        self._write(key, data)
+        with self.lock:
+            self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            victims = self._evict_locked(keep=1)
+        if victims:
+            self._delete(victims)
+
+    def touch(self, key: str):
+        """截图被新的检测记录再次引用"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+
+    def usage(self) -> Dict[str, int]:
+        with self.lock:
+            return {"crops": len(self.entries), "bytes": self.total_bytes, "evicted": self.evicted}
+
+
+class RedisCropStore(_LruStore):
+    def __init__(self, client: redis.Redis, budget_bytes: int, prefix: str = CROP_PREFIX, ttl_s: int = 3600):
+        super().__init__(budget_bytes)
+        self.client = client
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+
+    def make_key(self, ts_ms: int, idx: int) -> str:
+        return f"{self.prefix}:{ts_ms}:{idx}"
+
+    def _write(self, key: str, data: bytes):
+        self.client.set(key, data, ex=self.ttl_s)
+
+    def _delete(self, keys: List[str]):
+        self.client.unlink(*keys)
+
+
+class DiskCropStore(_LruStore):
+    def __init__(self, crop_dir: str, budget_bytes: int):
+        super().__init__(budget_bytes)
+        self.crop_dir = crop_dir
+        os.makedirs(crop_dir, exist_ok=True)
+        self._seed()
+
+    def _seed(self):
+        """重启后沿用目录里已有的截图：按修改时间先后登记到账本，超出预算的立即删除"""
+        existing = []
+        for entry in os.scandir(self.crop_dir):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # 上次退出时没写完的临时文件
+                self._delete([entry.name])
+                continue
+            if entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name, stat.st_size))
+        if not existing:
+            return
+        existing.sort()
+        with self.lock:
+            for _, name, size in existing:
+                self.entries[name] = size
+                self.total_bytes += size
+            victims = self._evict_locked(keep=0)
+        if victims:
+            self._delete(victims)
+        print(f"🗂️ 截图目录已有 {len(existing)} 张，淘汰 {len(victims)} 张，"
+              f"沿用 {len(self.entries)} 张 / {self.total_bytes / 1024 / 1024:.1f} MB")
+
+    def make_key(self, ts_ms: int, idx: int) -> str:
+        return f"{ts_ms}_{idx}.jpg"
+
+    def _write(self, key: str, data: bytes):
+        # 先写临时文件再改名，读取方不会看到写了一半的图片
+        path = os.path.join(self.crop_dir, key)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def _delete(self, keys: List[str]):
+        for key in keys:
+            try:
+                os.remove(os.path.join(self.crop_dir, key))
+            except OSError:
+                pass
+
+
+class CropSnapshotter:
+    def __init__(self, store, workers: int = 2, match_iou: float = 0.6, refresh_s: float = 10.0,
+                 jpeg_quality: int = 80, pad: float = 0.1, min_size: int = 16, max_pending: int = 64,
+                 track_ttl_s: float = 2.0):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crop")
+        self.match_iou = match_iou
+        self.refresh_s = refresh_s
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+        self.pad = pad
+        self.min_size = min_size
+        self.max_pending = max_pending
+        self.track_ttl_s = track_ttl_s
+        # 已有截图的目标：最近一次的检测框、截图键、截图时间、最近一次出现时间
+        self.tracks: List[Dict[str, Any]] = []
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.stats = {"encoded": 0, "reused": 0, "skipped": 0, "failed": 0, "bytes": 0, "encode_ms": 0.0}
+
+    def _crop(self, frame: np.ndarray, det: Dict[str, Any]) -> Optional[np.ndarray]:
+        h, w = frame.shape[:2]
+        bw, bh = float(det["width"]) * (1 + 2 * self.pad), float(det["height"]) * (1 + 2 * self.pad)
+        x1 = max(int(det["center_x"] - bw / 2), 0)
+        y1 = max(int(det["center_y"] - bh / 2), 0)
+        x2 = min(int(det["center_x"] + bw / 2), w)
+        y2 = min(int(det["center_y"] + bh / 2), h)
+        if x2 - x1 < self.min_size or y2 - y1 < self.min_size:
+            return None
+        # 拷贝出来：原始帧在主循环结束后会被复用
+        return frame[y1:y2, x1:x2].copy()
+
+    def _encode(self, key: str, crop: np.ndarray):
+        try:
+            t0 = time.perf_counter()
+            ok, buf = cv2.imencode(".jpg", crop, self.encode_params)
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+            if not ok:
+                raise RuntimeError("imencode 失败")
+            data = buf.tobytes()
+            self.store.put(key, data)
+            with self.lock:
+                self.stats["encoded"] += 1
+                self.stats["bytes"] += len(data)
+                self.stats["encode_ms"] += elapsed_ms
+        except Exception as e:
+            with self.lock:
+                self.stats["failed"] += 1
+            print(f"⚠️ 截图保存失败 {key}: {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def submit(self, frame: np.ndarray, detections: List[Dict[str, Any]], now: Optional[float] = None):
+        """为每条检测补上 crop_key（无截图时不加该字段）"""
+        now = time.time() if now is None else now
+        self.tracks = [t for t in self.tracks if now - t["seen"] <= self.track_ttl_s]
+        iou = iou_matrix(to_xyxy(detections), to_xyxy([t["det"] for t in self.tracks]))
+        pairs = greedy_match(iou, self.match_iou)
+        matched = {r: self.tracks[c] for r, c, _ in pairs}
+        ts_ms = int(now * 1000)
+        for idx, det in enumerate(detections):
+            track = matched.get(idx)
+            if track is not None:
+                track["det"] = det
+                track["seen"] = now
+                if now - track["encoded_at"] < self.refresh_s:
+                    det["crop_key"] = track["key"]
+                    self.store.touch(track["key"])
+                    self.stats["reused"] += 1
+                    continue
+            with self.lock:
+                busy = self.pending >= self.max_pending
+                if not busy:
+                    self.pending += 1
+            if busy:
+                self.stats["skipped"] += 1
+                if track is not None:
+                    # 编码排不上队时先沿用旧截图
+                    det["crop_key"] = track["key"]
+                continue
+            crop = self._crop(frame, det)
+            if crop is None:
+                with self.lock:
+                    self.pending -= 1
+                continue
+            key = self.store.make_key(ts_ms, idx)
+            self.executor.submit(self._encode, key, crop)
+            det["crop_key"] = key
+            if track is None:
+                self.tracks.append({"det": det, "key": key, "encoded_at": now, "seen": now})
+            else:
+                track["key"], track["encoded_at"] = key, now
+
+    def summary(self) -> str:
+        with self.lock:
+            s = dict(self.stats)
+        usage = self.store.usage()
+        avg_ms = s["encode_ms"] / s["encoded"] if s["encoded"] else 0.0
+        return (f"编码 {s['encoded']}（平均 {avg_ms:.1f} ms），复用 {s['reused']}，跳过 {s['skipped']}，"
+                f"失败 {s['failed']}；当前 {usage['crops']} 张 / {usage['bytes'] / 1024 / 1024:.1f} MB，"
+                f"淘汰 {usage['evicted']}")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,241 @@
+"""
+增量发布：场景不变时不重复写 Redis
+
+静止人群每帧检测框几乎一样，全量发布会把同样的框反复写入。DeltaEncoder 把当前帧与
+“上次发布的集合”做 IoU 匹配，只输出变化：
+- add     新出现的目标（未匹配到已发布的框）
+- move    匹配上但 IoU < move_iou（位移/尺寸变化明显），发布新位置
+- remove  已发布的目标在当前帧没有匹配
+- key     关键帧：每 keyframe_s 秒发布一次完整集合，供中途加入的订阅端同步
+
+匹配上且 IoU ≥ move_iou 的目标不发布，已发布集合中保留旧框；缓慢漂移累计到阈值后才会发一次 move。
+每条记录沿用 redis_publisher 的哈希格式，另加 op 与 obj_id 字段。
+
+增量记录写入独立的命名空间（见 delta_publisher）：
+    哈希键 image_metadata_delta:{ts}，频道 image:metadata:updates:delta
+默认键名/频道照常发布每帧完整检测：Java 端 RedisMessageSubscriber 把每条记录计为一人，
+增量记录混进去会算错人数。新的消费者订阅增量频道，读取量随场景变化而不是随帧率增长。
+此时 Redis 写入量是完整 + 增量，比只发完整还多；没有旧消费者时用 detect.py --delta-only
+停发完整检测，写入量才真正下降。summary(full_published=True) 按实际写入量汇总。
+
+订阅端用 DeltaDecoder 还原完整集合（sub.py --delta）：
+出现 key 记录时以关键帧重建状态，再依次应用 add / move / remove。
+
+离线评估（在 detect.py --log-dir 录下的任务日志上统计写入量与还原误差）：
+    python delta_publish.py eval logs/mission_20250308_135111 --move-iou 0.9 0.8 0.7
+"""
+
+import argparse
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+
+from redis_publisher import KEY_PREFIX, UPDATES_CHANNEL, RedisDetectionPublisher, detection_record
+
+DELTA_FIELDS = ("op", "obj_id")
+DELTA_SUFFIX = "delta"
+DELTA_CHANNEL = f"{UPDATES_CHANNEL}:{DELTA_SUFFIX}"
+
+
+def delta_publisher(full: RedisDetectionPublisher) -> Optional[RedisDetectionPublisher]:
+    """与完整发布端共用连接，键名加 _delta、频道加 :delta，记录附带 op / obj_id；完整发布端未连上时返回 None"""
+    if full.redis_client is None:
+        return None
+    return RedisDetectionPublisher(
+        key_prefix=f"{full.key_prefix}_{DELTA_SUFFIX}", channel=f"{full.channel}:{DELTA_SUFFIX}",
+        ttl_s=full.ttl_s, verbose=full.verbose, extra_fields=full.extra_fields + DELTA_FIELDS,
+        client=full.redis_client
+    )
+
+
+def to_xyxy(dets: List[Dict[str, Any]]) -> np.ndarray:
+    if not dets:
+        return np.zeros((0, 4), dtype=np.float32)
+    cwh = np.array([[float(d["center_x"]), float(d["center_y"]), float(d["width"]), float(d["height"])]
+                    for d in dets], dtype=np.float32)
+    half = cwh[:, 2:] / 2.0
+    return np.concatenate([cwh[:, :2] - half, cwh[:, :2] + half], axis=1)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a: (N,4) b: (M,4) xyxy -> (N,M)"""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def greedy_match(iou: np.ndarray, threshold: float) -> List[Tuple[int, int, float]]:
+    """按 IoU 从大到小贪心一对一匹配，返回 [(行, 列, IoU)]"""
+    if iou.size == 0:
+        return []
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    used_r, used_c = set(), set()
+    pairs = []
+    for k in order:
+        r, c = int(rows[k]), int(cols[k])
+        if r in used_r or c in used_c:
+            continue
+        used_r.add(r)
+        used_c.add(c)
+        pairs.append((r, c, float(iou[r, c])))
+    return pairs
+
+
+def payload_bytes(record: Dict[str, Any], key_prefix: str = KEY_PREFIX, channel: str = UPDATES_CHANNEL) -> int:
+    """一条记录写入 Redis 的大致字节数：HSET 字段 + EXPIRE/ZADD/PUBLISH 中的键名与频道"""
+    key_len = len(key_prefix) + 1 + len(str(record["timestamp"]))
+    fields = sum(len(k) + len(str(v)) for k, v in record.items())
+    return fields + key_len * 4 + len(channel)
+
+
+class DeltaEncoder:
+    def __init__(self, iou_match: float = 0.3, move_iou: float = 0.8, keyframe_s: float = 5.0):
+        self.iou_match = iou_match
+        self.move_iou = move_iou
+        self.keyframe_s = keyframe_s
+        # obj_id -> 最近一次发布的检测
+        self.published: Dict[int, Dict[str, Any]] = {}
+        self.next_id = 0
+        self.last_keyframe: Optional[float] = None
+        self.stats = {"frames": 0, "keyframes": 0, "add": 0, "move": 0, "remove": 0,
+                      "full_records": 0, "delta_records": 0, "full_bytes": 0, "delta_bytes": 0}
+
+    def encode(self, detections: List[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """返回本帧需要发布的记录（检测字段 + op + obj_id），无变化时为空列表"""
+        now = time.time() if now is None else now
+        keyframe = self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_s
+        prev_ids = list(self.published)
+        iou = iou_matrix(to_xyxy(detections), to_xyxy([self.published[i] for i in prev_ids]))
+        pairs = greedy_match(iou, self.iou_match)
+
+        records: List[Dict[str, Any]] = []
+        matched_cur, matched_prev = set(), set()
+        for r, c, score in pairs:
+            matched_cur.add(r)
+            matched_prev.add(c)
+            obj_id = prev_ids[c]
+            # 关键帧补发完整集合（包括未变化的目标）
+            if keyframe or score < self.move_iou:
+                self.published[obj_id] = detections[r]
+                records.append(dict(detections[r], op="key" if keyframe else "move", obj_id=obj_id))
+        for r, det in enumerate(detections):
+            if r in matched_cur:
+                continue
+            obj_id = self.next_id
+            self.next_id += 1
+            self.published[obj_id] = det
+            records.append(dict(det, op="key" if keyframe else "add", obj_id=obj_id))
+        for c, obj_id in enumerate(prev_ids):
+            if c not in matched_prev:
+                records.append(dict(self.published.pop(obj_id), op="remove", obj_id=obj_id))
+        if keyframe:
+            self.last_keyframe = now
+            self.stats["keyframes"] += 1
+
+        self.stats["frames"] += 1
+        for rec in records:
+            if rec["op"] in ("add", "move", "remove"):
+                self.stats[rec["op"]] += 1
+        ts = int(now * 1000)
+        self.stats["full_records"] += len(detections)
+        self.stats["delta_records"] += len(records)
+        self.stats["full_bytes"] += sum(payload_bytes(detection_record(d, ts, ts)) for d in detections)
+        self.stats["delta_bytes"] += sum(payload_bytes(detection_record(r, ts, ts, DELTA_FIELDS)) for r in records)
+        return records
+
+    def summary(self, full_published: bool = False) -> str:
+        """full_published：完整检测也照常发布（写入量为两者之和），否则按只发增量统计"""
+        s = self.stats
+        if full_published:
+            records = s["full_records"] + s["delta_records"]
+            nbytes = s["full_bytes"] + s["delta_bytes"]
+            extra = records / s["full_records"] - 1.0 if s["full_records"] else 0.0
+            return (f"完整 + 增量共写入 {records} 条 / {nbytes / 1024:.0f} KB（比只发完整多 {extra:.0%}；"
+                    f"增量 {s['delta_records']} 条），关键帧 {s['keyframes']}，"
+                    f"add/move/remove {s['add']}/{s['move']}/{s['remove']}")
+        saved_records = 1.0 - s["delta_records"] / s["full_records"] if s["full_records"] else 0.0
+        saved_bytes = 1.0 - s["delta_bytes"] / s["full_bytes"] if s["full_bytes"] else 0.0
+        return (f"记录 {s['full_records']} -> {s['delta_records']}（减少 {saved_records:.0%}），"
+                f"字节 {s['full_bytes'] / 1024:.0f} KB -> {s['delta_bytes'] / 1024:.0f} KB（减少 {saved_bytes:.0%}），"
+                f"关键帧 {s['keyframes']}，add/move/remove {s['add']}/{s['move']}/{s['remove']}")
+
+
+class DeltaDecoder:
+    """订阅端：由增量记录还原完整集合；记录字段可以是 Redis 读回的字符串"""
+
+    def __init__(self):
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        # 收到第一个关键帧之前，集合只包含加入后才出现的变化
+        self.synced = False
+
+    def apply(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if any(r.get("op") == "key" for r in records):
+            self.objects = {}
+            self.synced = True
+        for r in records:
+            op = r.get("op")
+            obj_id = str(r.get("obj_id"))
+            if op == "remove":
+                self.objects.pop(obj_id, None)
+            elif op in ("key", "add", "move"):
+                self.objects[obj_id] = r
+        return list(self.objects.values())
+
+
+# ========================= 离线评估 =========================
+def evaluate(frames, iou_match: float, move_iou: float, keyframe_s: float) -> Tuple[DeltaEncoder, Dict[str, float]]:
+    """frames: replay.log_frames 产生的 (dt, 检测列表)；同时检查还原结果与真实检测的偏差"""
+    encoder = DeltaEncoder(iou_match, move_iou, keyframe_s)
+    decoder = DeltaDecoder()
+    now = 0.0
+    ious: List[float] = []
+    count_errors = 0
+    for dt, detections in frames:
+        now += dt
+        decoded = decoder.apply(encoder.encode(detections, now))
+        if len(decoded) != len(detections):
+            count_errors += 1
+        pairs = greedy_match(iou_matrix(to_xyxy(detections), to_xyxy(decoded)), 0.0)
+        ious.extend(score for _, _, score in pairs)
+    quality = {
+        "mean_iou": float(np.mean(ious)) if ious else 1.0,
+        "p5_iou": float(np.percentile(ious, 5)) if ious else 1.0,
+        "count_errors": count_errors,
+    }
+    return encoder, quality
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='增量发布：离线评估')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_eval = sub.add_parser('eval', help='在任务检测日志上统计写入量与还原误差')
+    p_eval.add_argument('mission_dir', type=str, nargs='+', help='任务目录（可多个）')
+    p_eval.add_argument('--iou-match', type=float, default=0.3, help='视为同一目标的最小 IoU')
+    p_eval.add_argument('--move-iou', type=float, nargs='+', default=[0.8], help='低于该 IoU 才发布 move，可给多个值对比')
+    p_eval.add_argument('--keyframe-s', type=float, default=5.0, help='关键帧间隔（秒）')
+    return parser.parse_args()
+
+
+def main():
+    from replay import log_frames
+
+    args = parse_arguments()
+    for mission_dir in args.mission_dir:
+        print(f"📁 {mission_dir}")
+        for move_iou in args.move_iou:
+            t0 = time.perf_counter()
+            encoder, quality = evaluate(log_frames(mission_dir), args.iou_match, move_iou, args.keyframe_s)
+            elapsed = time.perf_counter() - t0
+            print(f"  move_iou={move_iou:.2f}: {encoder.summary()}")
+            print(f"    还原: 平均 IoU {quality['mean_iou']:.3f}，p5 {quality['p5_iou']:.3f}，"
+                  f"数量不一致 {quality['count_errors']} 帧；编码 {encoder.stats['frames'] / elapsed:.0f} 帧/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,66 +2,31 @@ import os
 os.environ['TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD'] = '1'
 
 import argparse
+import functools
+import signal
 import cv2
 import torch
-import redis
 import time
 import json
 import subprocess
 import threading
 import queue
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
+import numpy as np
 from ultralytics import YOLO
 
-# ========================= Redis 发布 =========================
-class RedisDetectionPublisher:
-    def __init__(self, host: str = '124.71.162.119', port: int = 6379, db: int = 0, password: Optional[str] = None):
-        pwd = None if (password in ("", "None", None)) else password
-        self.redis_client = redis.Redis(
-            host=host, port=port, db=db, password=pwd,
-            decode_responses=True, socket_timeout=5, retry_on_timeout=True
-        )
-        try:
-            self.redis_client.ping()
-            print(f"✅ Redis连接成功: {host}:{port}（{'无密码' if pwd is None else '使用密码'}）")
-        except redis.ConnectionError as e:
-            print(f"❌ Redis连接失败: {host}:{port}，错误：{e}")
-            self.redis_client = None
-
-    def publish_detection_metadata(self, detections_data: List[Dict[str, Any]]) -> bool:
-        if not self.redis_client or not detections_data:
-            return False
-        try:
-            base_ts_ms = int(time.time() * 1000)
-            for idx, det in enumerate(detections_data):
-                ts_ms = base_ts_ms + idx
-                key = f"image_metadata:{ts_ms}"
-                data = {
-                    "timestamp": ts_ms,
-                    "center_x": float(det["center_x"]),
-                    "center_y": float(det["center_y"]),
-                    "width": float(det["width"]),
-                    "height": float(det["height"]),
-                    "confidence": round(float(det["confidence"]) * 100.0, 2),
-                }
-                self.redis_client.hset(key, mapping=data)
-                self.redis_client.expire(key, 3600)
-                self.redis_client.publish("image:metadata:updates", key)
-            print(f"📤 已写入 Redis Hash {len(detections_data)} 个: image:metadata:updates")
-            return True
-        except Exception as e:
-            print(f"❌ Redis发布失败: {e}")
-            return False
-
-    def get_detection_stats(self) -> Dict[str, int]:
-        if not self.redis_client:
-            return {}
-        try:
-            keys = self.redis_client.keys("image:metadata:")
-            return {"total_image:metadata:updates": len(keys)}
-        except Exception as e:
-            print(f"获取统计信息失败: {e}")
-            return {}
+from detection_log import DetectionLogWriter
+from redis_publisher import RedisDetectionPublisher, KEY_PREFIX, UPDATES_CHANNEL
+from ffmpeg_capture import FfmpegCaptureThread, parse_size
+from frame_pool import FramePool
+from mem_report import MemoryReporter
+from control import PipelineControl, RedisControlListener, start_http_control
+from rtmp_abr import AbrController, ProgressReader
+from delta_publish import DeltaEncoder, delta_publisher
+from heatmap import DensityHeatmap, HeatmapPublisher, HEATMAP_KEY, HEATMAP_CHANNEL
+from profiler import SamplingProfiler
+from crop_snapshots import CropSnapshotter, RedisCropStore, DiskCropStore, CROP_PREFIX
+from class_routing import ClassRouter, resolve_classes, parse_class_routes, DEFAULT_ROUTE
 
 # ========================= RTMP 推流（yuv420p 修复） =========================
 class RtmpStreamer:
@@ -71,15 +36,64 @@ class RtmpStreamer:
     BITRATE_K = 2300
     MAXRATE_K = 2500
     BUFSIZE_K = 5000
-    # 若需更省带宽：
-    # TARGET_W, TARGET_H = 960, 540
-    # BITRATE_K, MAXRATE_K, BUFSIZE_K = 1600, 1800, 3600
+    # 更省带宽的档位见 rtmp_abr.DEFAULT_LADDER（--abr 时按链路状况自动切换）
 
-    def __init__(self, rtmp_url: str = 'rtmp://124.71.162.119:1936/hls/stream'):####rtmp://124.71.162.119:1936/hls/stream  rtmp://124.71.162.119:1935/live/stream
+    DEFAULT_URL = 'rtmp://124.71.162.119:1936/hls/stream'####rtmp://124.71.162.119:1936/hls/stream  rtmp://124.71.162.119:1935/live/stream
+    # 录像模式下 RTMP 输出失败后，间隔多少秒重启编码器重连
+    RTMP_RETRY_S = 30
+
+    def __init__(self, rtmp_url: Optional[str] = DEFAULT_URL, abr: Optional[AbrController] = None,
+                 record_dir: Optional[str] = None, segment_s: int = 60, record_format: str = "mp4"):
+        """rtmp_url 为 None 时只录像（需要 record_dir）"""
         self.rtmp_url = rtmp_url
         self.proc: Optional[subprocess.Popen] = None
         self.started = False
         self.restart_attempted = False
+        # 推流缩放复用同一块缓冲区
+        self.resize_buf: Optional[np.ndarray] = None
+        # 自适应码率：读取 ffmpeg -progress，切档推迟到 GOP 边界执行
+        self.abr = abr
+        self.progress: Optional[ProgressReader] = None
+        self.frames_written = 0
+        self.pending_rung: Optional[int] = None
+        # 控制通道下发的码率，同样推迟到 GOP 边界重启编码器；重启后逐个回调 fn(error)，error 为 None 表示已生效
+        self.pending_bitrate_k: Optional[int] = None
+        self.bitrate_callbacks: List[Callable[[Optional[str]], None]] = []
+        # 本地分段录像：同一次 libx264 编码经 tee 复用到 RTMP 和本地分段文件
+        self.record_dir = record_dir
+        self.segment_s = segment_s
+        self.record_format = record_format
+        self.rtmp_failed_at: Optional[float] = None
+
+    def _output_args(self) -> List[str]:
+        if not self.record_dir:
+            return ["-f", "flv", self.rtmp_url]
+        os.makedirs(self.record_dir, exist_ok=True)
+        pattern = os.path.join(self.record_dir, f"rec_%Y%m%d_%H%M%S.{self.record_format}")
+        # 录像排在第一个：结束时 tee 按顺序写各输出的收尾，RTMP 卡住也不影响最后一个分段写完整
+        slaves = [f"[f=segment:segment_time={self.segment_s}:segment_format={self.record_format}:"
+                  f"reset_timestamps=1:strftime=1]{pattern}"]
+        if self.rtmp_url:
+            # tee 同步写各输出：对端不读但连接不断时 onfail=ignore 不会触发，会拖住录像和 stdin。
+            # use_fifo 让 RTMP 在独立线程里写，队列满时丢包；断开后由 fifo 自行重连，录像不受影响
+            slaves.append(f"[f=flv:onfail=ignore:use_fifo=1:"
+                          f"fifo_options=drop_pkts_on_overflow=1\\:attempt_recovery=1]{self.rtmp_url}")
+        return ["-flags", "+global_header", "-map", "0:v", "-f", "tee", "|".join(slaves)]
+
+    def _watch_stderr(self, stream):
+        """转发 ffmpeg 错误输出；tee 报告 RTMP 输出（#0）失败时记下时间，由 write() 择机重连"""
+        for raw in iter(stream.readline, b""):
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            print(f"[ffmpeg] {line}")
+            if self.rtmp_url and "Slave muxer #1 failed" in line:
+                self.rtmp_failed_at = time.time()
+                print(f"⚠️ RTMP 输出失败，录像继续，{self.RTMP_RETRY_S}s 后重连")
+
+    @property
+    def rtmp_state(self) -> str:
+        if not self.rtmp_url or not self.started:
+            return "OFF"
+        return "RETRY" if self.rtmp_failed_at else "ON"
 
     def start(self):
         if self.started:
@@ -87,6 +101,10 @@ class RtmpStreamer:
         cmd = [
             "ffmpeg",
             "-loglevel", "error",
+        ]
+        if self.abr:
+            cmd += ["-nostats", "-progress", "pipe:1", "-stats_period", "1"]
+        cmd += [
             "-f", "rawvideo",
             "-pix_fmt", "bgr24",
             "-s", f"{self.TARGET_W}x{self.TARGET_H}",
@@ -105,13 +123,23 @@ class RtmpStreamer:
             "-maxrate", f"{self.MAXRATE_K}k",
             "-bufsize", f"{self.BUFSIZE_K}k",
             "-an",
-            "-f", "flv",
-            self.rtmp_url
-        ]
+        ] + self._output_args()
+        # 同时推流和录像时才需要监视 stderr 中的 tee 失败信息
+        watch = bool(self.record_dir and self.rtmp_url)
         try:
-            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE if self.abr else None,
+                                         stderr=subprocess.PIPE if watch else None)
             self.started = True
-            print(f"📺 RTMP 推流开始: {self.rtmp_url} {self.TARGET_W}x{self.TARGET_H}@{self.FPS} "
+            self.frames_written = 0
+            self.rtmp_failed_at = None
+            if self.abr:
+                self.progress = ProgressReader(self.proc.stdout, lambda: self.frames_written)
+                self.progress.start()
+            if watch:
+                threading.Thread(target=self._watch_stderr, args=(self.proc.stderr,), daemon=True).start()
+            targets = [t for t in (self.rtmp_url, self.record_dir and f"录像 {self.record_dir}") if t]
+            print(f"📺 RTMP 推流开始: {' + '.join(targets)} {self.TARGET_W}x{self.TARGET_H}@{self.FPS} "
                   f"{self.BITRATE_K}k(max {self.MAXRATE_K}k)")
         except Exception as e:
             self.proc = None
@@ -128,75 +156,179 @@ class RtmpStreamer:
             if not self.restart_attempted:
                 print("⚠️ 推流进程已退出，尝试重启...")
                 self.restart_attempted = True
-                self.close()
-                self.start()
+                self._restart()
             return
         try:
             if frame.shape[1] != self.TARGET_W or frame.shape[0] != self.TARGET_H:
-                frame = cv2.resize(frame, (self.TARGET_W, self.TARGET_H))
-            self.proc.stdin.write(frame.tobytes())
+                if self.resize_buf is None or self.resize_buf.shape[:2] != (self.TARGET_H, self.TARGET_W):
+                    self.resize_buf = np.empty((self.TARGET_H, self.TARGET_W, 3), dtype=np.uint8)
+                frame = cv2.resize(frame, (self.TARGET_W, self.TARGET_H), dst=self.resize_buf)
+            t0 = time.perf_counter()
+            # 直接写数组内存，省去 tobytes() 的整帧拷贝
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+            self.frames_written += 1
         except (BrokenPipeError, OSError) as e:
             print(f"⚠️ 推流中断: {e}")
             self.close()
+            return
+        gop_boundary = self.frames_written % (self.FPS * 2) == 0
+        if self.rtmp_failed_at and gop_boundary and time.time() - self.rtmp_failed_at >= self.RTMP_RETRY_S:
+            # 重启编码器重连 RTMP；录像从新的分段文件继续
+            print("🔁 尝试重连 RTMP...")
+            self._restart()
+            return
+        if self.pending_bitrate_k is not None and gop_boundary:
+            self._apply_bitrate(self.pending_bitrate_k)
+            return
+        if self.abr:
+            self.abr.on_write(time.perf_counter() - t0)
+            self.abr.on_progress(self.frames_written, self.progress.snapshot())
+            rung = self.abr.evaluate()
+            if rung is not None:
+                self.pending_rung = rung
+            # 固定 GOP（-g / -keyint_min / -sc_threshold 0），已写帧数整除 GOP 时正好处在关键帧边界
+            if self.pending_rung is not None and gop_boundary:
+                self._switch_rung(self.pending_rung)
+
+    def _switch_rung(self, rung: int):
+        w, h, bitrate_k, maxrate_k, bufsize_k = self.abr.ladder[rung]
+        print(f"🔀 推流切档 {self.abr.rung} -> {rung}: {w}x{h} {bitrate_k}k")
+        self.TARGET_W, self.TARGET_H = w, h
+        self.BITRATE_K, self.MAXRATE_K, self.BUFSIZE_K = bitrate_k, maxrate_k, bufsize_k
+        self.abr.switched(rung)
+        self.pending_rung = None
+        self._restart()
+
+    def report(self):
+        if self.abr:
+            print(f"  自适应推流[{self.rtmp_url}]: {self.abr.metrics()}")
+
+    def set_bitrate(self, bitrate_k: int, on_applied: Optional[Callable[[Optional[str]], None]] = None):
+        """
+        运行时调整码率（maxrate/bufsize 按默认比例跟随）；推流中时在下一个 GOP 边界重启编码器生效。
+        on_applied(error) 在真正生效（或重启失败）时调用，被新码率覆盖的请求随新码率一起确认
+        """
+        if on_applied:
+            self.bitrate_callbacks.append(on_applied)
+        if self.started:
+            self.pending_bitrate_k = bitrate_k
+        else:
+            self._apply_bitrate(bitrate_k)
+
+    def _apply_bitrate(self, bitrate_k: int):
+        self.pending_bitrate_k = None
+        self.BITRATE_K = bitrate_k
+        self.MAXRATE_K = int(bitrate_k * RtmpStreamer.MAXRATE_K / RtmpStreamer.BITRATE_K)
+        self.BUFSIZE_K = self.MAXRATE_K * 2
+        error = None
+        if self.started:
+            print(f"🎚️ 推流码率调整为 {bitrate_k}k")
+            self._restart()
+            if not self.started:
+                error = f"编码器以 {bitrate_k}k 重启失败"
+        callbacks, self.bitrate_callbacks = self.bitrate_callbacks, []
+        for fn in callbacks:
+            fn(error)
+
+    def _restart(self):
+        """旧进程在后台收尾（RTMP 卡住时可能要等满超时），新编码器立即启动，主循环不被阻塞"""
+        self.close(background=True)
+        self.start()
+
+    def _reap(self, proc: subprocess.Popen):
+        try:
+            if self.record_dir:
+                # 录像时等 ffmpeg 读到 EOF 自行退出，保证最后一个分段写完整（mp4 的 moov）
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    pass
+            if proc.poll() is None:
+                proc.terminate()
+            try:
+                proc.wait(timeout=2)
+            except Exception:
+                proc.kill()
+        except Exception:
+            pass
 
-    def close(self):
+    def close(self, background: bool = False):
+        """background=True 时在线程里等待旧进程退出（非守护线程，程序退出前仍会等它写完录像）"""
         if self.proc:
-            try:
-                if self.proc.stdin:
-                    try:
-                        self.proc.stdin.close()
-                    except Exception:
-                        pass
-                self.proc.terminate()
+            proc, self.proc = self.proc, None
+            self.started = False
+            if proc.stdin:
                 try:
-                    self.proc.wait(timeout=2)
+                    proc.stdin.close()
                 except Exception:
-                    self.proc.kill()
-            except Exception:
-                pass
-            finally:
-                self.proc = None
-                self.started = False
-                print("⏹️ RTMP 推流已停止")
+                    pass
+            if background:
+                threading.Thread(target=self._reap, args=(proc,), name="ffmpeg-reap").start()
+            else:
+                self._reap(proc)
+            print("⏹️ RTMP 推流已停止")
 
 # ========================= 线程：采集 & 推理 =========================
 class CaptureThread(threading.Thread):
-    def __init__(self, source, frame_queue: queue.Queue, stop_event: threading.Event):
+    def __init__(self, source, frame_queue: queue.Queue, stop_event: threading.Event,
+                 frame_ready: Optional[threading.Event] = None, name: str = "src0",
+                 pool: Optional[FramePool] = None):
         super().__init__(daemon=True)
         self.source = source
         self.frame_queue = frame_queue
         self.stop_event = stop_event
+        # 多路共享的“有新帧”信号，推理线程据此唤醒
+        self.frame_ready = frame_ready
+        self.source_name = name
+        # 启用缓冲区池时，帧的所有权随队列交给推理线程
+        self.pool = pool
         self.cap: Optional[cv2.VideoCapture] = None
 
     def run(self):
         self.cap = cv2.VideoCapture(self.source)
         if not self.cap.isOpened():
-            print("❌ 无法打开视频源")
-            self.stop_event.set()
+            print(f"❌ 无法打开视频源 [{self.source_name}]: {self.source}")
             return
-        print("🎥 CaptureThread 启动")
+        print(f"🎥 CaptureThread 启动 [{self.source_name}]")
+        shape = (int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
         while not self.stop_event.is_set():
-            ret, frame = self.cap.read()
+            buf = self.pool.acquire(shape) if (self.pool and shape[0] > 0) else None
+            # 传入 buf 时 read 直接解码到该缓冲区（尺寸不符时 OpenCV 会另行分配）
+            ret, frame = self.cap.read(buf)
             if not ret:
-                print("⚠️ 读取帧失败/结束，停止采集")
+                if self.pool:
+                    self.pool.release(buf)
+                print(f"⚠️ 读取帧失败/结束，停止采集 [{self.source_name}]")
                 break
             try:
                 self.frame_queue.put(frame, timeout=0.5)
+                if self.frame_ready:
+                    self.frame_ready.set()
             except queue.Full:
-                # 队列满可选择丢帧：pass
-                print("⚠️ 采集队列已满，丢弃帧")
-        self.stop_event.set()
+                # 队列满则丢弃本路的新帧，不影响其他路
+                if self.pool:
+                    self.pool.release(frame)
+                print(f"⚠️ 采集队列已满，丢弃帧 [{self.source_name}]")
         if self.cap:
             self.cap.release()
-        print("🎥 CaptureThread 结束")
+        print(f"🎥 CaptureThread 结束 [{self.source_name}]")
 
 class InferenceThread(threading.Thread):
-    def __init__(self, model, frame_queue: queue.Queue, result_queue: queue.Queue,
+    """
+    单模型推理线程，可服务多路视频源：
+    - 每路一个采集队列，按轮转顺序每路最多取 1 帧组成一个批次，一次 predict 完成整批推理
+    - 高帧率的源只会在自己的队列里积压/丢帧，不会挤占其他源在批次中的位置
+    """
+    def __init__(self, model, frame_queues: List[queue.Queue], result_queue: queue.Queue,
                  stop_event: threading.Event, conf: float, iou: float, device: str,
-                 enforce_resize: Optional[List[int]] = None):
+                 enforce_resize: Optional[List[int]] = None,
+                 frame_ready: Optional[threading.Event] = None, max_batch: Optional[int] = None,
+                 pool: Optional[FramePool] = None, stride: int = 1,
+                 control: Optional[PipelineControl] = None, profiler: Optional[SamplingProfiler] = None,
+                 classes: Optional[List[int]] = None):
         super().__init__(daemon=True)
         self.model = model
-        self.frame_queue = frame_queue
+        self.frame_queues = frame_queues
         self.result_queue = result_queue
         self.stop_event = stop_event
         self.conf = conf
@@ -204,42 +336,150 @@ class InferenceThread(threading.Thread):
         self.device = device
         # enforce_resize = [w, h] 若想所有帧统一尺寸可设；默认 None 不缩放
         self.enforce_resize = enforce_resize
+        self.frame_ready = frame_ready or threading.Event()
+        self.max_batch = max_batch or len(frame_queues)
+        self.next_source = 0
+        # 启用缓冲区池时：标注帧从池中取，自绘检测框代替 result.plot() 的多次整帧拷贝
+        self.pool = pool
+        # 每路每 stride 帧推理一次，中间帧沿用该路上次的检测框
+        self.stride = max(1, stride)
+        self.frame_counters = [0] * len(frame_queues)
+        self.last_detections: List[List[Dict[str, Any]]] = [[] for _ in frame_queues]
+        self.last_names: Optional[Dict[int, str]] = None
+        # 运行时控制通道（conf / iou / stride）
+        self.control = control
+        self.control_version = 0
+        # 按需 torch.profiler 跟踪（由 SamplingProfiler 触发）
+        self.profiler = profiler
+        # 只保留这些类别（在 NMS 阶段过滤），None 为全部类别
+        self.classes = classes
+        # 检测提取累计耗时（结束汇总用）
+        self.extract_s = 0.0
+        self.extract_frames = 0
+        # 当前没有待推理的帧（主线程据此判断是否全部处理完）
+        self.idle = True
         print("🧠 InferenceThread 初始化完成")
 
-    def run(self):
-        print("🧠 InferenceThread 启动")
-        while not self.stop_event.is_set():
+    def _collect_batch(self) -> List[tuple]:
+        batch = []
+        n = len(self.frame_queues)
+        for k in range(n):
+            if len(batch) >= self.max_batch:
+                break
+            source_id = (self.next_source + k) % n
             try:
-                frame = self.frame_queue.get(timeout=0.5)
+                batch.append((source_id, self.frame_queues[source_id].get_nowait()))
             except queue.Empty:
                 continue
+        # 下一批从下一路开始，批次放不下所有源时也能轮流获得名额
+        self.next_source = (self.next_source + 1) % n
+        return batch
+
+    def _apply_control(self):
+        version, values = self.control.snapshot()
+        self.conf = values["conf"]
+        self.iou = values["iou"]
+        self.stride = values["stride"]
+        self.control_version = version
+        self.control.applied("inference", version)
+
+    def _annotate(self, frame, detections: List[Dict[str, Any]], result=None):
+        if self.pool:
+            annotated = self.pool.acquire(frame.shape)
+            np.copyto(annotated, frame)
+            draw_detections(annotated, detections, self.last_names)
+            return annotated
+        if result is not None:
+            return result.plot()
+        annotated = frame.copy()
+        draw_detections(annotated, detections, self.last_names)
+        return annotated
 
-            # 可选统一尺寸（默认关闭）
-            if self.enforce_resize and len(self.enforce_resize) == 2:
-                target_w, target_h = self.enforce_resize
-                if frame.shape[1] != target_w or frame.shape[0] != target_h:
-                    frame = cv2.resize(frame, (target_w, target_h))
+    def run(self):
+        print("🧠 InferenceThread 启动")
+        while not self.stop_event.is_set():
+            if self.control and self.control.version != self.control_version:
+                self._apply_control()
+            self.frame_ready.clear()
+            # 取帧之前先标记忙碌：否则帧已出队、结果尚未入队的间隙里，主线程会看到
+            # “采集队列空 + 推理空闲 + 结果队列空”而提前结束
+            self.idle = False
+            batch = self._collect_batch()
+            if not batch:
+                self.idle = True
+                if self.profiler:
+                    self.profiler.torch_hook.poll()
+                self.frame_ready.wait(timeout=0.5)
+                continue
 
+            frames = []
+            for _, frame in batch:
+                # 可选统一尺寸（默认关闭）
+                if self.enforce_resize and len(self.enforce_resize) == 2:
+                    target_w, target_h = self.enforce_resize
+                    if frame.shape[1] != target_w or frame.shape[0] != target_h:
+                        if self.pool:
+                            resized = self.pool.acquire((target_h, target_w, 3))
+                            cv2.resize(frame, (target_w, target_h), dst=resized)
+                            self.pool.release(frame)
+                            frame = resized
+                        else:
+                            frame = cv2.resize(frame, (target_w, target_h))
+                frames.append(frame)
+
+            # 按 stride 拆分：需要推理的帧 / 沿用上次检测框的帧
+            infer_idx, reuse_idx = [], []
+            for k, (source_id, _) in enumerate(batch):
+                (infer_idx if self.frame_counters[source_id] % self.stride == 0 else reuse_idx).append(k)
+                self.frame_counters[source_id] += 1
+
+            outputs: Dict[int, tuple] = {}
+            queued = 0
             try:
-                # 关键修改：删除 imgsz=None，避免错误
-                results = self.model.predict(
-                    frame,
-                    conf=self.conf,
-                    iou=self.iou,
-                    verbose=False,
-                    #show=True,
-                    device=self.device
-                )
-                result = results[0]
-                annotated = result.plot()
-                detections = extract_detections_from_result(result)
-                self.result_queue.put({
-                    "orig": frame,
-                    "annotated": annotated,
-                    "detections": detections
-                })
+                if infer_idx:
+                    # 关键修改：删除 imgsz=None，避免错误
+                    predict = self.model.predict
+                    if self.profiler:
+                        predict = functools.partial(self.profiler.torch_hook.predict, predict)
+                    results = predict(
+                        [frames[k] for k in infer_idx],
+                        conf=self.conf,
+                        iou=self.iou,
+                        classes=self.classes,
+                        verbose=False,
+                        #show=True,
+                        device=self.device
+                    )
+                    for k, result in zip(infer_idx, results):
+                        source_id = batch[k][0]
+                        t0 = time.perf_counter()
+                        detections = extract_detections_from_result(result)
+                        self.extract_s += time.perf_counter() - t0
+                        self.extract_frames += 1
+                        self.last_names = getattr(result, "names", None)
+                        self.last_detections[source_id] = detections
+                        outputs[k] = (self._annotate(frames[k], detections, result), detections)
+                for k in reuse_idx:
+                    # 未推理的帧只画框不发布，detections 置空
+                    outputs[k] = (self._annotate(frames[k], self.last_detections[batch[k][0]]), [])
+                for k, (source_id, _) in enumerate(batch):
+                    annotated, detections = outputs[k]
+                    self.result_queue.put({
+                        "source": source_id,
+                        "orig": frames[k],
+                        "annotated": annotated,
+                        "detections": detections,
+                        "inferred": k not in reuse_idx
+                    })
+                    queued += 1
             except Exception as e:
                 print(f"❌ 推理失败: {e}")
+                if self.pool:
+                    # 已入队的帧归主线程所有；其余原始帧和已画好的标注帧归还给池
+                    self.pool.release(*frames[queued:],
+                                      *(annotated for k, (annotated, _) in outputs.items() if k >= queued))
+        if self.profiler:
+            self.profiler.torch_hook.close()
         print("🧠 InferenceThread 结束")
         self.stop_event.set()
 
@@ -267,65 +507,311 @@ def extract_detections_from_result(result) -> List[Dict[str, Any]]:
             })
     return detections
 
+def bitrate_ack(control: PipelineControl, version: int, names: List[str]) -> Callable[[str, Optional[str]], None]:
+    """各路编码器都以新码率重启后才确认 rtmp 目标；任一路失败则以 rejected 结束"""
+    remaining = set(names)
+    errors: List[str] = []
+
+    def on_applied(name: str, error: Optional[str]):
+        if error:
+            errors.append(f"{name}: {error}")
+        remaining.discard(name)
+        if remaining:
+            return
+        if errors:
+            control.failed("rtmp", version, "；".join(errors))
+        else:
+            control.applied("rtmp", version)
+    return on_applied
+
+def publish_detections(sink: Dict[str, Any], detections: List[Dict[str, Any]], inferred: bool = True):
+    """
+    sink 为带 redis / full / delta / delta_redis 的输出：outputs 中的一路（默认路由），或按类别分流的一条路由。
+    完整检测写入默认命名空间（现有消费者按记录数计人数；--delta-only 时 full 为 False 不写），
+    增量记录另写 delta_redis 的命名空间
+    """
+    if sink['full'] and sink['redis'] and detections:
+        sink['redis'].publish_detection_metadata(detections)
+    # 沿用检测框的帧不参与比较，否则会被当成目标全部消失
+    if sink['delta'] and inferred:
+        records = sink['delta'].encode(detections)
+        if records:
+            sink['delta_redis'].publish_detection_metadata(records)
+
+def draw_detections(img, detections: List[Dict[str, Any]], names: Optional[Dict[int, str]] = None):
+    """在 img 上原地绘制检测框与标签（不分配整帧数组）"""
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox_x1"], det["bbox_y1"], det["bbox_x2"], det["bbox_y2"]
+        class_id = det.get("class_id", -1)
+        label = f"{names.get(class_id, class_id) if names else class_id} {det['confidence']:.2f}"
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        ty = max(y1, th + 4)
+        cv2.rectangle(img, (x1, ty - th - 4), (x1 + tw + 2, ty), (0, 0, 255), -1)
+        cv2.putText(img, label, (x1 + 1, ty - 3), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
 # ========================= 主流程 =========================
 def parse_arguments():
     parser = argparse.ArgumentParser(description='YOLO 实时检测（多线程采集+推理 + Redis + RTMP 推流）')
     parser.add_argument('--model', type=str, default='yolov8m.pt', help='模型路径')
-    parser.add_argument('--source', type=str, default='0', help='输入源（文件路径或摄像头索引）')
+    parser.add_argument('--source', type=str, nargs='+', default=['0'],
+                        help='输入源（文件路径或摄像头索引），可传多个，共用一个模型')
+    parser.add_argument('--name', type=str, nargs='+', default=None,
+                        help='(多路) 各源名称，用作 Redis 键/频道命名空间，默认 src0 src1 ...')
+    parser.add_argument('--rtmp-url', type=str, nargs='+', default=None,
+                        help='RTMP 推流地址；多路时每路一个，缺省为 默认地址_{名称}')
     parser.add_argument('--conf', type=float, default=0.5, help='置信度阈值')
     parser.add_argument('--iou', type=float, default=0.85, help='IOU 阈值')
     parser.add_argument('--device', type=str, default='cuda:0', help='计算设备，如 cuda:0 / cpu / auto')
     parser.add_argument('--imgsz', type=int, nargs='+', default=[1280, 720], help='(可选) 统一缩放尺寸，当前未强制使用')
+    parser.add_argument('--capture-backend', type=str, default='opencv', choices=['opencv', 'ffmpeg'],
+                        help='采集后端：opencv(cv2.VideoCapture) / ffmpeg(管道解码 + 预分配缓冲区)')
+    parser.add_argument('--decode-threads', type=int, default=0, help='(ffmpeg) 解码线程数，0 为自动')
+    parser.add_argument('--decode-size', type=str, default=None, help='(ffmpeg) 解码时直接缩放到该尺寸，如 1280x720')
+    parser.add_argument('--frame-pool', action='store_true',
+                        help='启用帧缓冲区池：采集/标注/显示缓冲区跨帧复用，标注改为原地绘制')
+    parser.add_argument('--mem-report', type=str, default=None,
+                        help='(可选) 内存报告 CSV 路径：tracemalloc + RSS，结束时打印稳态每帧分配')
+    parser.add_argument('--stride', type=int, default=1, help='每 N 帧推理一次，中间帧沿用上次检测框')
+    parser.add_argument('--control-redis', action='store_true',
+                        help='开启 Redis 控制通道（detect:control），运行时调整 conf/iou/stride/bitrate_k')
+    parser.add_argument('--control-port', type=int, default=None, help='(可选) 本地 HTTP 控制接口端口')
+    parser.add_argument('--record-dir', type=str, default=None,
+                        help='(可选) 本地分段录像目录；与推流共用一次编码（ffmpeg tee），RTMP 断开不影响录像')
+    parser.add_argument('--segment-time', type=int, default=60, help='(录像) 每个分段的秒数')
+    parser.add_argument('--record-format', type=str, default='mp4', choices=['mp4', 'ts'],
+                        help='(录像) 分段格式；ts 在进程异常退出时也能保留最后一个分段')
+    parser.add_argument('--no-rtmp', action='store_true', help='不推流，只录像（需要 --record-dir）')
+    parser.add_argument('--abr', action='store_true',
+                        help='推流自适应：根据写入阻塞和编码积压在 720p/540p/360p 阶梯间切换')
+    parser.add_argument('--profile-dir', type=str, default='profiles', help='采样分析输出目录（kill -USR1 触发）')
+    parser.add_argument('--profile-seconds', type=float, default=10.0, help='(采样分析) 每次采样秒数')
+    parser.add_argument('--profile-torch', action='store_true', help='(采样分析) 同时用 torch.profiler 跟踪 model.predict')
+    parser.add_argument('--classes', type=str, nargs='+', default=None,
+                        help='只检测这些类别（名称或编号，如 person 或 0），在推理时过滤')
+    parser.add_argument('--class-route', type=str, nargs='+', default=None,
+                        help='按类别分流到独立的 Redis 键名/频道，如 vehicles=car,bus,truck；未列出的类别走默认频道')
+    parser.add_argument('--max-batch', type=int, default=None, help='(多路) 单次推理最大批大小，默认等于源数量')
     parser.add_argument('--redis-host', type=str, default='124.71.162.119', help='Redis服务器地址')
     parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
     parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
     parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    parser.add_argument('--delta', action='store_true',
+                        help='另发增量记录到 image_metadata_delta:* / image:metadata:updates:delta：只含新增/消失/明显移动的目标，定期发布完整关键帧（订阅端 sub.py --delta）；默认频道照常发布完整检测')
+    parser.add_argument('--delta-only', action='store_true',
+                        help='(增量发布) 停发默认频道的完整检测，只写增量命名空间；仅在没有 Java 端等旧消费者时使用')
+    parser.add_argument('--delta-keyframe-s', type=float, default=5.0, help='(增量发布) 关键帧间隔（秒）')
+    parser.add_argument('--heatmap', action='store_true', help='累计人群密度热力图并定期发布到 Redis')
+    parser.add_argument('--heatmap-cell', type=int, default=20, help='(热力图) 网格边长（像素）')
+    parser.add_argument('--heatmap-half-life', type=float, default=60.0, help='(热力图) 衰减半衰期（秒）')
+    parser.add_argument('--heatmap-interval', type=float, default=1.0, help='(热力图) 发布间隔（秒）')
+    parser.add_argument('--crops', type=str, default=None, choices=['redis', 'disk'],
+                        help='(可选) 保存检测目标截图，检测记录附带 crop_key')
+    parser.add_argument('--crop-dir', type=str, default='crops', help='(截图) disk 模式的保存目录')
+    parser.add_argument('--crop-budget-mb', type=float, default=64.0, help='(截图) 每路截图总大小上限，超出按 LRU 淘汰')
+    parser.add_argument('--crop-workers', type=int, default=2, help='(截图) JPEG 编码线程数')
+    parser.add_argument('--crop-refresh', type=float, default=10.0, help='(截图) 同一目标重新截图的间隔（秒）')
+    parser.add_argument('--pipeline', type=str, nargs='+', default=None,
+                        help='(可选) 按流水线配置运行（见 pipeline.py / pipelines/*.json）；给多个配置时依次运行并对比。'
+                             '只支持单路源与检测/发布/推流主干，截图、热力图、分流、控制、ABR 等参数会被拒绝')
     parser.add_argument('--disable-redis', action='store_true', help='禁用Redis')
+    parser.add_argument('--log-dir', type=str, default=None, help='(可选) 本地检测日志根目录，每次运行新建一个任务子目录')
     return parser.parse_args()
 
 def main():
     args = parse_arguments()
-    try:
-        src = int(args.source)
-    except ValueError:
-        src = args.source
+    sources = []
+    for s in args.source:
+        try:
+            sources.append(int(s))
+        except ValueError:
+            sources.append(s)
+    multi = len(sources) > 1
+    names = args.name or [f"src{i}" for i in range(len(sources))]
+    if len(names) != len(sources):
+        raise SystemExit("❌ --name 数量必须与 --source 一致")
+    if args.rtmp_url and len(args.rtmp_url) != len(sources):
+        raise SystemExit("❌ --rtmp-url 数量必须与 --source 一致")
+    if args.no_rtmp and not args.record_dir:
+        raise SystemExit("❌ --no-rtmp 需要同时指定 --record-dir")
+    if args.delta_only and not args.delta:
+        raise SystemExit("❌ --delta-only 需要同时指定 --delta")
+    if args.pipeline:
+        from pipeline import run_pipelines
+        run_pipelines(args.pipeline, args)
+        return
 
     device = 'cuda:0' if (args.device == 'auto' and torch.cuda.is_available()) else args.device
     print(f"🚀 使用设备: {device.upper()}")
 
     model = YOLO(args.model).to(device)
-    print(f"✅ 已加载模型: {args.model}")
+    print(f"✅ 已加载模型: {args.model}（{len(sources)} 路视频源共用）")
 
-    redis_publisher = None
-    if not args.disable_redis:
-        redis_publisher = RedisDetectionPublisher(
-            host=args.redis_host, port=args.redis_port, db=args.redis_db, password=args.redis_password
-        )
-
-    rtmp_streamer = RtmpStreamer()
-    rtmp_streamer.start()
-
-    frame_queue: queue.Queue = queue.Queue(maxsize=8)
-    result_queue: queue.Queue = queue.Queue(maxsize=8)
+    try:
+        classes = resolve_classes(args.classes, model.names) if args.classes else None
+        class_routes = parse_class_routes(args.class_route, model.names) if args.class_route else {}
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    if classes:
+        print(f"🏷️ 只检测类别: {', '.join(str(model.names.get(c, c)) for c in classes)}")
+        dropped = [c for c in class_routes if c not in classes]
+        if dropped:
+            print(f"⚠️ 以下分流类别不在 --classes 中，不会出现: {dropped}")
+    for route in sorted(set(class_routes.values())):
+        members = [str(model.names.get(c, c)) for c, r in class_routes.items() if r == route]
+        print(f"🔀 类别分流 {route}: {', '.join(members)}")
+
+    # 每路的输出：单路时沿用原有键名/频道/推流地址，多路时按名称划分命名空间
+    outputs = []
+    mission_dir = None
+    if args.log_dir:
+        mission_dir = os.path.join(args.log_dir, time.strftime('mission_%Y%m%d_%H%M%S'))
+        print(f"🗂️ 检测日志目录: {mission_dir}")
+    for i, name in enumerate(names):
+        redis_publisher = None
+        extra_fields = ("crop_key",) if args.crops else ()
+        if not args.disable_redis:
+            ns = {"key_prefix": f"{KEY_PREFIX}_{name}", "channel": f"{UPDATES_CHANNEL}:{name}"} if multi else {}
+            redis_publisher = RedisDetectionPublisher(
+                host=args.redis_host, port=args.redis_port, db=args.redis_db, password=args.redis_password,
+                extra_fields=extra_fields, **ns
+            )
+        detection_log = None
+        if mission_dir:
+            detection_log = DetectionLogWriter(os.path.join(mission_dir, name) if multi else mission_dir,
+                                               source=str(sources[i]))
+        abr = AbrController(RtmpStreamer.FPS) if args.abr else None
+        if args.no_rtmp:
+            rtmp_url = None
+        elif args.rtmp_url:
+            rtmp_url = args.rtmp_url[i]
+        elif multi:
+            rtmp_url = f"{RtmpStreamer.DEFAULT_URL}_{name}"
+        else:
+            rtmp_url = RtmpStreamer.DEFAULT_URL
+        # 按类别分流：每条路由一个发布端（共用连接），键名/频道在默认命名空间后加路由名
+        routes: Dict[str, Dict[str, Any]] = {}
+        if class_routes and redis_publisher and redis_publisher.redis_client:
+            for route in sorted(set(class_routes.values())):
+                route_pub = RedisDetectionPublisher(
+                    key_prefix=f"{redis_publisher.key_prefix}_{route}", channel=f"{redis_publisher.channel}:{route}",
+                    extra_fields=extra_fields, client=redis_publisher.redis_client
+                )
+                route_delta = delta_publisher(route_pub) if args.delta else None
+                routes[route] = {
+                    "redis": route_pub,
+                    "full": not (route_delta and args.delta_only),
+                    "delta": DeltaEncoder(keyframe_s=args.delta_keyframe_s) if route_delta else None,
+                    "delta_redis": route_delta,
+                }
+        heatmap_pub = None
+        if args.heatmap and redis_publisher and redis_publisher.redis_client:
+            hm_ns = {"key": f"{HEATMAP_KEY}_{name}", "channel": f"{HEATMAP_CHANNEL}:{name}"} if multi else {}
+            heatmap_pub = HeatmapPublisher(redis_publisher.redis_client, interval_s=args.heatmap_interval, **hm_ns)
+        crops = None
+        budget = int(args.crop_budget_mb * 1024 * 1024)
+        if args.crops == 'disk':
+            crop_dir = os.path.join(args.crop_dir, name) if multi else args.crop_dir
+            crops = CropSnapshotter(DiskCropStore(crop_dir, budget), workers=args.crop_workers,
+                                    refresh_s=args.crop_refresh)
+        elif args.crops == 'redis' and redis_publisher and redis_publisher.redis_client:
+            store = RedisCropStore(redis_publisher.redis_client, budget,
+                                   prefix=f"{CROP_PREFIX}_{name}" if multi else CROP_PREFIX)
+            crops = CropSnapshotter(store, workers=args.crop_workers, refresh_s=args.crop_refresh)
+        record_dir = None
+        if args.record_dir:
+            record_dir = os.path.join(args.record_dir, name) if multi else args.record_dir
+        delta_redis = delta_publisher(redis_publisher) if (args.delta and redis_publisher) else None
+        rtmp_streamer = RtmpStreamer(rtmp_url, abr=abr, record_dir=record_dir,
+                                     segment_s=args.segment_time, record_format=args.record_format)
+        rtmp_streamer.start()
+        outputs.append({
+            "name": name,
+            "redis": redis_publisher,
+            "log": detection_log,
+            "rtmp": rtmp_streamer,
+            # 热力图网格在拿到第一帧的分辨率后创建
+            "heatmap": None,
+            "heatmap_pub": heatmap_pub,
+            "crops": crops,
+            "full": not (delta_redis and args.delta_only),
+            "delta": DeltaEncoder(keyframe_s=args.delta_keyframe_s) if delta_redis else None,
+            "delta_redis": delta_redis,
+            "router": ClassRouter(class_routes) if routes else None,
+            "routes": routes,
+            "publish_s": 0.0,
+            "frames": 0,
+            "detections": 0,
+            "start": time.time(),
+        })
+
+    frame_queues: List[queue.Queue] = [queue.Queue(maxsize=8) for _ in sources]
+    result_queue: queue.Queue = queue.Queue(maxsize=8 * len(sources))
     stop_event = threading.Event()
+    frame_ready = threading.Event()
+    pool = FramePool() if args.frame_pool else None
+
+    control = None
+    if args.control_redis or args.control_port:
+        control = PipelineControl({
+            "conf": args.conf, "iou": args.iou, "stride": args.stride, "bitrate_k": RtmpStreamer.BITRATE_K
+        })
+        if args.control_redis:
+            control_client = next((o['redis'].redis_client for o in outputs
+                                   if o['redis'] and o['redis'].redis_client), None)
+            if control_client:
+                RedisControlListener(control, control_client, stop_event).start()
+            else:
+                print("⚠️ Redis 不可用，控制通道未开启")
+        if args.control_port:
+            start_http_control(control, '127.0.0.1', args.control_port)
+    rtmp_control_version = 0
+    mem_reporter = MemoryReporter(args.mem_report) if args.mem_report else None
+
+    # 按需采样分析：kill -USR1 <pid> 或控制通道 profile_s
+    profiler = SamplingProfiler(args.profile_dir)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: profiler.capture(args.profile_seconds, args.profile_torch))
+        print(f"🔬 采样分析: kill -USR1 {os.getpid()}（{args.profile_seconds:.0f}s -> {args.profile_dir}）")
 
     # 如果想强制推理输入统一尺寸，可把 enforce_resize 换成 list，例如:
     # enforce_resize = args.imgsz if len(args.imgsz) == 2 else None
     enforce_resize = None
 
-    capture_thread = CaptureThread(src, frame_queue, stop_event)
+    if args.capture_backend == 'ffmpeg':
+        # 环形缓冲区需覆盖下游最多同时持有的帧：本路采集队列 + 结果队列 + 推理/主线程各 1 帧 + 余量
+        ring_size = frame_queues[0].maxsize + result_queue.maxsize + 4
+        capture_threads = [
+            FfmpegCaptureThread(src, frame_queues[i], stop_event, frame_ready=frame_ready, name=names[i],
+                                decode_threads=args.decode_threads, output_size=parse_size(args.decode_size),
+                                ring_size=ring_size, pool=pool)
+            for i, src in enumerate(sources)
+        ]
+    else:
+        capture_threads = [
+            CaptureThread(src, frame_queues[i], stop_event, frame_ready=frame_ready, name=names[i], pool=pool)
+            for i, src in enumerate(sources)
+        ]
     inference_thread = InferenceThread(
         model=model,
-        frame_queue=frame_queue,
+        frame_queues=frame_queues,
         result_queue=result_queue,
         stop_event=stop_event,
         conf=args.conf,
         iou=args.iou,
         device=device,
-        enforce_resize=enforce_resize
+        enforce_resize=enforce_resize,
+        frame_ready=frame_ready,
+        max_batch=args.max_batch,
+        pool=pool,
+        stride=args.stride,
+        control=control,
+        profiler=profiler,
+        classes=classes
     )
 
-    capture_thread.start()
+    for t in capture_threads:
+        t.start()
     inference_thread.start()
 
     frame_count = 0
@@ -334,58 +820,141 @@ def main():
 
     try:
         while not stop_event.is_set():
+            # 先处理控制变更再取结果：推理停滞、结果队列为空时同样能调码率、触发采样
+            if control and control.version != rtmp_control_version:
+                rtmp_control_version, values, changed = control.changes_since(rtmp_control_version)
+                if 'bitrate_k' in changed:
+                    # 只在码率本身被修改时下发，避免覆盖 ABR 选定的档位；编码器重启后才确认
+                    ack = bitrate_ack(control, rtmp_control_version, [o['name'] for o in outputs])
+                    for o in outputs:
+                        o['rtmp'].set_bitrate(values['bitrate_k'], functools.partial(ack, o['name']))
+                if "profile_s" in changed:
+                    torch_trace = bool(changed.get('profile_torch', args.profile_torch))
+                    if profiler.capture(values['profile_s'], torch_trace):
+                        control.applied("profiler", rtmp_control_version)
+                    else:
+                        control.failed("profiler", rtmp_control_version, "已有采样在进行")
+
             try:
                 item = result_queue.get(timeout=0.5)
             except queue.Empty:
-                if not capture_thread.is_alive() and result_queue.empty():
+                if (not any(t.is_alive() for t in capture_threads)
+                        and all(q.empty() for q in frame_queues)
+                        and inference_thread.idle and result_queue.empty()):
                     print("⚠️ 无更多帧，结束主循环")
                     break
                 continue
 
+
+            out = outputs[item['source']]
             frame_count += 1
+            out['frames'] += 1
             orig = item['orig']
             annotated = item['annotated']
-            detections = item['detections']
-            detection_total += len(detections)
-
-            if redis_publisher and detections:
-                redis_publisher.publish_detection_metadata(detections)
-
-            rtmp_streamer.write(annotated)
-
-            elapsed = time.time() - start_time
-            fps = frame_count / elapsed if elapsed > 0 else 0.0
-            stats = [
-                f"FPS: {fps:.1f}",
-                f"Frames: {frame_count}",
-                f"Detections: {detection_total}",
-                f"Redis: {'ON' if (redis_publisher and redis_publisher.redis_client) else 'OFF'}",
-                f"RTMP: {'ON' if rtmp_streamer.started else 'OFF'}"
-            ]
-            for i, txt in enumerate(stats):
-                cv2.putText(annotated, txt, (10, 30 + i * 25),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-            disp = cv2.hconcat([orig, annotated])
-            dh, dw = disp.shape[:2]
-            disp_small = cv2.resize(disp, (dw // 2, dh // 2))
-            cv2.imshow("YOLOv8 多线程 + Redis + RTMP - ESC退出", disp_small)
+            left = right = disp_small = None
+            try:
+                detections = item['detections']
+                detection_total += len(detections)
+                out['detections'] += len(detections)
+
+                if out['log'] and detections:
+                    out['log'].append(out['frames'], int(time.time() * 1000), detections)
+
+                if out['crops'] and detections:
+                    # 在发布前补上 crop_key；裁剪区域已拷贝，原始帧之后可以归还缓冲区池
+                    out['crops'].submit(orig, detections)
+
+                inferred = item.get('inferred', True)
+                crowd = detections
+                t0 = time.perf_counter()
+                if out['router']:
+                    groups = out['router'].split(detections)
+                    crowd = groups.pop(DEFAULT_ROUTE)
+                    publish_detections(out, crowd, inferred)
+                    for route, route_dets in groups.items():
+                        publish_detections(out['routes'][route], route_dets, inferred)
+                else:
+                    publish_detections(out, detections, inferred)
+                out['publish_s'] += time.perf_counter() - t0
+
+                if out['heatmap_pub']:
+                    if out['heatmap'] is None:
+                        out['heatmap'] = DensityHeatmap((orig.shape[1], orig.shape[0]), args.heatmap_cell,
+                                                        args.heatmap_half_life)
+                    if inferred:
+                        # 分流时热力图只统计默认路由（人群）
+                        out['heatmap'].add(crowd)
+                    out['heatmap_pub'].maybe_publish(out['heatmap'])
+
+                out['rtmp'].write(annotated)
+
+                elapsed = time.time() - out['start']
+                fps = out['frames'] / elapsed if elapsed > 0 else 0.0
+                stats = [
+                    f"FPS: {fps:.1f}",
+                    f"Frames: {out['frames']}",
+                    f"Detections: {out['detections']}",
+                    f"Redis: {'ON' if (out['redis'] and out['redis'].redis_client) else 'OFF'}",
+                    f"RTMP: {out['rtmp'].rtmp_state}"
+                ]
+                if out['rtmp'].record_dir:
+                    stats.append(f"REC: {'ON' if out['rtmp'].started else 'OFF'}")
+                if multi:
+                    stats.insert(0, f"Source: {out['name']}")
+                for i, txt in enumerate(stats):
+                    cv2.putText(annotated, txt, (10, 30 + i * 25),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+                if pool:
+                    # 先各自缩小再拼接，三块显示缓冲区都来自池
+                    h, w = orig.shape[:2]
+                    half = (h // 2, w // 2, 3)
+                    left, right = pool.acquire(half), pool.acquire(half)
+                    cv2.resize(orig, (w // 2, h // 2), dst=left)
+                    cv2.resize(annotated, (w // 2, h // 2), dst=right)
+                    disp_small = pool.acquire((h // 2, (w // 2) * 2, 3))
+                    cv2.hconcat([left, right], dst=disp_small)
+                else:
+                    disp = cv2.hconcat([orig, annotated])
+                    dh, dw = disp.shape[:2]
+                    disp_small = cv2.resize(disp, (dw // 2, dh // 2))
+                title = "YOLOv8 多线程 + Redis + RTMP - ESC退出"
+                cv2.imshow(f"{title} [{out['name']}]" if multi else title, disp_small)
+            finally:
+                if pool:
+                    # 本帧所有缓冲区到此用完（中途出错也一样），归还给池
+                    pool.release(orig, annotated, left, right, disp_small)
+            if mem_reporter:
+                mem_reporter.tick()
             if cv2.waitKey(1) == 27:
                 print("🛑 用户退出")
                 stop_event.set()
                 break
 
-            if frame_count % 200 == 0 and redis_publisher:
-                stats_r = redis_publisher.get_detection_stats()
+            if out['frames'] % 200 == 0 and out['redis']:
+                stats_r = out['redis'].get_detection_stats()
                 if stats_r:
-                    print(f"📊 Redis统计: image:metadata:updates键数={stats_r.get('total_image:metadata:updates', 0)}")
+                    print(f"📊 Redis统计[{out['name']}]: image:metadata:updates键数="
+                          f"{stats_r.get('total_image:metadata:updates', 0)}")
 
     finally:
         stop_event.set()
-        capture_thread.join(timeout=2)
+        for t in capture_threads:
+            t.join(timeout=2)
         inference_thread.join(timeout=2)
-        rtmp_streamer.close()
+        if inference_thread.is_alive() and profiler.torch_hook.busy:
+            # 推理线程退出前在导出 torch.profiler 跟踪
+            inference_thread.join(timeout=30)
+        for out in outputs:
+            out['rtmp'].close()
+            out['rtmp'].report()
+            if out['log']:
+                out['log'].close()
+            if out['crops']:
+                out['crops'].close()
         cv2.destroyAllWindows()
+        if mem_reporter:
+            mem_reporter.close()
 
         total_time = time.time() - start_time
         avg_fps = frame_count / total_time if total_time > 0 else 0.0
@@ -394,11 +963,33 @@ def main():
         print(f"  总检测: {detection_total}")
         print(f"  平均FPS: {avg_fps:.1f}")
         print(f"  总耗时: {total_time:.1f}s")
-
-        if redis_publisher:
-            final_stats = redis_publisher.get_detection_stats()
-            if final_stats:
-                print(f"  Redis数据: {final_stats}")
+        if pool:
+            print(f"  缓冲区池: {pool.stats()}")
+        if inference_thread.extract_frames:
+            print(f"  检测提取: 平均 {inference_thread.extract_s / inference_thread.extract_frames * 1000:.2f} ms/帧")
+        if multi:
+            for out in outputs:
+                print(f"  [{out['name']}] 帧数 {out['frames']}，检测 {out['detections']}，"
+                      f"FPS {out['frames'] / total_time if total_time > 0 else 0.0:.1f}")
+
+        for out in outputs:
+            if out['crops']:
+                print(f"  截图[{out['name']}]: {out['crops'].summary()}")
+            if out['heatmap_pub']:
+                print(f"  热力图[{out['name']}]: 发布 {out['heatmap_pub'].published} 次 -> {out['heatmap_pub'].key}")
+            if out['delta']:
+                print(f"  增量发布[{out['name']}]: {out['delta'].summary(out['full'])} -> {out['delta_redis'].channel}")
+            if out['redis']:
+                if out['frames']:
+                    print(f"  发布[{out['name']}]: 平均 {out['publish_s'] / out['frames'] * 1000:.2f} ms/帧")
+                final_stats = out['redis'].get_detection_stats()
+                if final_stats:
+                    print(f"  Redis数据[{out['name']}]: {final_stats}" if multi else f"  Redis数据: {final_stats}")
+            for route, sink in out['routes'].items():
+                if sink['delta']:
+                    print(f"  增量发布[{out['name']}/{route}]: {sink['delta'].summary(sink['full'])} -> "
+                          f"{sink['delta_redis'].channel}")
+                print(f"  Redis数据[{out['name']}/{route}]: {sink['redis'].get_detection_stats()} -> {sink['redis'].channel}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,322 @@
+"""
+任务级检测日志（追加写入、按列存储）
+
+Redis 中的检测数据只保留 1 小时，飞行结束后无法复盘。本模块把每帧检测结果
+额外写入本地目录，按列存为 NumPy 分块，并维护一个很小的时间索引：
+
+    mission_xxx/
+        meta.json                  列定义 / 创建时间 / 视频源
+        index.npy                  每个分块一行：行数、时间戳范围、帧号范围
+        chunk_000000/ts_ms.npy     每列一个 .npy 文件
+        chunk_000000/frame_id.npy
+        ...
+
+查询时先在 index 上二分找到与时间窗/帧范围相交的分块，再以 mmap 方式打开
+分块的 ts_ms / frame_id 列二分定位行区间，只复制命中的切片，
+因此多小时、上百万框的任务也无需扫描整个日志。
+
+命令行：
+    python detection_log.py info  logs/mission_20250308_135111
+    python detection_log.py query logs/mission_20250308_135111 --last-seconds 30
+    python detection_log.py query logs/mission_20250308_135111 --frames 1000 2000 --csv out.csv
+    python detection_log.py selftest                   # 写入 / 续写 / 查询自检（临时目录）
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, Any, Optional, List
+
+import numpy as np
+
+# 列定义：名称 -> dtype（顺序即 CSV 输出顺序）
+COLUMNS: Dict[str, str] = {
+    "ts_ms": "int64",
+    "frame_id": "int64",
+    "center_x": "float32",
+    "center_y": "float32",
+    "width": "float32",
+    "height": "float32",
+    "confidence": "float32",
+    "class_id": "int16",
+}
+
+INDEX_DTYPE = np.dtype([
+    ("chunk_id", "int32"),
+    ("rows", "int64"),
+    ("ts_min", "int64"),
+    ("ts_max", "int64"),
+    ("frame_min", "int64"),
+    ("frame_max", "int64"),
+])
+
+LOG_VERSION = 1
+
+
+def _chunk_dir(mission_dir: str, chunk_id: int) -> str:
+    return os.path.join(mission_dir, f"chunk_{chunk_id:06d}")
+
+
+# ========================= 写入端 =========================
+class DetectionLogWriter:
+    """
+    追加写入检测日志。
+    - append() 只做内存拷贝，满 chunk_rows 行或超过 flush_interval_s 秒后落盘一个分块
+    - 时间戳强制单调不减（系统时钟回拨时沿用上一个时间戳），保证分块内可二分
+    - 续写已有任务目录时，分块编号、时间戳、帧号都接在已有索引之后：
+      调用方的 frame_id 每次运行从 1 开始（detect.py 先计数再写入），写入时加上上次的最大帧号 frame_offset，
+      新旧帧号首尾相接；否则帧号重叠，index 的 frame_min/frame_max 不再单调，查询的二分会漏掉分块
+    """
+
+    def __init__(self, mission_dir: str, chunk_rows: int = 65536, flush_interval_s: float = 10.0,
+                 source: Optional[str] = None):
+        self.mission_dir = mission_dir
+        self.chunk_rows = chunk_rows
+        self.flush_interval_s = flush_interval_s
+        os.makedirs(mission_dir, exist_ok=True)
+
+        index_path = os.path.join(mission_dir, "index.npy")
+        if os.path.exists(index_path):
+            # 同一目录续写：接在已有分块之后
+            self.index = np.load(index_path)
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+            with open(os.path.join(mission_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": LOG_VERSION,
+                    "columns": COLUMNS,
+                    "created_ms": int(time.time() * 1000),
+                    "source": source,
+                }, f, ensure_ascii=False, indent=2)
+
+        self.next_chunk_id = int(self.index["chunk_id"].max()) + 1 if len(self.index) else 0
+        self.last_ts = int(self.index["ts_max"][-1]) if len(self.index) else 0
+        self.buffers = {name: np.empty(chunk_rows, dtype=dt) for name, dt in COLUMNS.items()}
+        self.rows = 0
+        self.total_rows = int(self.index["rows"].sum()) if len(self.index) else 0
+        self.frame_offset = int(self.index["frame_max"].max()) if len(self.index) else 0
+        self.last_flush = time.time()
+        if len(self.index):
+            print(f"🗂️ 续写检测日志: {mission_dir}（已有 {self.total_rows} 条, {len(self.index)} 个分块，"
+                  f"帧号从 {self.frame_offset + 1} 继续）")
+
+    def append(self, frame_id: int, ts_ms: int, detections: List[Dict[str, Any]]):
+        frame_id = int(frame_id) + self.frame_offset
+        ts_ms = max(int(ts_ms), self.last_ts)
+        self.last_ts = ts_ms
+        pos = 0
+        n = len(detections)
+        while pos < n:
+            take = min(n - pos, self.chunk_rows - self.rows)
+            sl = slice(self.rows, self.rows + take)
+            part = detections[pos:pos + take]
+            self.buffers["ts_ms"][sl] = ts_ms
+            self.buffers["frame_id"][sl] = frame_id
+            for name in ("center_x", "center_y", "width", "height", "confidence"):
+                self.buffers[name][sl] = [d[name] for d in part]
+            self.buffers["class_id"][sl] = [d.get("class_id", -1) for d in part]
+            self.rows += take
+            pos += take
+            if self.rows >= self.chunk_rows:
+                self.flush()
+        if self.rows and time.time() - self.last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if self.rows == 0:
+            return
+        chunk_id = self.next_chunk_id
+        cdir = _chunk_dir(self.mission_dir, chunk_id)
+        os.makedirs(cdir, exist_ok=True)
+        for name, buf in self.buffers.items():
+            np.save(os.path.join(cdir, f"{name}.npy"), buf[:self.rows])
+
+        entry = np.zeros(1, dtype=INDEX_DTYPE)
+        entry["chunk_id"] = chunk_id
+        entry["rows"] = self.rows
+        entry["ts_min"] = self.buffers["ts_ms"][0]
+        entry["ts_max"] = self.buffers["ts_ms"][self.rows - 1]
+        entry["frame_min"] = self.buffers["frame_id"][0]
+        entry["frame_max"] = self.buffers["frame_id"][self.rows - 1]
+        self.index = np.concatenate([self.index, entry])
+
+        # 先写临时文件再替换，进程中途被杀也不会留下损坏的索引
+        tmp_path = os.path.join(self.mission_dir, "index.tmp.npy")
+        np.save(tmp_path, self.index)
+        os.replace(tmp_path, os.path.join(self.mission_dir, "index.npy"))
+
+        self.total_rows += self.rows
+        self.next_chunk_id += 1
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+        print(f"🗂️ 检测日志已保存: {self.mission_dir}（{self.total_rows} 条, {len(self.index)} 个分块）")
+
+
+# ========================= 读取端 =========================
+class DetectionLog:
+    """
+    只读打开一个任务目录，按时间窗或帧范围查询。
+    返回 {列名: np.ndarray}，各列等长。
+    """
+
+    def __init__(self, mission_dir: str):
+        self.mission_dir = mission_dir
+        with open(os.path.join(mission_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        index_path = os.path.join(mission_dir, "index.npy")
+        self.index = np.load(index_path) if os.path.exists(index_path) else np.zeros(0, dtype=INDEX_DTYPE)
+
+    @property
+    def total_rows(self) -> int:
+        return int(self.index["rows"].sum()) if len(self.index) else 0
+
+    def _open_column(self, chunk_id: int, name: str) -> np.ndarray:
+        return np.load(os.path.join(_chunk_dir(self.mission_dir, chunk_id), f"{name}.npy"), mmap_mode="r")
+
+    def _query(self, key: str, lo_col: str, hi_col: str, start: int, end: int,
+               columns: Optional[List[str]]) -> Dict[str, np.ndarray]:
+        columns = columns or list(COLUMNS)
+        # 分块按写入顺序排列，lo/hi 单调不减，可直接二分
+        first = int(np.searchsorted(self.index[hi_col], start, side="left"))
+        last = int(np.searchsorted(self.index[lo_col], end, side="right"))
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in columns}
+        for entry in self.index[first:last]:
+            chunk_id = int(entry["chunk_id"])
+            keys = self._open_column(chunk_id, key)
+            i0 = int(np.searchsorted(keys, start, side="left"))
+            i1 = int(np.searchsorted(keys, end, side="right"))
+            if i1 <= i0:
+                continue
+            for name in columns:
+                col = keys if name == key else self._open_column(chunk_id, name)
+                parts[name].append(np.array(col[i0:i1]))
+        return {
+            name: (np.concatenate(chunks) if chunks else np.zeros(0, dtype=COLUMNS[name]))
+            for name, chunks in parts.items()
+        }
+
+    def query_time(self, start_ms: int, end_ms: int, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """查询 [start_ms, end_ms] 时间窗内的检测（闭区间）"""
+        return self._query("ts_ms", "ts_min", "ts_max", start_ms, end_ms, columns)
+
+    def query_frames(self, first_frame: int, last_frame: int,
+                     columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """查询 [first_frame, last_frame] 帧范围内的检测（闭区间）"""
+        return self._query("frame_id", "frame_min", "frame_max", first_frame, last_frame, columns)
+
+
+# ========================= 命令行 =========================
+def _write_csv(path: str, data: Dict[str, np.ndarray]):
+    names = list(data)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(",".join(names) + "\n")
+        for row in zip(*(data[n].tolist() for n in names)):
+            f.write(",".join(str(v) for v in row) + "\n")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='任务检测日志查询工具')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p_info = sub.add_parser('info', help='查看任务日志概况')
+    p_info.add_argument('mission_dir', type=str, help='任务目录')
+
+    p_query = sub.add_parser('query', help='按时间窗或帧范围查询')
+    p_query.add_argument('mission_dir', type=str, help='任务目录')
+    p_query.add_argument('--start', type=int, default=None, help='起始时间戳(ms)')
+    p_query.add_argument('--end', type=int, default=None, help='结束时间戳(ms)')
+    p_query.add_argument('--last-seconds', type=float, default=None, help='查询日志末尾 N 秒')
+    p_query.add_argument('--frames', type=int, nargs=2, default=None, help='帧范围（闭区间）')
+    p_query.add_argument('--csv', type=str, default=None, help='结果写入 CSV 文件')
+
+    p_check = sub.add_parser('selftest', help='自检：在临时目录写入、续写并查询，检查帧号连续')
+    p_check.add_argument('--runs', type=int, default=3, help='续写次数')
+    p_check.add_argument('--frames', type=int, default=50, help='每次写入帧数')
+    return parser.parse_args()
+
+
+def selftest(runs: int, frames: int, chunk_rows: int = 16) -> List[str]:
+    """模拟多次运行续写同一任务目录（帧号按 detect.py 的方式从 1 开始），返回发现的问题"""
+    import tempfile
+
+    det = {"center_x": 1.0, "center_y": 2.0, "width": 3.0, "height": 4.0, "confidence": 0.5, "class_id": 0}
+    problems: List[str] = []
+    with tempfile.TemporaryDirectory() as mission_dir:
+        ts = 1_000_000
+        for _ in range(runs):
+            writer = DetectionLogWriter(mission_dir, chunk_rows=chunk_rows)
+            for frame in range(1, frames + 1):
+                writer.append(frame, ts, [det, det])
+                ts += 40
+            writer.close()
+        log = DetectionLog(mission_dir)
+        ids = np.unique(log.query_frames(0, runs * frames + 1)["frame_id"])
+        expected = np.arange(1, runs * frames + 1)
+        if not np.array_equal(ids, expected):
+            missing = np.setdiff1d(expected, ids)[:10].tolist()
+            extra = np.setdiff1d(ids, expected)[:10].tolist()
+            problems.append(f"帧号不连续：缺少 {missing}，多出 {extra}")
+        for name in ("frame_min", "frame_max", "ts_min", "ts_max"):
+            if np.any(np.diff(log.index[name]) < 0):
+                problems.append(f"index.{name} 不单调")
+        # 跨越续写边界的帧范围查询
+        lo, hi = frames - 2, frames + 3
+        got = np.unique(log.query_frames(lo, hi)["frame_id"]).tolist()
+        if got != list(range(lo, hi + 1)):
+            problems.append(f"帧范围 [{lo}, {hi}] 查询结果为 {got}")
+    return problems
+
+
+def main():
+    args = parse_arguments()
+    if args.cmd == 'selftest':
+        problems = selftest(args.runs, args.frames)
+        if problems:
+            for p in problems:
+                print(f"❌ {p}")
+            raise SystemExit(1)
+        print(f"✅ 自检通过：{args.runs} 次续写，帧号 1 ~ {args.runs * args.frames} 连续")
+        return
+
+    log = DetectionLog(args.mission_dir)
+
+    if args.cmd == 'info':
+        print(f"📁 任务目录: {args.mission_dir}")
+        print(f"  视频源: {log.meta.get('source')}")
+        print(f"  分块数: {len(log.index)}")
+        print(f"  总检测: {log.total_rows}")
+        if len(log.index):
+            ts_min, ts_max = int(log.index['ts_min'][0]), int(log.index['ts_max'][-1])
+            print(f"  时间范围: {ts_min} ~ {ts_max}（{(ts_max - ts_min) / 1000.0:.1f}s）")
+            print(f"  帧范围: {int(log.index['frame_min'][0])} ~ {int(log.index['frame_max'][-1])}")
+        return
+
+    t0 = time.perf_counter()
+    if args.frames:
+        data = log.query_frames(args.frames[0], args.frames[1])
+    else:
+        if not len(log.index):
+            print("⚠️ 日志为空")
+            return
+        end = args.end if args.end is not None else int(log.index['ts_max'][-1])
+        if args.last_seconds is not None:
+            start = end - int(args.last_seconds * 1000)
+        else:
+            start = args.start if args.start is not None else int(log.index['ts_min'][0])
+        data = log.query_time(start, end)
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+    rows = len(data['ts_ms'])
+    frames = len(np.unique(data['frame_id'])) if rows else 0
+    print(f"🔎 命中 {rows} 条检测 / {frames} 帧，耗时 {elapsed_ms:.2f} ms")
+    if args.csv:
+        _write_csv(args.csv, data)
+        print(f"💾 已写入: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+ffmpeg 管道解码采集（cv2.VideoCapture 的替代后端）
+
+- ffmpeg 多线程解码（-threads），可在解码阶段直接缩放（只需 1280x720 时不必先出全分辨率）
+- stdout 输出 bgr24 rawvideo，用 readinto 直接读入预分配的 NumPy 缓冲区，不为每帧新分配内存
+- 缓冲区按环形复用：环大小必须大于下游可能同时持有的帧数（采集队列 + 结果队列 + 正在处理的帧），
+  由调用方根据队列长度传入 ring_size；传入 FramePool 时改为从池中取缓冲区，由下游显式归还
+
+基准测试（同一文件对比解码 FPS 与 CPU）：
+    python ffmpeg_capture.py bench DJI_20250308135111_0001_S.MP4 --decode-size 1280x720 --threads 4
+"""
+
+import argparse
+import queue
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional, List, Tuple
+
+import cv2
+import numpy as np
+
+from frame_pool import FramePool
+
+
+def parse_size(text: Optional[str]) -> Optional[Tuple[int, int]]:
+    """'1280x720' -> (1280, 720)"""
+    if not text:
+        return None
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def _input_args(source) -> List[str]:
+    # 摄像头索引映射为 v4l2 设备（Linux）
+    if isinstance(source, int):
+        return ["-f", "v4l2", "-i", f"/dev/video{source}"]
+    return ["-i", str(source)]
+
+
+def probe_size(source) -> Optional[Tuple[int, int]]:
+    """解析 `ffmpeg -i` 的输出获取视频分辨率（不依赖 ffprobe）"""
+    proc = subprocess.run(["ffmpeg", "-hide_banner"] + _input_args(source),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in proc.stderr.splitlines():
+        if "Video:" in line:
+            m = re.search(r"\b(\d{2,5})x(\d{2,5})\b", line)
+            if m:
+                return int(m.group(1)), int(m.group(2))
+    return None
+
+
+class FfmpegFrameReader:
+    """启动 ffmpeg 解码进程，按帧 readinto 到环形缓冲区"""
+
+    def __init__(self, source, decode_threads: int = 0, output_size: Optional[Tuple[int, int]] = None,
+                 ring_size: int = 24):
+        self.source = source
+        self.decode_threads = decode_threads
+        # 只有显式指定尺寸时才在解码端缩放
+        self.scale = output_size is not None
+        self.output_size = output_size or probe_size(source)
+        if self.output_size is None:
+            raise RuntimeError(f"无法获取视频分辨率: {source}")
+        w, h = self.output_size
+        self.frame_bytes = w * h * 3
+        self.ring = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(ring_size)]
+        self.next_slot = 0
+        self.proc: Optional[subprocess.Popen] = None
+
+    def open(self):
+        cmd = ["ffmpeg", "-loglevel", "error", "-threads", str(self.decode_threads)]
+        cmd += _input_args(self.source)
+        cmd += ["-an", "-sn"]
+        if self.scale:
+            cmd += ["-vf", f"scale={self.output_size[0]}:{self.output_size[1]}"]
+        cmd += ["-pix_fmt", "bgr24", "-f", "rawvideo", "-"]
+        # bufsize=0：stdout 为原始文件对象，readinto 直接写入目标缓冲区
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+
+    def read(self, out: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """读取下一帧到 out（未给出则用环中的下一块缓冲区）；EOF 返回 None"""
+        buf = self.ring[self.next_slot] if out is None else out
+        view = memoryview(buf.reshape(-1))
+        got = 0
+        while got < self.frame_bytes:
+            n = self.proc.stdout.readinto(view[got:])
+            if not n:
+                return None
+            got += n
+        if out is None:
+            self.next_slot = (self.next_slot + 1) % len(self.ring)
+        return buf
+
+    def close(self):
+        if self.proc:
+            try:
+                self.proc.stdout.close()
+                self.proc.terminate()
+                self.proc.wait(timeout=2)
+            except Exception:
+                self.proc.kill()
+            finally:
+                self.proc = None
+
+
+# ========================= 采集线程 =========================
+class FfmpegCaptureThread(threading.Thread):
+    """与 detect.CaptureThread 接口一致"""
+
+    def __init__(self, source, frame_queue: queue.Queue, stop_event: threading.Event,
+                 frame_ready: Optional[threading.Event] = None, name: str = "src0",
+                 decode_threads: int = 0, output_size: Optional[Tuple[int, int]] = None, ring_size: int = 24,
+                 pool: Optional[FramePool] = None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.frame_queue = frame_queue
+        self.stop_event = stop_event
+        self.frame_ready = frame_ready
+        self.source_name = name
+        self.decode_threads = decode_threads
+        self.output_size = output_size
+        self.pool = pool
+        # 使用池时不需要环形缓冲区
+        self.ring_size = 0 if pool else ring_size
+
+    def run(self):
+        try:
+            reader = FfmpegFrameReader(self.source, self.decode_threads, self.output_size, self.ring_size)
+            reader.open()
+        except Exception as e:
+            print(f"❌ 无法打开视频源 [{self.source_name}]: {e}")
+            return
+        w, h = reader.output_size
+        print(f"🎥 FfmpegCaptureThread 启动 [{self.source_name}] {w}x{h} 解码线程={self.decode_threads or 'auto'}")
+        shape = (h, w, 3)
+        while not self.stop_event.is_set():
+            buf = self.pool.acquire(shape) if self.pool else None
+            frame = reader.read(buf)
+            if frame is None:
+                if self.pool:
+                    self.pool.release(buf)
+                print(f"⚠️ 读取帧失败/结束，停止采集 [{self.source_name}]")
+                break
+            try:
+                self.frame_queue.put(frame, timeout=0.5)
+                if self.frame_ready:
+                    self.frame_ready.set()
+            except queue.Full:
+                # 丢帧时该缓冲区直接在下一轮被复用
+                if self.pool:
+                    self.pool.release(frame)
+                print(f"⚠️ 采集队列已满，丢弃帧 [{self.source_name}]")
+        reader.close()
+        print(f"🎥 FfmpegCaptureThread 结束 [{self.source_name}]")
+
+
+# ========================= 基准测试 =========================
+def _cpu_seconds(who) -> float:
+    r = resource.getrusage(who)
+    return r.ru_utime + r.ru_stime
+
+
+def bench_videocapture(path: str, size: Optional[Tuple[int, int]], max_frames: int):
+    cpu0 = _cpu_seconds(resource.RUSAGE_SELF)
+    t0 = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    frames = 0
+    while frames < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if size and (frame.shape[1], frame.shape[0]) != size:
+            frame = cv2.resize(frame, size)
+        frames += 1
+    cap.release()
+    wall = time.perf_counter() - t0
+    return frames, wall, _cpu_seconds(resource.RUSAGE_SELF) - cpu0
+
+
+def bench_ffmpeg(path: str, size: Optional[Tuple[int, int]], threads: int, max_frames: int):
+    # 探测分辨率的子进程不计入解码开销
+    reader = FfmpegFrameReader(path, threads, size, ring_size=4)
+    cpu0 = _cpu_seconds(resource.RUSAGE_SELF)
+    child0 = _cpu_seconds(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    reader.open()
+    frames = 0
+    while frames < max_frames and reader.read() is not None:
+        frames += 1
+    reader.close()
+    wall = time.perf_counter() - t0
+    cpu = (_cpu_seconds(resource.RUSAGE_SELF) - cpu0) + (_cpu_seconds(resource.RUSAGE_CHILDREN) - child0)
+    return frames, wall, cpu
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='ffmpeg 管道解码采集')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_bench = sub.add_parser('bench', help='对比 cv2.VideoCapture 与 ffmpeg 管道解码')
+    p_bench.add_argument('path', type=str, help='视频文件')
+    p_bench.add_argument('--decode-size', type=str, default=None, help='输出尺寸，如 1280x720；默认原始分辨率')
+    p_bench.add_argument('--threads', type=int, default=0, help='ffmpeg 解码线程数，0 为自动')
+    p_bench.add_argument('--max-frames', type=int, default=sys.maxsize, help='最多解码帧数')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    size = parse_size(args.decode_size)
+    print(f"🧪 基准测试: {args.path}  输出尺寸={args.decode_size or '原始'}")
+    rows = [
+        ("cv2.VideoCapture", bench_videocapture(args.path, size, args.max_frames)),
+        (f"ffmpeg(threads={args.threads or 'auto'})", bench_ffmpeg(args.path, size, args.threads, args.max_frames)),
+    ]
+    print("\n📊 结果:")
+    for label, (frames, wall, cpu) in rows:
+        fps = frames / wall if wall > 0 else 0.0
+        print(f"  {label:<22} 帧数 {frames:>6}  FPS {fps:>7.1f}  CPU {cpu:>6.2f}s（{cpu / wall * 100 if wall else 0:.0f}%）  "
+              f"每帧 CPU {cpu / frames * 1000 if frames else 0:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
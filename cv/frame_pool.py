@@ -0,0 +1,58 @@
+"""
+帧缓冲区池
+
+每帧要分配多块整帧大小的数组（采集帧、标注帧、显示拼接、推流缩放），25fps 下分配器压力很大。
+FramePool 按 (shape, dtype) 维护空闲列表，各阶段显式交接所有权：
+
+    采集线程 acquire -> 放入队列（所有权交给推理线程）
+    推理线程 acquire 标注帧 -> 连同原始帧放入结果队列（所有权交给主线程）
+    主线程用完后 release 原始帧 / 标注帧 / 显示缓冲区
+
+规则：谁持有谁负责 release；release 之后不得再访问该数组。
+丢帧、推理失败等分支同样要 release，否则池会不断扩容（可从 stats() 的 created 观察）。
+"""
+
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class FramePool:
+    def __init__(self, name: str = "frames"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.free: Dict[Tuple, List[np.ndarray]] = {}
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+
+    def acquire(self, shape, dtype=np.uint8) -> np.ndarray:
+        """取得一块缓冲区的所有权（内容未初始化）"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            bucket = self.free.get(key)
+            if bucket:
+                self.reused += 1
+                return bucket.pop()
+            self.created += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, *bufs):
+        """归还缓冲区；None 会被忽略，外部分配的数组也会被收编复用"""
+        with self.lock:
+            for buf in bufs:
+                if buf is None or not buf.flags.c_contiguous or buf.base is not None:
+                    continue
+                key = (buf.shape, buf.dtype.str)
+                self.free.setdefault(key, []).append(buf)
+                self.released += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "released": self.released,
+                "free": sum(len(b) for b in self.free.values()),
+            }
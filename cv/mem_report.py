@@ -0,0 +1,83 @@
+"""
+内存报告：tracemalloc + RSS 随时间变化
+
+主线程每处理完一帧调用一次 tick()：
+- transient：自上一帧以来 tracemalloc 峰值相对上一帧结束时的增量，
+  即这一帧期间（所有线程）临时分配的高水位，反映分配器抖动
+- growth：本帧结束时相对上一帧结束时的常驻增量，长期为正说明有泄漏
+NumPy / OpenCV 返回的数组都通过 NumPy 分配器登记到 tracemalloc，因此整帧数组会被统计到。
+
+每 sample_every 帧写一行 CSV（时间、帧号、RSS、tracemalloc 当前值、窗口内平均 transient/growth），
+结束时打印稳态（跳过 warmup_frames 帧预热）的每帧平均值，便于对比 --frame-pool 开关前后。
+"""
+
+import os
+import resource
+import time
+import tracemalloc
+from typing import List
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        # 非 Linux：退化为峰值 RSS（macOS 单位为字节，Linux 为 KB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if peak > 1 << 30 else peak / 1024
+
+
+class MemoryReporter:
+    def __init__(self, path: str, warmup_frames: int = 50, sample_every: int = 25):
+        self.path = path
+        self.warmup_frames = warmup_frames
+        self.sample_every = sample_every
+        self.frames = 0
+        self.start = time.time()
+        self.window_transient: List[int] = []
+        self.window_growth: List[int] = []
+        self.steady_transient = 0
+        self.steady_growth = 0
+        self.steady_frames = 0
+        self.rss_start = rss_mb()
+        tracemalloc.start()
+        self.last_current = tracemalloc.get_traced_memory()[0]
+        self.f = open(path, "w", encoding="utf-8")
+        self.f.write("elapsed_s,frame,rss_mb,traced_mb,transient_kb_per_frame,growth_kb_per_frame\n")
+        print(f"🧮 内存报告已开启: {path}")
+
+    def tick(self):
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        transient = max(peak - self.last_current, 0)
+        growth = current - self.last_current
+        self.last_current = current
+        self.frames += 1
+
+        self.window_transient.append(transient)
+        self.window_growth.append(growth)
+        if self.frames > self.warmup_frames:
+            self.steady_transient += transient
+            self.steady_growth += growth
+            self.steady_frames += 1
+
+        if self.frames % self.sample_every == 0:
+            n = len(self.window_transient)
+            self.f.write(f"{time.time() - self.start:.2f},{self.frames},{rss_mb():.1f},{current / 1024 / 1024:.1f},"
+                         f"{sum(self.window_transient) / n / 1024:.1f},{sum(self.window_growth) / n / 1024:.1f}\n")
+            self.f.flush()
+            self.window_transient.clear()
+            self.window_growth.clear()
+
+    def close(self):
+        tracemalloc.stop()
+        self.f.close()
+        print("\n🧮 内存报告:")
+        print(f"  RSS: {self.rss_start:.1f} MB -> {rss_mb():.1f} MB")
+        if self.steady_frames:
+            print(f"  稳态每帧临时分配峰值: {self.steady_transient / self.steady_frames / 1024 / 1024:.2f} MB"
+                  f"（{self.steady_frames} 帧，跳过前 {self.warmup_frames} 帧）")
+            print(f"  稳态每帧常驻增长: {self.steady_growth / self.steady_frames / 1024:.1f} KB")
+        print(f"  明细: {self.path}")
@@ -0,0 +1,638 @@
+"""
+声明式流水线：阶段、队列和放置方式写在 JSON 配置里（detect.py --pipeline）
+
+detect.py 默认布局固定为“采集线程 + 推理线程 + 主线程做其余所有事”。流水线模式把处理拆成阶段：
+    capture -> preprocess -> inference -> extract -> annotate -> publish -> encode -> display
+按配置决定每个阶段放在哪里、阶段之间的队列多长、队列满了怎么办，便于按部署机器的核数重新分配。
+
+配置（pipelines/threaded.json 的线程划分与默认布局相同，功能范围见下文“支持的功能”）：
+    {
+      "name": "threaded",
+      "stages": [
+        {"stage": "capture",    "placement": "thread", "options": {"realtime": true}},
+        {"stage": "preprocess", "placement": "inline"},
+        {"stage": "inference",  "placement": "thread", "queue": 8, "overflow": "drop_newest"},
+        {"stage": "extract",    "placement": "inline"},
+        {"stage": "annotate",   "placement": "main",   "queue": 8},
+        ...
+      ]
+    }
+- 阶段按列表顺序串成一条链，可以省略不需要的阶段（如无界面时不要 display），capture 必须在最前
+- placement
+    thread   独立线程
+    process  独立进程（spawn）：阶段在子进程内初始化（加载模型、启动 ffmpeg），跨进程的数据要序列化，
+             1280x720 一帧约 2.7 MB，进程边界应放在计算量远大于拷贝的位置
+    main     主线程，最多一个；display 必须在主线程（cv2.imshow）
+    inline   与上一阶段在同一线程/进程里串行执行，中间没有队列
+- queue / overflow：该阶段输入队列的长度（默认 8）与满时的策略（inline 阶段没有输入队列）
+    block        生产方等待，反压传到上游（默认）
+    drop_oldest  丢掉队列里最旧的一项再放入，保持实时
+    drop_newest  丢掉新来的这一项
+- options：传给阶段的参数，如 capture 的 {"realtime": true} 按视频帧率读取文件（模拟机载实时流），
+  去掉则尽快读取，用于测最大吞吐
+
+各段初始化完成（模型加载、推流启动）后才开始采集；汇总的耗时从第一帧采集到最后一帧完成。
+
+支持的功能（流水线模式用于比较阶段放置方式，只实现主干处理）：
+    单路视频源（OpenCV 读取）、--decode-size、--stride、--model / --device / --conf / --iou / --classes、
+    Redis 发布（--redis-* / --disable-redis / --delta / --delta-only）、推流与录像（--rtmp-url / --no-rtmp / --record-*）
+不支持、给出时直接报错（见 UNSUPPORTED_FLAGS）：
+    --capture-backend ffmpeg、--frame-pool、--mem-report、--control-redis / --control-port、--abr、
+    --profile-torch（采样分析）、--class-route、--max-batch、--heatmap、--crops、--log-dir、多路 --source
+
+process 阶段的启动开销：
+    spawn 子进程会重新导入主模块。从 detect.py 启动时，每个 process 段都要重新执行 detect.py 的顶层导入，
+    包括 torch 与 ultralytics（数秒、数百 MB 内存），与该段实际运行哪些阶段无关，
+    把阶段实现挪出 detect.py 也避免不了。这部分时间在各段就绪之前，不计入汇总耗时；
+    process 段数量按可用内存控制，不适合只跑 display 之类的轻量阶段。
+
+对比布局（同一段视频依次运行，最后打印对比表）：
+    python detect.py --source street.mp4 --disable-redis --rtmp-url /tmp/out.flv \\
+        --pipeline pipelines/serial.json pipelines/threaded.json pipelines/split.json
+"""
+
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+import cv2
+import numpy as np
+
+PLACEMENTS = ("main", "thread", "process", "inline")
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+DEFAULT_QUEUE_SIZE = 8
+
+# 子进程用 spawn 启动：不继承父进程的 CUDA 上下文与线程，Windows 上行为一致
+_mp = mp.get_context("spawn")
+
+
+# ========================= 运行时 =========================
+class Stage:
+    """
+    阶段基类。实例在所属的线程/进程里构造并 open()；
+    process 返回交给下一阶段的数据，返回 None 表示该项到此为止。
+    """
+    source = False
+    # 必须出现在本阶段之前的阶段（它们写入本阶段要读的字段）
+    requires: tuple = ()
+
+    def __init__(self, args, options: Optional[Dict[str, Any]] = None):
+        self.args = args
+        self.options = options or {}
+        # 由运行时在 open() 前设置，阶段可借此结束整条流水线（如 display 按 ESC）
+        self.stop_event = None
+
+    def open(self):
+        pass
+
+    def process(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return item
+
+    def close(self):
+        pass
+
+
+class SourceStage(Stage):
+    source = True
+    # 按帧率读取时的等待时间，不计入阶段耗时
+    idle_s = 0.0
+
+    def items(self):
+        raise NotImplementedError
+
+
+class StageQueue:
+    """阶段之间的有界队列；统计由生产方记录，随生产方的汇总一起上报"""
+
+    def __init__(self, size: int, overflow: str, cross_process: bool):
+        self.q = _mp.Queue(size) if cross_process else queue.Queue(size)
+        self.cross_process = cross_process
+        self.overflow = overflow
+        self.stats = {"put": 0, "dropped": 0, "max_depth": 0}
+
+    def put(self, item: Dict[str, Any], stop_event):
+        if self.overflow == "block":
+            while not stop_event.is_set():
+                try:
+                    self.q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            else:
+                return
+        elif self.overflow == "drop_newest":
+            try:
+                self.q.put_nowait(item)
+            except queue.Full:
+                self.stats["dropped"] += 1
+                return
+        else:
+            while True:
+                try:
+                    self.q.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.q.get_nowait()
+                        self.stats["dropped"] += 1
+                    except queue.Empty:
+                        pass
+        self.stats["put"] += 1
+        try:
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.q.qsize())
+        except NotImplementedError:
+            # macOS 的 multiprocessing.Queue 不支持 qsize
+            pass
+
+    def put_end(self, stop_event):
+        """结束标记（None）不受丢弃策略影响"""
+        while not stop_event.is_set():
+            try:
+                self.q.put(None, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, stop_event) -> Optional[Dict[str, Any]]:
+        while not stop_event.is_set():
+            try:
+                return self.q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def abandon(self):
+        """中途停止时不再等待未被取走的数据写完，避免子进程退出时卡住"""
+        if self.cross_process:
+            self.q.cancel_join_thread()
+
+
+def load_config(path: str, registry: Dict[str, type]) -> Dict[str, Any]:
+    """读取并校验配置，按 inline 把阶段合并为段（每段一个线程/进程）"""
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    stages = config.get("stages") or []
+    if not stages:
+        raise ValueError(f"{path}: 没有定义 stages")
+    segments: List[Dict[str, Any]] = []
+    for i, spec in enumerate(stages):
+        name = spec.get("stage")
+        placement = spec.get("placement", "thread")
+        if name not in registry:
+            raise ValueError(f"{path}: 未知阶段 {name}，可选 {', '.join(registry)}")
+        if placement not in PLACEMENTS:
+            raise ValueError(f"{path}: 阶段 {name} 的 placement 应为 {'/'.join(PLACEMENTS)}")
+        if registry[name].source != (i == 0):
+            raise ValueError(f"{path}: 阶段 {name} " + ("必须在最前" if registry[name].source else "不能作为第一个阶段"))
+        earlier = [s.get("stage") for s in stages[:i]]
+        missing = [r for r in registry[name].requires if r not in earlier]
+        if missing:
+            raise ValueError(f"{path}: 阶段 {name} 需要前面有 {', '.join(missing)}")
+        if placement == "inline":
+            if "queue" in spec or "overflow" in spec:
+                raise ValueError(f"{path}: inline 阶段 {name} 没有输入队列，不能设置 queue/overflow")
+            segments[-1]["stages"].append(name)
+            segments[-1]["options"].append(spec.get("options") or {})
+            continue
+        overflow = spec.get("overflow", "block")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"{path}: 阶段 {name} 的 overflow 应为 {'/'.join(OVERFLOW_POLICIES)}")
+        segments.append({"stages": [name], "placement": placement, "options": [spec.get("options") or {}],
+                         "queue": int(spec.get("queue", DEFAULT_QUEUE_SIZE)), "overflow": overflow})
+    if sum(seg["placement"] == "main" for seg in segments) > 1:
+        raise ValueError(f"{path}: 最多一个阶段放在主线程（main），其余用 inline 串在它后面")
+    for seg in segments:
+        if "display" in seg["stages"] and seg["placement"] != "main":
+            raise ValueError(f"{path}: display 必须在主线程（placement 为 main，或 inline 跟在 main 阶段后）")
+    return {"name": config.get("name") or os.path.splitext(os.path.basename(path))[0], "segments": segments}
+
+
+def _run_segment(index: int, names: List[str], classes: List[type], options: List[Dict[str, Any]], args,
+                 in_q: Optional[StageQueue], out_q: Optional[StageQueue], stop_event, ready, stats_q):
+    """一段阶段的执行体：线程和子进程共用；ready 为所有段共用的屏障，全部初始化完才开始处理"""
+    stats: Dict[str, Any] = {"segment": index, "latency_ms": [], "queue": None, "t_first": None, "t_last": None,
+                             "stages": {name: {"items": 0, "busy_s": 0.0} for name in names}}
+    stages: List[Stage] = []
+
+    def push(item, start: int):
+        for name, stage in zip(names[start:], stages[start:]):
+            t0 = time.perf_counter()
+            item = stage.process(item)
+            st = stats["stages"][name]
+            st["busy_s"] += time.perf_counter() - t0
+            st["items"] += 1
+            if item is None:
+                return
+        if out_q:
+            out_q.put(item, stop_event)
+        else:
+            stats["t_last"] = time.time()
+            stats["latency_ms"].append((stats["t_last"] - item["ts"]) * 1000.0)
+
+    try:
+        try:
+            for cls, opts in zip(classes, options):
+                stage = cls(args, opts)
+                stage.stop_event = stop_event
+                stage.open()
+                stages.append(stage)
+        except Exception:
+            # 让其他段不再等待屏障
+            ready.abort()
+            raise
+        ready.wait(timeout=300)
+        if stages[0].source:
+            it = iter(stages[0].items())
+            src = stats["stages"][names[0]]
+            while not stop_event.is_set():
+                t0, idle0 = time.perf_counter(), stages[0].idle_s
+                item = next(it, None)
+                src["busy_s"] += time.perf_counter() - t0 - (stages[0].idle_s - idle0)
+                if item is None:
+                    break
+                if stats["t_first"] is None:
+                    stats["t_first"] = item["ts"]
+                src["items"] += 1
+                push(item, 1)
+        else:
+            while True:
+                item = in_q.get(stop_event)
+                if item is None:
+                    break
+                push(item, 0)
+    except (KeyboardInterrupt, threading.BrokenBarrierError):
+        stop_event.set()
+    except Exception as e:
+        print(f"❌ 流水线阶段 {'+'.join(names)} 异常: {e}")
+        stop_event.set()
+    finally:
+        if out_q:
+            out_q.put_end(stop_event)
+            if stop_event.is_set():
+                out_q.abandon()
+            stats["queue"] = out_q.stats
+        for stage in stages:
+            try:
+                stage.close()
+            except Exception as e:
+                print(f"⚠️ 关闭阶段 {type(stage).__name__} 失败: {e}")
+        stats_q.put(stats)
+
+
+class Pipeline:
+    def __init__(self, config: Dict[str, Any], registry: Dict[str, type], args):
+        self.name = config["name"]
+        self.segments = config["segments"]
+        self.registry = registry
+        self.args = args
+
+    def run(self) -> Dict[str, Any]:
+        segs = self.segments
+        use_mp = any(seg["placement"] == "process" for seg in segs)
+        stop_event = _mp.Event() if use_mp else threading.Event()
+        stats_q = _mp.Queue() if use_mp else queue.Queue()
+        ready = _mp.Barrier(len(segs)) if use_mp else threading.Barrier(len(segs))
+        # 第 i 个队列是第 i 段的输入；任一端在子进程里时用跨进程队列
+        queues: List[Optional[StageQueue]] = [None] + [
+            StageQueue(seg["queue"], seg["overflow"],
+                       cross_process="process" in (seg["placement"], segs[i - 1]["placement"]))
+            for i, seg in enumerate(segs) if i > 0
+        ]
+        print(f"🧩 流水线 {self.name}: " + " | ".join(
+            f"{'+'.join(seg['stages'])}@{seg['placement']}" for seg in segs))
+
+        workers = []
+        main_call = None
+        for i, seg in enumerate(segs):
+            call = (i, seg["stages"], [self.registry[n] for n in seg["stages"]], seg["options"], self.args,
+                    queues[i], queues[i + 1] if i + 1 < len(segs) else None, stop_event, ready, stats_q)
+            if seg["placement"] == "main":
+                main_call = call
+                continue
+            if seg["placement"] == "process":
+                worker = _mp.Process(target=_run_segment, args=call, daemon=True, name=f"pipeline-{i}")
+            else:
+                worker = threading.Thread(target=_run_segment, args=call, daemon=True, name=f"pipeline-{i}")
+            worker.start()
+            workers.append(worker)
+
+        try:
+            if main_call:
+                _run_segment(*main_call)
+            while any(w.is_alive() for w in workers) and not stop_event.is_set():
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            print("🛑 用户中断")
+            stop_event.set()
+
+        # 先收汇总再等待退出：子进程要等放入队列的数据被取走后才能结束
+        collected = []
+        deadline = time.time() + 10
+        while len(collected) < len(segs) and time.time() < deadline:
+            try:
+                collected.append(stats_q.get(timeout=0.5))
+            except queue.Empty:
+                if main_call is None and not any(w.is_alive() for w in workers):
+                    break
+        stop_event.set()
+        for w in workers:
+            w.join(timeout=5)
+            if isinstance(w, _mp.Process) and w.is_alive():
+                w.terminate()
+        return self._report(collected)
+
+    def _report(self, collected: List[Dict[str, Any]]) -> Dict[str, Any]:
+        by_index = {s["segment"]: s for s in collected}
+        # 从第一帧采集到最后一帧完成，不含各阶段初始化
+        t_first = by_index.get(0, {}).get("t_first")
+        t_last = by_index.get(len(self.segments) - 1, {}).get("t_last")
+        wall_s = t_last - t_first if (t_first and t_last) else 0.0
+        stages, queues = [], []
+        latencies: List[float] = []
+        for i, seg in enumerate(self.segments):
+            s = by_index.get(i)
+            for k, name in enumerate(seg["stages"]):
+                st = s["stages"][name] if s else {"items": 0, "busy_s": 0.0}
+                stages.append({"stage": name, "placement": seg["placement"] if k == 0 else "inline",
+                               "items": st["items"], "busy_s": st["busy_s"]})
+            if i > 0:
+                prev = by_index.get(i - 1)
+                q = (prev or {}).get("queue") or {"put": 0, "dropped": 0, "max_depth": 0}
+                queues.append(dict(q, stage=seg["stages"][0], size=seg["queue"], overflow=seg["overflow"]))
+            if s and i == len(self.segments) - 1:
+                latencies = s["latency_ms"]
+        captured = stages[0]["items"]
+        delivered = len(latencies)
+        return {
+            "name": self.name, "wall_s": wall_s, "captured": captured, "delivered": delivered,
+            "fps": delivered / wall_s if wall_s > 0 else 0.0,
+            "latency_p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+            "latency_p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "dropped": sum(q["dropped"] for q in queues),
+            "stages": stages, "queues": queues,
+        }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n📊 流水线 {report['name']}：{report['wall_s']:.1f}s，采集 {report['captured']} 帧，"
+          f"完成 {report['delivered']} 帧（{report['fps']:.1f} FPS），"
+          f"端到端延迟 p50 {report['latency_p50']:.0f} ms / p95 {report['latency_p95']:.0f} ms")
+    print(f"  {'阶段':<12} {'位置':<8} {'处理数':>7} {'平均ms':>8} {'占用':>6}")
+    for st in report["stages"]:
+        avg_ms = st["busy_s"] / st["items"] * 1000.0 if st["items"] else 0.0
+        busy = st["busy_s"] / report["wall_s"] if report["wall_s"] > 0 else 0.0
+        print(f"  {st['stage']:<12} {st['placement']:<8} {st['items']:>7} {avg_ms:>8.2f} {busy:>6.0%}")
+    for q in report["queues"]:
+        print(f"  队列 -> {q['stage']:<10} 容量 {q['size']:<3} {q['overflow']:<12} "
+              f"放入 {q['put']}，丢弃 {q['dropped']}，最大深度 {q['max_depth']}")
+
+
+def print_comparison(reports: List[Dict[str, Any]]):
+    print("\n📊 布局对比:")
+    print(f"  {'布局':<16} {'FPS':>7} {'完成/采集':>12} {'丢弃':>6} {'p50ms':>7} {'p95ms':>7}")
+    for r in reports:
+        print(f"  {r['name']:<16} {r['fps']:>7.1f} {r['delivered']:>5}/{r['captured']:<6} {r['dropped']:>6} "
+              f"{r['latency_p50']:>7.0f} {r['latency_p95']:>7.0f}")
+
+
+# ========================= 检测阶段 =========================
+# 阶段依赖（torch / ultralytics / ffmpeg 推流）在 open() 里导入，只在实际运行该阶段的线程/进程里初始化；
+# process 段的子进程另会重新导入主模块 detect.py（见模块说明）
+class CaptureStage(SourceStage):
+    """options.realtime：按视频帧率读取（文件源默认尽快读取）"""
+
+    def open(self):
+        source = self.args.source[0]
+        self.cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"无法打开视频源: {source}")
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        self.interval_s = 1.0 / fps if self.options.get("realtime") else 0.0
+        print(f"🎥 采集开始: {source}" + (f"（按 {fps:.0f} FPS 读取）" if self.interval_s else ""))
+
+    def items(self):
+        seq = 0
+        next_t = time.perf_counter()
+        while not self.stop_event.is_set():
+            if self.interval_s:
+                wait = max(0.0, next_t - time.perf_counter())
+                time.sleep(wait)
+                self.idle_s += wait
+                next_t = max(next_t + self.interval_s, time.perf_counter() - self.interval_s)
+            ret, frame = self.cap.read()
+            if not ret:
+                print("⚠️ 读取帧失败/结束，停止采集")
+                return
+            yield {"seq": seq, "ts": time.time(), "frame": frame}
+            seq += 1
+
+    def close(self):
+        self.cap.release()
+
+
+class PreprocessStage(Stage):
+    """可选缩放（--decode-size）并按 --stride 标记需要推理的帧"""
+
+    def open(self):
+        from ffmpeg_capture import parse_size
+
+        self.size = parse_size(self.args.decode_size)
+        self.stride = max(1, self.args.stride)
+
+    def process(self, item):
+        frame = item["frame"]
+        if self.size and (frame.shape[1], frame.shape[0]) != self.size:
+            item["frame"] = cv2.resize(frame, self.size)
+        item["infer"] = item["seq"] % self.stride == 0
+        return item
+
+
+class InferenceStage(Stage):
+    def open(self):
+        import torch
+        from ultralytics import YOLO
+        from class_routing import resolve_classes
+
+        args = self.args
+        self.device = 'cuda:0' if (args.device == 'auto' and torch.cuda.is_available()) else args.device
+        self.model = YOLO(args.model).to(self.device)
+        self.classes = resolve_classes(args.classes, self.model.names) if args.classes else None
+        print(f"✅ 已加载模型: {args.model}（{self.device}）")
+
+    def process(self, item):
+        if item.get("infer", True):
+            item["result"] = self.model.predict(item["frame"], conf=self.args.conf, iou=self.args.iou,
+                                                classes=self.classes, verbose=False, device=self.device)[0]
+        return item
+
+
+class ExtractStage(Stage):
+    """Results 不跨阶段传递；未推理的帧沿用上次检测框画框，但不发布"""
+    requires = ("inference",)
+
+    def open(self):
+        from detect import extract_detections_from_result
+
+        self.extract = extract_detections_from_result
+        self.last_detections: List[Dict[str, Any]] = []
+        self.names = None
+
+    def process(self, item):
+        result = item.pop("result", None)
+        item["inferred"] = result is not None
+        if result is not None:
+            self.last_detections = self.extract(result)
+            self.names = getattr(result, "names", None)
+        item["detections"] = self.last_detections
+        item["names"] = self.names
+        return item
+
+
+class AnnotateStage(Stage):
+    requires = ("extract",)
+
+    def open(self):
+        from detect import draw_detections
+
+        self.draw = draw_detections
+        self.frames = 0
+        self.start = time.time()
+
+    def process(self, item):
+        annotated = item["frame"].copy()
+        self.draw(annotated, item["detections"], item.get("names"))
+        self.frames += 1
+        elapsed = time.time() - self.start
+        stats = [f"FPS: {self.frames / elapsed if elapsed > 0 else 0.0:.1f}", f"Frames: {self.frames}",
+                 f"Detections: {len(item['detections'])}"]
+        for i, txt in enumerate(stats):
+            cv2.putText(annotated, txt, (10, 30 + i * 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        item["annotated"] = annotated
+        return item
+
+
+class PublishStage(Stage):
+    requires = ("extract",)
+
+    def open(self):
+        from redis_publisher import RedisDetectionPublisher
+        from delta_publish import DeltaEncoder, delta_publisher
+        from detect import publish_detections
+
+        self.publish = publish_detections
+        args = self.args
+        self.sink = {"redis": None, "full": True, "delta": None, "delta_redis": None}
+        if args.disable_redis:
+            return
+        # 逐帧打印会干扰布局对比，吞吐看流水线汇总
+        self.sink["redis"] = RedisDetectionPublisher(
+            host=args.redis_host, port=args.redis_port, db=args.redis_db, password=args.redis_password,
+            verbose=False
+        )
+        if args.delta:
+            self.sink["delta_redis"] = delta_publisher(self.sink["redis"])
+        if self.sink["delta_redis"]:
+            self.sink["delta"] = DeltaEncoder(keyframe_s=args.delta_keyframe_s)
+            self.sink["full"] = not args.delta_only
+
+    def process(self, item):
+        if self.sink["redis"]:
+            self.publish(self.sink, item["detections"] if item["inferred"] else [], item["inferred"])
+        return item
+
+    def close(self):
+        if self.sink["delta"]:
+            print(f"  增量发布: {self.sink['delta'].summary(self.sink['full'])}")
+
+
+class EncodeStage(Stage):
+    def open(self):
+        from detect import RtmpStreamer
+
+        args = self.args
+        if args.no_rtmp:
+            rtmp_url = None
+        else:
+            rtmp_url = args.rtmp_url[0] if args.rtmp_url else RtmpStreamer.DEFAULT_URL
+        self.streamer = RtmpStreamer(rtmp_url, record_dir=args.record_dir, segment_s=args.segment_time,
+                                     record_format=args.record_format)
+        self.streamer.start()
+
+    def process(self, item):
+        self.streamer.write(item.get("annotated", item["frame"]))
+        return item
+
+    def close(self):
+        self.streamer.close()
+
+
+class DisplayStage(Stage):
+    def process(self, item):
+        disp = cv2.hconcat([item["frame"], item.get("annotated", item["frame"])])
+        dh, dw = disp.shape[:2]
+        cv2.imshow("YOLOv8 流水线 - ESC退出", cv2.resize(disp, (dw // 2, dh // 2)))
+        if cv2.waitKey(1) == 27:
+            print("🛑 用户退出")
+            self.stop_event.set()
+        return item
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+STAGES: Dict[str, type] = {
+    "capture": CaptureStage,
+    "preprocess": PreprocessStage,
+    "inference": InferenceStage,
+    "extract": ExtractStage,
+    "annotate": AnnotateStage,
+    "publish": PublishStage,
+    "encode": EncodeStage,
+    "display": DisplayStage,
+}
+
+
+# 流水线模式未实现的 detect.py 参数：参数名 -> 判断是否给出
+UNSUPPORTED_FLAGS: Dict[str, Any] = {
+    "--capture-backend ffmpeg": lambda a: a.capture_backend != "opencv",
+    "--frame-pool": lambda a: a.frame_pool,
+    "--mem-report": lambda a: a.mem_report,
+    "--control-redis": lambda a: a.control_redis,
+    "--control-port": lambda a: a.control_port is not None,
+    "--abr": lambda a: a.abr,
+    "--profile-torch": lambda a: a.profile_torch,
+    "--class-route": lambda a: a.class_route,
+    "--max-batch": lambda a: a.max_batch is not None,
+    "--heatmap": lambda a: a.heatmap,
+    "--crops": lambda a: a.crops,
+    "--log-dir": lambda a: a.log_dir,
+    "多路 --source": lambda a: len(a.source) > 1,
+}
+
+
+def check_args(args) -> List[str]:
+    """返回流水线模式不支持、但命令行里给出的参数"""
+    return [flag for flag, given in UNSUPPORTED_FLAGS.items() if given(args)]
+
+
+def run_pipelines(paths: List[str], args) -> List[Dict[str, Any]]:
+    """依次运行每个配置（同一输入源），多于一个时打印对比"""
+    unsupported = check_args(args)
+    if unsupported:
+        raise SystemExit(f"❌ 流水线模式不支持: {', '.join(unsupported)}（见 pipeline.py 模块说明）")
+    try:
+        configs = [load_config(path, STAGES) for path in paths]
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ 流水线配置错误: {e}")
+    reports = []
+    for config in configs:
+        report = Pipeline(config, STAGES, args).run()
+        print_report(report)
+        reports.append(report)
+    if len(reports) > 1:
+        print_comparison(reports)
+    return reports
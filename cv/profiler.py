@@ -0,0 +1,210 @@
+"""
+运行中按需采样分析（现场 FPS 下降时定位耗时）
+
+触发方式（detect.py）：
+- 信号：kill -USR1 <pid>                        采样 --profile-seconds 秒
+- 控制通道：{"profile_s": 15, "profile_torch": 1}  经 control.py 的 Redis / HTTP 入口下发
+
+SamplingProfiler 在独立线程里每 interval_ms 读取一次 sys._current_frames()，记录所有线程的调用栈，
+结束后在 profile_dir/profile_YYYYmmdd_HHMMSS/ 下写出：
+- stacks.collapsed   折叠栈（"线程;函数;函数 次数"），可直接用 flamegraph.pl / speedscope 打开
+- summary.txt        每个线程的样本数、自身耗时（栈顶）与包含耗时最高的函数
+- torch_trace.json   （可选）采样期间 model.predict 的 torch.profiler 跟踪，chrome://tracing 打开
+- torch_ops.txt      （可选）按算子汇总的耗时表
+
+采样只反映 Python 栈：线程阻塞在 C 扩展（解码、CUDA 同步、管道写入）时栈顶停在调用它的 Python 函数上。
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, List, Tuple
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class TorchTraceHook:
+    """
+    包裹 model.predict 的 torch.profiler 跟踪。
+    profile 上下文必须在同一线程进入/退出，因此由推理线程在每次 predict 时驱动：
+    有待处理的请求时开始跟踪，到期后在推理线程里停止并导出。
+    没有新帧时推理线程不再调用 predict，由空闲轮询 poll() 按时间停止；
+    推理线程退出前调用 close()，把已采集的部分导出，不会因停流/退出而丢失跟踪。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Optional[Tuple[float, str]] = None
+        self.prof = None
+        self.deadline = 0.0
+        self.out_dir = ""
+        self.calls = 0
+        self.exporting = False
+
+    @property
+    def busy(self) -> bool:
+        """跟踪进行中或正在导出（退出时据此多等推理线程一会儿）"""
+        return self.prof is not None or self.exporting
+
+    def request(self, seconds: float, out_dir: str):
+        with self.lock:
+            self.pending = (seconds, out_dir)
+
+    def _start(self):
+        import torch
+        with self.lock:
+            seconds, self.out_dir = self.pending
+            self.pending = None
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.prof = torch.profiler.profile(activities=activities)
+        self.prof.__enter__()
+        self.deadline = time.time() + seconds
+        self.calls = 0
+        print(f"🔬 torch.profiler 跟踪开始（{seconds:.0f}s）")
+
+    def _stop(self):
+        prof, self.prof = self.prof, None
+        prof.__exit__(None, None, None)
+        os.makedirs(self.out_dir, exist_ok=True)
+        trace_path = os.path.join(self.out_dir, "torch_trace.json")
+        prof.export_chrome_trace(trace_path)
+        sort_by = "cuda_time_total" if any(a.name == "CUDA" for a in prof.activities) else "cpu_time_total"
+        with open(os.path.join(self.out_dir, "torch_ops.txt"), "w", encoding="utf-8") as f:
+            f.write(prof.key_averages().table(sort_by=sort_by, row_limit=40))
+        print(f"🔬 torch.profiler 跟踪结束：{self.calls} 次 predict -> {trace_path}")
+
+    def _finish(self):
+        self.exporting = True
+        try:
+            self._stop()
+        except Exception as e:
+            print(f"⚠️ torch.profiler 导出失败: {e}")
+        finally:
+            self.exporting = False
+
+    def poll(self):
+        """推理线程空闲时调用：跟踪已到期则停止并导出"""
+        if self.prof is not None and time.time() >= self.deadline:
+            self._finish()
+
+    def close(self):
+        """推理线程退出前调用：导出进行中的跟踪，丢弃尚未开始的请求"""
+        with self.lock:
+            self.pending = None
+        if self.prof is not None:
+            self._finish()
+
+    def predict(self, fn, *args, **kwargs):
+        if self.pending and self.prof is None:
+            try:
+                self._start()
+            except Exception as e:
+                print(f"⚠️ torch.profiler 启动失败: {e}")
+                self.prof = None
+        if self.prof is None:
+            return fn(*args, **kwargs)
+        import torch
+        with torch.profiler.record_function("model.predict"):
+            result = fn(*args, **kwargs)
+        self.calls += 1
+        if time.time() >= self.deadline:
+            self._finish()
+        return result
+
+
+class SamplingProfiler:
+    def __init__(self, profile_dir: str = "profiles", interval_ms: float = 10.0, top_n: int = 15):
+        self.profile_dir = profile_dir
+        self.interval_s = interval_ms / 1000.0
+        self.top_n = top_n
+        self.torch_hook = TorchTraceHook()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def capture(self, seconds: float, torch_trace: bool = False) -> Optional[str]:
+        """开始一次后台采样，返回输出目录；已有采样在进行时忽略本次请求"""
+        if self.running:
+            print("⚠️ 已有采样在进行，忽略本次请求")
+            return None
+        out_dir = os.path.join(self.profile_dir, time.strftime("profile_%Y%m%d_%H%M%S"))
+        if torch_trace:
+            self.torch_hook.request(seconds, out_dir)
+        self.thread = threading.Thread(target=self._run, args=(seconds, out_dir), daemon=True, name="profiler")
+        self.thread.start()
+        return out_dir
+
+    def _thread_names(self) -> Dict[int, str]:
+        # 自定义线程类附上类名，便于区分 CaptureThread / InferenceThread
+        return {t.ident: t.name if type(t).__module__ == "threading" else f"{t.name}({type(t).__name__})"
+                for t in threading.enumerate() if t.ident is not None}
+
+    def _run(self, seconds: float, out_dir: str):
+        print(f"🔬 开始采样 {seconds:.0f}s（间隔 {self.interval_s * 1000:.0f} ms）-> {out_dir}")
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        samples: Counter = Counter()
+        names = self._thread_names()
+        deadline = time.perf_counter() + seconds
+        next_tick = time.perf_counter()
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = self._thread_names()
+                labels: List[str] = []
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                thread_name = names.get(ident, str(ident))
+                labels.append(thread_name)
+                stacks[tuple(reversed(labels))] += 1
+                samples[thread_name] += 1
+            next_tick += self.interval_s
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        self._write(out_dir, stacks, samples, seconds)
+
+    def _write(self, out_dir: str, stacks: Counter, samples: Counter, seconds: float):
+        os.makedirs(out_dir, exist_ok=True)
+        with open(os.path.join(out_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{';'.join(s.replace(';', ':') for s in stack)} {count}\n")
+
+        lines = [f"采样 {seconds:.0f}s，间隔 {self.interval_s * 1000:.0f} ms，共 {sum(samples.values())} 个样本", ""]
+        for thread_name, total in samples.most_common():
+            self_time: Counter = Counter()
+            inclusive: Counter = Counter()
+            for stack, count in stacks.items():
+                if stack[0] != thread_name:
+                    continue
+                self_time[stack[-1]] += count
+                # 递归函数在同一个栈里只计一次
+                for label in set(stack[1:]):
+                    inclusive[label] += count
+            lines.append(f"[{thread_name}] {total} 个样本")
+            lines.append("  自身（栈顶）:")
+            lines += [f"    {c / total:6.1%}  {label}" for label, c in self_time.most_common(self.top_n)]
+            lines.append("  包含:")
+            lines += [f"    {c / total:6.1%}  {label}" for label, c in inclusive.most_common(self.top_n)]
+            lines.append("")
+        summary = "\n".join(lines)
+        with open(os.path.join(out_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary)
+        print(f"🔬 采样结束 -> {out_dir}")
+        # 控制台只打印每个线程最热的几个函数
+        for thread_name, total in samples.most_common():
+            top = Counter()
+            for stack, count in stacks.items():
+                if stack[0] == thread_name:
+                    top[stack[-1]] += count
+            hot = "，".join(f"{label} {c / total:.0%}" for label, c in top.most_common(3))
+            print(f"  [{thread_name}] {hot}")
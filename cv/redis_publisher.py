@@ -0,0 +1,279 @@
+"""
+Redis 检测结果发布 + 时间索引
+
+数据结构（与 Java 端 RedisMessageSubscriber 保持一致）：
+- 哈希键: image_metadata:{timestamp_ms}
+  字段: timestamp, center_x, center_y, width, height, confidence(百分比),
+        frame_ts（同一帧所有检测共用的帧时间戳，订阅端据此按帧聚合）, class_id（模型类别编号）
+  可选字段（extra_fields）: op, obj_id（增量发布，见 delta_publish.py），crop_key（目标截图，见 crop_snapshots.py）
+- 频道: image:metadata:updates  消息内容: key 名
+- 时间索引: 有序集合 image_metadata_index，member=哈希键，score=timestamp_ms
+  按哈希过期时间同步裁剪，索引名不落在 image_metadata:* 模式内，不影响按前缀扫描的旧消费者
+
+"最近 N 秒的检测" 只需 ZRANGEBYSCORE + 分批流水线 HGETALL，
+往返次数为 1 + ceil(命中数 / batch_size)，与库中键总数无关。
+
+基准测试（对比 SCAN 全库）：
+    python redis_publisher.py bench --keys 1000000 --window 30
+"""
+
+import argparse
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+import redis
+
+KEY_PREFIX = "image_metadata"
+UPDATES_CHANNEL = "image:metadata:updates"
+KEY_TTL_S = 3600
+# client 参数的默认值：按 host/port 自建连接（与显式传入的 None 区分）
+_OWN_CONNECTION: Any = object()
+
+
+def index_key_for(key_prefix: str) -> str:
+    return f"{key_prefix}_index"
+
+
+def detection_record(det: Dict[str, Any], ts_ms: int, base_ts_ms: int,
+                     extra_fields: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """一条检测对应的哈希字段；extra_fields 中在 det 里存在的字段原样附加"""
+    data = {
+        "timestamp": ts_ms,
+        "center_x": float(det["center_x"]),
+        "center_y": float(det["center_y"]),
+        "width": float(det["width"]),
+        "height": float(det["height"]),
+        "confidence": round(float(det["confidence"]) * 100.0, 2),
+        "frame_ts": base_ts_ms,
+    }
+    if "class_id" in det:
+        data["class_id"] = int(det["class_id"])
+    for name in extra_fields:
+        if name in det:
+            data[name] = det[name]
+    return data
+
+
+class RedisDetectionPublisher:
+    def __init__(self, host: str = '124.71.162.119', port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 key_prefix: str = KEY_PREFIX, channel: str = UPDATES_CHANNEL, ttl_s: int = KEY_TTL_S,
+                 trim_interval_s: float = 5.0, verbose: bool = True, extra_fields: Tuple[str, ...] = (),
+                 client: Any = _OWN_CONNECTION):
+        """
+        client：复用已有连接（同一进程内多个命名空间，如按类别分流），此时不再单独 PING。
+        显式传入 None（上游连接失败）时本发布端同样不可用，不会改连 host 的默认地址
+        """
+        pwd = None if (password in ("", "None", None)) else password
+        if client is _OWN_CONNECTION:
+            self.redis_client = redis.Redis(
+                host=host, port=port, db=db, password=pwd,
+                decode_responses=True, socket_timeout=5, retry_on_timeout=True
+            )
+        else:
+            self.redis_client = client
+        self.key_prefix = key_prefix
+        self.channel = channel
+        self.index_key = index_key_for(key_prefix)
+        self.ttl_s = ttl_s
+        self.trim_interval_s = trim_interval_s
+        self.last_trim = 0.0
+        self.verbose = verbose
+        self.extra_fields = tuple(extra_fields)
+        if client is not _OWN_CONNECTION:
+            return
+        try:
+            self.redis_client.ping()
+            print(f"✅ Redis连接成功: {host}:{port}（{'无密码' if pwd is None else '使用密码'}）")
+        except redis.ConnectionError as e:
+            print(f"❌ Redis连接失败: {host}:{port}，错误：{e}")
+            self.redis_client = None
+
+    def publish_detection_metadata(self, detections_data: List[Dict[str, Any]],
+                                   base_ts_ms: Optional[int] = None) -> bool:
+        """base_ts_ms 默认取当前时间（回放工具传入以便统计键名冲突）"""
+        if not self.redis_client or not detections_data:
+            return False
+        try:
+            if base_ts_ms is None:
+                base_ts_ms = int(time.time() * 1000)
+            # 一帧的所有写入合并为一次往返
+            pipe = self.redis_client.pipeline(transaction=False)
+            for idx, det in enumerate(detections_data):
+                ts_ms = base_ts_ms + idx
+                key = f"{self.key_prefix}:{ts_ms}"
+                data = detection_record(det, ts_ms, base_ts_ms, self.extra_fields)
+                pipe.hset(key, mapping=data)
+                pipe.expire(key, self.ttl_s)
+                pipe.zadd(self.index_key, {key: ts_ms})
+                pipe.publish(self.channel, key)
+            now = time.time()
+            if now - self.last_trim >= self.trim_interval_s:
+                # 索引按哈希 TTL 裁剪，避免指向已过期的键
+                pipe.zremrangebyscore(self.index_key, "-inf", f"({base_ts_ms - self.ttl_s * 1000}")
+                self.last_trim = now
+            pipe.execute()
+            if self.verbose:
+                print(f"📤 已写入 Redis Hash {len(detections_data)} 个: {self.channel}")
+            return True
+        except Exception as e:
+            print(f"❌ Redis发布失败: {e}")
+            return False
+
+    def get_detection_stats(self) -> Dict[str, int]:
+        if not self.redis_client:
+            return {}
+        try:
+            # ZCARD 为 O(1)，替代阻塞式 KEYS
+            return {"total_image:metadata:updates": int(self.redis_client.zcard(self.index_key))}
+        except Exception as e:
+            print(f"获取统计信息失败: {e}")
+            return {}
+
+
+# ========================= 时间窗查询 =========================
+def query_detections(client: redis.Redis, start_ms: int, end_ms: int, key_prefix: str = KEY_PREFIX,
+                     batch_size: int = 1000, limit: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    返回 [start_ms, end_ms] 内的检测哈希（按时间升序）。
+    已过期但尚未从索引裁剪的键会被跳过。
+    """
+    if limit is not None:
+        keys = client.zrangebyscore(index_key_for(key_prefix), start_ms, end_ms, start=0, num=limit)
+    else:
+        keys = client.zrangebyscore(index_key_for(key_prefix), start_ms, end_ms)
+    results: List[Dict[str, str]] = []
+    for i in range(0, len(keys), batch_size):
+        pipe = client.pipeline(transaction=False)
+        for key in keys[i:i + batch_size]:
+            pipe.hgetall(key)
+        results.extend(h for h in pipe.execute() if h)
+    return results
+
+
+def query_recent(client: redis.Redis, seconds: float, key_prefix: str = KEY_PREFIX,
+                 batch_size: int = 1000) -> List[Dict[str, str]]:
+    """最近 seconds 秒内的检测"""
+    now_ms = int(time.time() * 1000)
+    return query_detections(client, now_ms - int(seconds * 1000), now_ms, key_prefix, batch_size)
+
+
+def _scan_detections(client: redis.Redis, start_ms: int, end_ms: int, key_prefix: str,
+                     batch_size: int) -> Tuple[List[Dict[str, str]], int]:
+    """旧做法：SCAN 全部 image_metadata:* 再逐个取哈希过滤，返回 (结果, 往返次数)"""
+    round_trips = 0
+    results: List[Dict[str, str]] = []
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor=cursor, match=f"{key_prefix}:*", count=batch_size)
+        round_trips += 1
+        if keys:
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            round_trips += 1
+            for h in pipe.execute():
+                if h and start_ms <= int(float(h.get("timestamp", 0))) <= end_ms:
+                    results.append(h)
+        if cursor == 0:
+            break
+    return results, round_trips
+
+
+# ========================= 基准测试 =========================
+def _populate(client: redis.Redis, key_prefix: str, n_keys: int, span_s: float, batch: int = 10000) -> int:
+    end_ms = int(time.time() * 1000)
+    start_ms = end_ms - int(span_s * 1000)
+    step = max((end_ms - start_ms) / max(n_keys, 1), 0.001)
+    index_key = index_key_for(key_prefix)
+    for i in range(0, n_keys, batch):
+        pipe = client.pipeline(transaction=False)
+        members = {}
+        for j in range(i, min(i + batch, n_keys)):
+            # 毫秒级时间戳会重复，键名附加序号保证唯一
+            ts_ms = start_ms + int(j * step)
+            key = f"{key_prefix}:{ts_ms}-{j}"
+            pipe.hset(key, mapping={"timestamp": ts_ms, "center_x": 640.0, "center_y": 360.0,
+                                    "width": 40.0, "height": 90.0, "confidence": 80.0})
+            pipe.expire(key, KEY_TTL_S)
+            members[key] = ts_ms
+        pipe.zadd(index_key, members)
+        pipe.execute()
+        print(f"  已写入 {min(i + batch, n_keys)}/{n_keys}", end="\r")
+    print()
+    return end_ms
+
+
+def _cleanup(client: redis.Redis, key_prefix: str, batch: int = 10000):
+    index_key = index_key_for(key_prefix)
+    while True:
+        keys = client.zrange(index_key, 0, batch - 1)
+        if not keys:
+            break
+        pipe = client.pipeline(transaction=False)
+        pipe.unlink(*keys)
+        pipe.zrem(index_key, *keys)
+        pipe.execute()
+    client.unlink(index_key)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Redis 检测时间索引：查询 / 基准测试')
+    parser.add_argument('--redis-host', type=str, default='localhost', help='Redis服务器地址')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
+    parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p_query = sub.add_parser('query', help='查询最近 N 秒的检测')
+    p_query.add_argument('--seconds', type=float, default=30.0, help='时间窗长度（秒）')
+    p_query.add_argument('--key-prefix', type=str, default=KEY_PREFIX, help='哈希键前缀')
+
+    p_bench = sub.add_parser('bench', help='索引查询 vs SCAN 基准测试（写入独立前缀，结束后清理）')
+    p_bench.add_argument('--keys', type=int, default=1_000_000, help='写入的检测键数量')
+    p_bench.add_argument('--span', type=float, default=3600.0, help='检测时间跨度（秒）')
+    p_bench.add_argument('--window', type=float, default=30.0, help='查询时间窗（秒）')
+    p_bench.add_argument('--batch', type=int, default=1000, help='流水线批大小 / SCAN COUNT')
+    p_bench.add_argument('--key-prefix', type=str, default='bench_metadata', help='基准测试键前缀')
+    p_bench.add_argument('--keep', action='store_true', help='测试后保留数据')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    pwd = None if (args.redis_password in ("", "None", None)) else args.redis_password
+    client = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db, password=pwd,
+                         decode_responses=True, socket_timeout=60)
+
+    if args.cmd == 'query':
+        t0 = time.perf_counter()
+        rows = query_recent(client, args.seconds, args.key_prefix)
+        print(f"🔎 最近 {args.seconds:.0f}s 检测 {len(rows)} 条，耗时 {(time.perf_counter() - t0) * 1000:.1f} ms")
+        return
+
+    print(f"🧪 写入 {args.keys} 个检测键（前缀 {args.key_prefix}:，跨度 {args.span:.0f}s）...")
+    end_ms = _populate(client, args.key_prefix, args.keys, args.span)
+    start_ms = end_ms - int(args.window * 1000)
+    try:
+        t0 = time.perf_counter()
+        rows = query_detections(client, start_ms, end_ms, args.key_prefix, args.batch)
+        t_index = time.perf_counter() - t0
+        trips_index = 1 + (len(rows) + args.batch - 1) // args.batch
+
+        t0 = time.perf_counter()
+        rows_scan, trips_scan = _scan_detections(client, start_ms, end_ms, args.key_prefix, args.batch)
+        t_scan = time.perf_counter() - t0
+
+        print("\n📊 基准测试结果:")
+        print(f"  时间窗: 最近 {args.window:.0f}s / 总键数 {args.keys}")
+        print(f"  有序集合索引: {len(rows)} 条, {t_index * 1000:.1f} ms, 往返 {trips_index} 次")
+        print(f"  SCAN 全库:    {len(rows_scan)} 条, {t_scan * 1000:.1f} ms, 往返 {trips_scan} 次")
+        if t_index > 0:
+            print(f"  加速比: {t_scan / t_index:.1f}x")
+    finally:
+        if not args.keep:
+            print("🧹 清理基准测试数据...")
+            _cleanup(client, args.key_prefix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+检测回放 / 压测工具：把录制或合成的检测会话按真实格式写入 Redis，评估 Redis 与订阅端容量
+
+数据源：
+- log        回放 detection_log.py 记录的任务目录，帧间隔取自 ts_ms（过长的空档压缩到 --max-gap）
+- synthetic  合成人群：每帧人数服从泊松分布，均值 --crowd；每帧以 --burst-prob 概率进入
+             持续 --burst-frames 帧、人数放大 --burst-scale 倍的突发段；目标位置做随机游走
+
+写入直接复用 RedisDetectionPublisher（哈希字段、TTL、时间索引、频道通知与 detect.py 完全一致），
+--speed N 按 N 倍速播放，--streams K 模拟 K 路视频源（命名空间与 detect.py 多路模式相同）。
+默认写入独立前缀 replay_metadata / 频道 replay:metadata:updates，结束后清理；
+需要压真实消费者（Java SSE 等）时显式指定 --key-prefix image_metadata --channel image:metadata:updates。
+
+同时在后台线程运行 sub.py 的 AsyncDetectionSubscriber，报告：
+- 发布：目标/实际帧率与检测条数、单帧流水线耗时、调度滞后（发布端跟不上时增大）
+- 键名冲突：键名为 {prefix}:{帧时间戳+序号}，一帧的框数超过帧间隔毫秒数时会覆盖下一帧的键
+- 端到端：订阅端聚合出一帧的时刻 - 发布时刻（包含订阅端 frame_linger_ms 的等待）
+
+用法：
+    python replay.py --redis-host localhost synthetic --crowd 200 --duration 60 --speed 2
+    python replay.py --redis-host localhost log logs/mission_20250308_135111 --speed 4 --streams 3
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+import numpy as np
+import redis.asyncio as aioredis
+
+from detection_log import DetectionLog
+from redis_publisher import RedisDetectionPublisher, KEY_PREFIX, _cleanup
+from sub import AsyncDetectionSubscriber, StatsSink
+
+REPLAY_PREFIX = "replay_metadata"
+REPLAY_CHANNEL = "replay:metadata:updates"
+
+# 一帧 = (距上一帧的秒数, 检测列表)，检测字段与 extract_detections_from_result 一致
+Frame = Tuple[float, List[Dict[str, Any]]]
+
+
+# ========================= 数据源 =========================
+def log_frames(mission_dir: str, max_gap_s: float = 5.0) -> Iterator[Frame]:
+    """按分块读取任务日志，按 frame_id 切分成帧"""
+    log = DetectionLog(mission_dir)
+    last_ts: Optional[int] = None
+    last_frame = -1
+    for entry in log.index:
+        data = log.query_frames(int(entry["frame_min"]), int(entry["frame_max"]))
+        bounds = np.flatnonzero(np.diff(data["frame_id"])) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(data["frame_id"])]):
+            frame_id = int(data["frame_id"][lo])
+            # 跨分块的帧在前一个分块的查询里已完整返回
+            if frame_id <= last_frame:
+                continue
+            last_frame = frame_id
+            ts = int(data["ts_ms"][lo])
+            dt = 0.0 if last_ts is None else min(max(ts - last_ts, 0) / 1000.0, max_gap_s)
+            last_ts = ts
+            yield dt, [
+                {"center_x": float(data["center_x"][i]), "center_y": float(data["center_y"][i]),
+                 "width": float(data["width"][i]), "height": float(data["height"][i]),
+                 "confidence": float(data["confidence"][i]), "class_id": int(data["class_id"][i])}
+                for i in range(lo, hi)
+            ]
+
+
+def synthetic_frames(crowd: float, fps: float, duration_s: float, burst_prob: float = 0.02,
+                     burst_scale: float = 3.0, burst_frames: int = 50, width: int = 1280, height: int = 720,
+                     seed: Optional[int] = None) -> Iterator[Frame]:
+    rng = np.random.default_rng(seed)
+    capacity = max(int(crowd * burst_scale * 2), 16)
+    pos = rng.uniform([0, 0], [width, height], size=(capacity, 2))
+    size = rng.uniform([20, 50], [50, 120], size=(capacity, 2))
+    burst_left = 0
+    for _ in range(int(duration_s * fps)):
+        if burst_left == 0 and rng.random() < burst_prob:
+            burst_left = burst_frames
+        mean = crowd * burst_scale if burst_left else crowd
+        burst_left = max(burst_left - 1, 0)
+        n = min(int(rng.poisson(mean)), capacity)
+        pos += rng.normal(0.0, 3.0, size=pos.shape)
+        np.clip(pos, 0, [width, height], out=pos)
+        conf = rng.uniform(0.5, 0.95, size=n)
+        yield 1.0 / fps, [
+            {"center_x": float(pos[i, 0]), "center_y": float(pos[i, 1]),
+             "width": float(size[i, 0]), "height": float(size[i, 1]), "confidence": float(conf[i]), "class_id": 0}
+            for i in range(n)
+        ]
+
+
+# ========================= 发布 =========================
+class ReplayStream(threading.Thread):
+    """按时间表把帧写入一个 RedisDetectionPublisher"""
+
+    def __init__(self, frames: Iterator[Frame], publisher: RedisDetectionPublisher, speed: float,
+                 stop_event: threading.Event, name: str):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.publisher = publisher
+        self.speed = speed
+        self.stop_event = stop_event
+        self.stream_name = name
+        self.stats = {"frames": 0, "detections": 0, "failed": 0, "collisions": 0, "schedule_s": 0.0}
+        self.publish_ms: List[float] = []
+        self.slip_ms: List[float] = []
+        self.elapsed = 0.0
+
+    def run(self):
+        start = time.monotonic()
+        scheduled = 0.0
+        last_key_ts = -1
+        for dt, detections in self.frames:
+            if self.stop_event.is_set():
+                break
+            scheduled += dt / self.speed
+            delay = start + scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.slip_ms.append(-delay * 1000.0)
+            if not detections:
+                continue
+            base_ts_ms = int(time.time() * 1000)
+            if base_ts_ms <= last_key_ts:
+                # 本帧前几个键与上一帧的键同名，上一帧的数据被覆盖
+                self.stats["collisions"] += min(last_key_ts - base_ts_ms + 1, len(detections))
+            t0 = time.perf_counter()
+            ok = self.publisher.publish_detection_metadata(detections, base_ts_ms=base_ts_ms)
+            self.publish_ms.append((time.perf_counter() - t0) * 1000.0)
+            if not ok:
+                self.stats["failed"] += 1
+                continue
+            last_key_ts = base_ts_ms + len(detections) - 1
+            self.stats["frames"] += 1
+            self.stats["detections"] += len(detections)
+        self.elapsed = time.monotonic() - start
+        self.stats["schedule_s"] = scheduled
+
+
+# ========================= 订阅端 =========================
+class SubscriberThread(threading.Thread):
+    """在独立事件循环里为每个频道运行一个 AsyncDetectionSubscriber，共用一个 StatsSink"""
+
+    def __init__(self, host: str, port: int, db: int, password: Optional[str], channels: List[str],
+                 frame_linger_ms: float):
+        super().__init__(daemon=True)
+        self.client_kwargs = {"host": host, "port": port, "db": db, "password": password, "decode_responses": True}
+        self.channels = channels
+        self.frame_linger_ms = frame_linger_ms
+        self.sink = StatsSink()
+        self.subscribers: List[AsyncDetectionSubscriber] = []
+        self.ready = threading.Event()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stop: Optional[asyncio.Event] = None
+
+    def run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        client = aioredis.Redis(**self.client_kwargs)
+        self.loop = asyncio.get_running_loop()
+        self.stop = asyncio.Event()
+        self.subscribers = [AsyncDetectionSubscriber(client, self.sink, channel=c, frame_linger_ms=self.frame_linger_ms)
+                            for c in self.channels]
+        tasks = [asyncio.create_task(s.run(self.stop)) for s in self.subscribers]
+        await asyncio.sleep(0.5)  # 等待订阅生效
+        self.ready.set()
+        await asyncio.gather(*tasks)
+        await client.aclose()
+
+    def shutdown(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.stop.set)
+        self.join(timeout=10)
+
+    def totals(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for s in self.subscribers:
+            for k, v in s.stats.items():
+                out[k] = out.get(k, 0) + v
+        return out
+
+
+def _pct(values: List[float], p: float) -> float:
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def report(streams: List[ReplayStream], subscriber: Optional[SubscriberThread]):
+    frames = sum(s.stats["frames"] for s in streams)
+    dets = sum(s.stats["detections"] for s in streams)
+    elapsed = max(max(s.elapsed for s in streams), 1e-6)
+    schedule = max(max(s.stats["schedule_s"] for s in streams), 1e-6)
+    publish_ms = [v for s in streams for v in s.publish_ms]
+    slip_ms = [v for s in streams for v in s.slip_ms]
+    print("\n📊 回放结果:")
+    print(f"  路数: {len(streams)}，时长 {elapsed:.1f}s（时间表 {schedule:.1f}s）")
+    print(f"  目标: {frames / schedule:.1f} 帧/秒，{dets / schedule:.0f} 条/秒")
+    print(f"  实际: {frames / elapsed:.1f} 帧/秒，{dets / elapsed:.0f} 条/秒（共 {frames} 帧 / {dets} 条）")
+    print(f"  单帧发布: p50 {_pct(publish_ms, 50):.1f} ms / p95 {_pct(publish_ms, 95):.1f} ms / "
+          f"max {max(publish_ms, default=0.0):.1f} ms")
+    print(f"  调度滞后: {len(slip_ms)} 帧晚于时间表，p95 {_pct(slip_ms, 95):.1f} ms / max {max(slip_ms, default=0.0):.1f} ms")
+    print(f"  发布失败: {sum(s.stats['failed'] for s in streams)} 帧，"
+          f"键名冲突: {sum(s.stats['collisions'] for s in streams)} 条")
+    if subscriber:
+        sink = subscriber.sink
+        totals = subscriber.totals()
+        print(f"  订阅端: 收到 {totals.get('fetched', 0)} 条 / {sink.frames} 帧，"
+              f"缺失 {totals.get('missing', 0)}，丢弃 {totals.get('dropped', 0)}")
+        print(f"  端到端延迟: p50 {sink.percentile(50):.1f} ms / p95 {sink.percentile(95):.1f} ms / "
+              f"max {max(sink.lags, default=0.0):.1f} ms（含 frame_linger {subscriber.frame_linger_ms:.0f} ms）")
+
+
+# ========================= 主流程 =========================
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='检测回放 / Redis 链路压测')
+    parser.add_argument('--redis-host', type=str, default='localhost', help='Redis服务器地址')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
+    parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    parser.add_argument('--key-prefix', type=str, default=REPLAY_PREFIX, help='哈希键前缀')
+    parser.add_argument('--channel', type=str, default=REPLAY_CHANNEL, help='通知频道')
+    parser.add_argument('--ttl', type=int, default=120, help='哈希过期时间（秒）')
+    parser.add_argument('--speed', type=float, default=1.0, help='播放倍速')
+    parser.add_argument('--streams', type=int, default=1, help='并行回放的路数（模拟多路视频源）')
+    parser.add_argument('--no-subscribe', action='store_true', help='只发布，不测端到端延迟')
+    parser.add_argument('--frame-linger-ms', type=float, default=50.0, help='订阅端帧聚合等待时间')
+    parser.add_argument('--keep', action='store_true', help='结束后保留写入的数据')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p_log = sub.add_parser('log', help='回放任务检测日志')
+    p_log.add_argument('mission_dir', type=str, help='任务目录')
+    p_log.add_argument('--max-gap', type=float, default=5.0, help='帧间空档上限（秒）')
+
+    p_syn = sub.add_parser('synthetic', help='合成人群')
+    p_syn.add_argument('--crowd', type=float, default=50.0, help='每帧平均人数')
+    p_syn.add_argument('--fps', type=float, default=25.0, help='帧率')
+    p_syn.add_argument('--duration', type=float, default=30.0, help='时长（秒，按 1 倍速计）')
+    p_syn.add_argument('--burst-prob', type=float, default=0.02, help='每帧进入突发段的概率')
+    p_syn.add_argument('--burst-scale', type=float, default=3.0, help='突发段人数倍数')
+    p_syn.add_argument('--burst-frames', type=int, default=50, help='突发段持续帧数')
+    p_syn.add_argument('--seed', type=int, default=None, help='随机种子')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    multi = args.streams > 1
+    names = [f"s{i}" for i in range(args.streams)]
+    namespaces = [(f"{args.key_prefix}_{n}", f"{args.channel}:{n}") if multi else (args.key_prefix, args.channel)
+                  for n in names]
+
+    subscriber = None
+    if not args.no_subscribe:
+        subscriber = SubscriberThread(args.redis_host, args.redis_port, args.redis_db, args.redis_password,
+                                      [channel for _, channel in namespaces], args.frame_linger_ms)
+        subscriber.start()
+        subscriber.ready.wait(timeout=10)
+
+    stop_event = threading.Event()
+    streams: List[ReplayStream] = []
+    for i, (name, (prefix, channel)) in enumerate(zip(names, namespaces)):
+        if args.cmd == 'log':
+            frames = log_frames(args.mission_dir, args.max_gap)
+        else:
+            seed = None if args.seed is None else args.seed + i
+            frames = synthetic_frames(args.crowd, args.fps, args.duration, args.burst_prob, args.burst_scale,
+                                      args.burst_frames, seed=seed)
+        publisher = RedisDetectionPublisher(host=args.redis_host, port=args.redis_port, db=args.redis_db,
+                                            password=args.redis_password, key_prefix=prefix, channel=channel,
+                                            ttl_s=args.ttl, verbose=False)
+        if not publisher.redis_client:
+            raise SystemExit("❌ 无法连接 Redis")
+        streams.append(ReplayStream(frames, publisher, args.speed, stop_event, name))
+
+    print(f"▶️ 回放 {args.cmd}：{args.streams} 路，{args.speed}x，写入 {args.key_prefix} / {args.channel}")
+    for s in streams:
+        s.start()
+    try:
+        for s in streams:
+            while s.is_alive():
+                s.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("🛑 中断回放")
+        stop_event.set()
+        for s in streams:
+            s.join()
+
+    if subscriber:
+        # 给订阅端留出追平时间
+        time.sleep(1.0 + args.frame_linger_ms / 1000.0)
+        subscriber.shutdown()
+    report(streams, subscriber)
+
+    if not args.keep:
+        if args.key_prefix == KEY_PREFIX:
+            print("⚠️ 写入的是生产键前缀，不做清理（依赖 TTL 过期）")
+        else:
+            print("🧹 清理回放数据...")
+            for s in streams:
+                _cleanup(s.publisher.redis_client, s.publisher.key_prefix)
+
+
+if __name__ == "__main__":
+    main()
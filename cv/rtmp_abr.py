@@ -0,0 +1,148 @@
+"""
+RTMP 自适应码率/分辨率控制
+
+4G 上行变弱时，ffmpeg 发送阻塞 -> 编码器积压 -> stdin 管道写满 -> 主线程 write() 卡住，画面整体停滞。
+AbrController 根据两类信号在分辨率/码率阶梯上切换：
+- 管道写入阻塞：单次 write 超过 stall_factor 个帧间隔记为一次卡顿
+- ffmpeg -progress 输出：编码帧数落后于已写入帧数（积压）
+
+每 window_s 秒评估一次窗口健康度；连续 degrade_after 个坏窗口降一档，
+连续 upgrade_after 个好窗口才升一档（升档比降档慢，且刚切换后 hold_s 秒内不再切换），避免来回抖动。
+切档需要重启编码器，由 RtmpStreamer 在 GOP 边界（关键帧处）执行。
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+# (宽, 高, 平均码率k, 峰值码率k, 缓冲k)，第 0 档与 RtmpStreamer 默认配置一致
+DEFAULT_LADDER: List[Tuple[int, int, int, int, int]] = [
+    (1280, 720, 2300, 2500, 5000),
+    (960, 540, 1600, 1800, 3600),
+    (640, 360, 800, 900, 1800),
+]
+
+
+class ProgressReader(threading.Thread):
+    """
+    读取 ffmpeg `-progress pipe:1` 输出，每个 progress= 块结束时更新一次最新状态。
+    written_fn 返回当前已写入帧数：块到达时记下该值（written 字段），积压按同一时刻的两个计数计算；
+    否则快照最多滞后一个 -stats_period，正常链路上也会算出约一秒的“积压”。
+    """
+
+    def __init__(self, stream, written_fn: Optional[Callable[[], int]] = None):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.written_fn = written_fn
+        self.latest: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        block: Dict[str, str] = {}
+        try:
+            for raw in iter(self.stream.readline, b""):
+                key, _, value = raw.decode("utf-8", errors="replace").strip().partition("=")
+                block[key] = value
+                if key == "progress":
+                    if self.written_fn:
+                        block["written"] = str(self.written_fn())
+                    with self.lock:
+                        self.latest = block
+                    block = {}
+        except (OSError, ValueError):
+            pass
+
+    def snapshot(self) -> Dict[str, str]:
+        with self.lock:
+            return dict(self.latest)
+
+
+class AbrController:
+    def __init__(self, fps: int, ladder: Optional[List[Tuple[int, int, int, int, int]]] = None,
+                 window_s: float = 2.0, stall_factor: float = 2.0, max_stall_ratio: float = 0.1,
+                 max_backlog_s: float = 1.0, degrade_after: int = 2, upgrade_after: int = 15,
+                 hold_s: float = 10.0):
+        self.fps = fps
+        self.ladder = ladder or DEFAULT_LADDER
+        self.window_s = window_s
+        self.stall_threshold_s = stall_factor / fps
+        self.max_stall_ratio = max_stall_ratio
+        self.max_backlog_frames = max_backlog_s * fps
+        self.degrade_after = degrade_after
+        self.upgrade_after = upgrade_after
+        self.hold_s = hold_s
+
+        self.rung = 0
+        self.bad_windows = 0
+        self.good_windows = 0
+        now = time.monotonic()
+        self.window_start = now
+        self.last_switch = now
+        self.rung_since = now
+        self.writes = 0
+        self.stalls = 0
+        self.max_backlog = 0
+        # 统计：每档累计时长、切换次数
+        self.time_at_rung = [0.0] * len(self.ladder)
+        self.switches = 0
+
+    def on_write(self, write_s: float):
+        self.writes += 1
+        if write_s > self.stall_threshold_s:
+            self.stalls += 1
+
+    def on_progress(self, frames_written: int, progress: Dict[str, str]):
+        """progress 带 written 时用块到达时的写入帧数；frames_written 仅在没有该字段时使用"""
+        if not progress:
+            return
+        try:
+            encoded = int(progress.get("frame", 0))
+            written = int(progress.get("written", frames_written))
+        except ValueError:
+            return
+        self.max_backlog = max(self.max_backlog, written - encoded)
+
+    def evaluate(self) -> Optional[int]:
+        """窗口结束时返回建议切换到的档位，否则 None"""
+        now = time.monotonic()
+        if now - self.window_start < self.window_s:
+            return None
+        stall_ratio = self.stalls / self.writes if self.writes else 0.0
+        backlog = self.max_backlog
+        healthy = stall_ratio <= self.max_stall_ratio and backlog <= self.max_backlog_frames
+        self.window_start = now
+        self.writes = self.stalls = self.max_backlog = 0
+
+        if healthy:
+            self.good_windows += 1
+            self.bad_windows = 0
+        else:
+            self.bad_windows += 1
+            self.good_windows = 0
+            print(f"📉 推流窗口异常: 卡顿比例 {stall_ratio:.0%}，编码积压 {backlog} 帧（档位 {self.rung}）")
+
+        if now - self.last_switch < self.hold_s:
+            return None
+        if self.bad_windows >= self.degrade_after and self.rung < len(self.ladder) - 1:
+            return self.rung + 1
+        if self.good_windows >= self.upgrade_after and self.rung > 0:
+            return self.rung - 1
+        return None
+
+    def switched(self, rung: int):
+        now = time.monotonic()
+        self.time_at_rung[self.rung] += now - self.rung_since
+        self.rung = rung
+        self.rung_since = now
+        self.last_switch = now
+        self.bad_windows = self.good_windows = 0
+        self.switches += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        times = list(self.time_at_rung)
+        times[self.rung] += time.monotonic() - self.rung_since
+        return {
+            "rung": self.rung,
+            "switches": self.switches,
+            "time_at_rung_s": {f"{w}x{h}@{b}k": round(t, 1) for (w, h, b, _, _), t in zip(self.ladder, times)},
+        }
@@ -0,0 +1,485 @@
+"""
+SSE / WebSocket 扇出网关（asyncio）
+
+Java 端每条检测对应一个 SSE 事件，且每个浏览器都会放大 Redis 读取量。
+本网关只从 Redis 消费一次（复用 sub.py 的 AsyncDetectionSubscriber），
+把检测合并为“每帧一个事件”（或每 N ms 一个事件），事件只编码一次，再扇出给所有客户端：
+
+- GET /api/image-metadata/stream   SSE（与 Java 端路径一致，便于前端切换）
+- GET /ws                          WebSocket（文本帧，内容同 SSE 的 data）
+- GET /stats                       网关统计（JSON）
+
+每个客户端一个有界发送队列：队列满时丢弃最旧事件。按每 drop_window 个事件统计一次丢弃比例，
+超过 max_drop_ratio 的慢客户端直接断开，不拖累其他连接（偶尔能读走几个事件的客户端同样会被断开）。
+慢客户端用 transport.abort() 断开：对端不读时 close() 要等发送缓冲写完，连接协程会一直卡在 drain()。
+单次 drain() 超过 write_timeout_s 的客户端同样按慢客户端断开。
+压测结束时检查被断开客户端的连接协程是否都已退出，有残留则以非零状态退出。
+
+用法：
+    python sse_gateway.py --redis-host 124.71.162.119 --port 8090
+    python sse_gateway.py --coalesce-ms 200                    # 每 200ms 合并为一个事件
+    python sse_gateway.py --load-test --clients 500 --slow 20   # 本地压测（合成数据，无需 Redis）
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from typing import Dict, Any, Optional, List
+
+import redis.asyncio as aioredis
+
+from sub import AsyncDetectionSubscriber, UPDATES_CHANNEL
+
+SSE_PATH = "/api/image-metadata/stream"
+WS_PATH = "/ws"
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """服务端 -> 客户端帧（不加掩码）"""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+async def _read_ws_frame(reader: asyncio.StreamReader):
+    """读取一帧，返回 (opcode, payload)；兼容带掩码（浏览器）与不带掩码（压测客户端）"""
+    b1, b2 = await reader.readexactly(2)
+    opcode = b1 & 0x0F
+    n = b2 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if b2 & 0x80 else None
+    payload = await reader.readexactly(n)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+# ========================= 客户端连接 =========================
+class _Client:
+    def __init__(self, client_id: int, kind: str, writer: asyncio.StreamWriter, buffer_size: int):
+        self.id = client_id
+        self.kind = kind  # "sse" / "ws"
+        self.writer = writer
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.sent = 0
+        self.dropped = 0
+        # 当前统计窗口内的入队 / 丢弃次数
+        self.window_offers = 0
+        self.window_drops = 0
+        self.closed = asyncio.Event()
+        # 处理该连接的协程（断开后检查它是否退出）
+        self.handler: Optional[asyncio.Task] = asyncio.current_task()
+
+    def offer(self, event: Dict[str, bytes]) -> bool:
+        """非阻塞入队；返回 False 表示队列已满（已丢弃最旧事件）"""
+        self.window_offers += 1
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.queue.put_nowait(event)
+            self.dropped += 1
+            self.window_drops += 1
+            return False
+
+    def window_drop_ratio(self, window: int) -> Optional[float]:
+        """每满 window 次入队返回一次该窗口的丢弃比例并开始新窗口，其余时候返回 None"""
+        if self.window_offers < window:
+            return None
+        ratio = self.window_drops / self.window_offers
+        self.window_offers = self.window_drops = 0
+        return ratio
+
+
+# ========================= 网关 =========================
+class FanoutGateway:
+    def __init__(self, coalesce_ms: float = 0.0, buffer_size: int = 32, max_drop_ratio: float = 0.5,
+                 drop_window: int = 50, heartbeat_s: float = 25.0, write_timeout_s: float = 10.0):
+        self.coalesce_s = coalesce_ms / 1000.0
+        self.buffer_size = buffer_size
+        self.max_drop_ratio = max_drop_ratio
+        self.drop_window = drop_window
+        self.heartbeat_s = heartbeat_s
+        self.write_timeout_s = write_timeout_s
+        self.clients: Dict[int, _Client] = {}
+        # 正在处理的连接协程，压测结束时统一取消
+        self.handlers: set = set()
+        self.next_id = 0
+        self.pending: List[Dict[str, Any]] = []
+        self.stats = {"frames_in": 0, "events_out": 0, "deliveries": 0, "dropped": 0,
+                      "slow_disconnects": 0, "connections": 0, "stuck_handlers": 0}
+        # 被断开的慢客户端中连接协程尚未退出的
+        self.dropped_handlers: set = set()
+
+    # ---------- 输入：sink 接口 ----------
+    def emit(self, frame: Dict[str, Any]):
+        self.stats["frames_in"] += 1
+        if self.coalesce_s > 0:
+            self.pending.append(frame)
+        else:
+            self._broadcast([frame])
+
+    async def _coalesce_loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            await asyncio.sleep(self.coalesce_s)
+            if self.pending:
+                frames, self.pending = self.pending, []
+                self._broadcast(frames)
+
+    # ---------- 扇出 ----------
+    @staticmethod
+    def _encode(frames: List[Dict[str, Any]]) -> Dict[str, bytes]:
+        payload = json.dumps({
+            "sentMs": int(time.time() * 1000),
+            "frames": [{
+                "timestamp": f["frame_ts"],
+                "peopleCount": f["count"],
+                "avgConfidence": round(f["avg_confidence"], 2),
+                "boxes": f["boxes"],
+            } for f in frames],
+        }, separators=(",", ":")).encode("utf-8")
+        return {
+            "sse": b"event: frame\ndata: " + payload + b"\n\n",
+            "ws": _ws_frame(payload),
+        }
+
+    def _broadcast(self, frames: List[Dict[str, Any]]):
+        if not self.clients:
+            return
+        # 每个事件只序列化一次，所有客户端共享同一份字节
+        event = self._encode(frames)
+        self.stats["events_out"] += 1
+        for client in list(self.clients.values()):
+            if client.offer(event):
+                self.stats["deliveries"] += 1
+            else:
+                self.stats["dropped"] += 1
+            ratio = client.window_drop_ratio(self.drop_window)
+            if ratio is not None and ratio > self.max_drop_ratio:
+                print(f"🐢 客户端 {client.id} 最近 {self.drop_window} 个事件丢弃 {ratio:.0%}，断开连接")
+                self._drop_slow(client)
+
+    def _drop(self, client: _Client, abort: bool = False):
+        if self.clients.pop(client.id, None) is not None:
+            client.closed.set()
+            if abort:
+                # 不等发送缓冲写完：对端不读时 close() 永远完成不了
+                client.writer.transport.abort()
+            else:
+                client.writer.close()
+
+    def _drop_slow(self, client: _Client):
+        if client.id not in self.clients:
+            return
+        self.stats["slow_disconnects"] += 1
+        self._drop(client, abort=True)
+        if client.handler is not None and not client.handler.done():
+            self.dropped_handlers.add(client.handler)
+            client.handler.add_done_callback(self.dropped_handlers.discard)
+
+    async def check_dropped_handlers(self, timeout: float = 2.0) -> int:
+        """等待被断开客户端的连接协程退出，返回超时仍未退出的数量"""
+        handlers = list(self.dropped_handlers)
+        if handlers:
+            await asyncio.wait(handlers, timeout=timeout)
+        stuck = sum(1 for task in handlers if not task.done())
+        self.stats["stuck_handlers"] = stuck
+        return stuck
+
+    # ---------- HTTP ----------
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            headers: Dict[str, str] = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line in ("\r\n", "\n", ""):
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.split()
+            path = parts[1].split("?")[0] if len(parts) >= 2 else ""
+
+            if path == SSE_PATH:
+                await self._serve_sse(reader, writer)
+            elif path == WS_PATH and headers.get("upgrade", "").lower() == "websocket":
+                await self._serve_ws(reader, writer, headers)
+            elif path == "/stats":
+                body = json.dumps({**self.stats, "clients": len(self.clients)}).encode("utf-8")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Access-Control-Allow-Origin: *\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+                writer.close()
+            else:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+                writer.close()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+        finally:
+            self.handlers.discard(task)
+
+    async def shutdown(self):
+        """断开所有客户端并等待连接协程结束"""
+        for client in list(self.clients.values()):
+            self._drop(client)
+        # 断开后 _pump 与读循环会自行退出；超时未结束的再取消
+        handlers = list(self.handlers)
+        if handlers:
+            _, pending = await asyncio.wait(handlers, timeout=2.0)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _register(self, kind: str, writer: asyncio.StreamWriter) -> _Client:
+        client = _Client(self.next_id, kind, writer, self.buffer_size)
+        self.next_id += 1
+        self.clients[client.id] = client
+        self.stats["connections"] += 1
+        return client
+
+    async def _pump(self, client: _Client, heartbeat: bytes):
+        """把客户端队列写入 socket；空闲时发送心跳。等待事件时同时等待断开，被踢掉的客户端立即退出"""
+        closed = asyncio.ensure_future(client.closed.wait())
+        get: Optional[asyncio.Future] = None
+        try:
+            while not client.closed.is_set():
+                get = asyncio.ensure_future(client.queue.get())
+                done, _ = await asyncio.wait({get, closed}, timeout=self.heartbeat_s,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    client.writer.write(get.result()[client.kind])
+                    client.sent += 1
+                elif closed in done:
+                    break
+                else:
+                    client.writer.write(heartbeat)
+                get = None
+                # drain() 有上限：对端不读时不让协程一直挂着
+                await asyncio.wait_for(client.writer.drain(), self.write_timeout_s)
+        except asyncio.TimeoutError:
+            print(f"🐢 客户端 {client.id} 写入超过 {self.write_timeout_s:g}s 未完成，断开连接")
+            self._drop_slow(client)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            for fut in (get, closed):
+                if fut is not None and not fut.done():
+                    fut.cancel()
+            self._drop(client)
+
+    async def _serve_sse(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n"
+                     b"Access-Control-Allow-Origin: *\r\n\r\n")
+        await writer.drain()
+        client = self._register("sse", writer)
+        # 浏览器断开时 read 返回空，借此尽早清理
+        watcher = asyncio.create_task(reader.read())
+        watcher.add_done_callback(lambda _: self._drop(client))
+        await self._pump(client, b": heartbeat\n\n")
+        watcher.cancel()
+
+    async def _serve_ws(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        headers: Dict[str, str]):
+        accept = base64.b64encode(hashlib.sha1((headers.get("sec-websocket-key", "") + WS_GUID)
+                                               .encode("latin-1")).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        client = self._register("ws", writer)
+        pump = asyncio.create_task(self._pump(client, _ws_frame(b"", opcode=0x9)))
+        try:
+            while not client.closed.is_set():
+                opcode, payload = await _read_ws_frame(reader)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    writer.write(_ws_frame(payload, opcode=0xA))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._drop(client)
+            pump.cancel()
+
+
+# ========================= 压测 =========================
+async def _synthetic_frames(gateway: FanoutGateway, rate: float, boxes: int, stop: asyncio.Event):
+    """不经 Redis，直接以固定帧率向网关注入合成帧"""
+    interval = 1.0 / rate
+    next_tick = time.monotonic()
+    while not stop.is_set():
+        gateway.emit({
+            "frame_ts": int(time.time() * 1000),
+            "count": boxes,
+            "avg_confidence": 80.0,
+            "boxes": [[640.0, 360.0, 40.0, 90.0]] * boxes,
+            "lag_ms": 0.0,
+        })
+        next_tick += interval
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+async def _sim_client(host: str, port: int, kind: str, delay_s: float, results: Dict[str, Any],
+                      stop: asyncio.Event):
+    """模拟一个浏览器连接：读取事件并记录 sentMs -> 收到 的延迟；delay_s > 0 模拟慢客户端"""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        results["connect_errors"] += 1
+        return
+    path = SSE_PATH if kind == "sse" else WS_PATH
+    req = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if kind == "ws":
+        req += ("Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Version: 13\r\n"
+                f"Sec-WebSocket-Key: {base64.b64encode(b'loadtest-key-000').decode()}\r\n")
+    writer.write((req + "\r\n").encode("latin-1"))
+    received = 0
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        while not stop.is_set():
+            if kind == "sse":
+                block = await reader.readuntil(b"\n\n")
+                if not block.startswith(b"event: frame"):
+                    continue
+                payload = block.split(b"data: ", 1)[1]
+            else:
+                opcode, payload = await _read_ws_frame(reader)
+                if opcode != 0x1:
+                    continue
+            sent_ms = json.loads(payload)["sentMs"]
+            results["lags"].append(time.time() * 1000.0 - sent_ms)
+            received += 1
+            if delay_s:
+                await asyncio.sleep(delay_s)
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        results["disconnected"] += 1
+    finally:
+        results["received"] += received
+        writer.close()
+
+
+async def run_load_test(args):
+    gateway = FanoutGateway(coalesce_ms=args.coalesce_ms, buffer_size=args.buffer,
+                            max_drop_ratio=args.max_drop_ratio, drop_window=args.drop_window,
+                            write_timeout_s=args.write_timeout)
+    server = await asyncio.start_server(gateway.handle, "127.0.0.1", 0, limit=2 ** 22)
+    port = server.sockets[0].getsockname()[1]
+    stop = asyncio.Event()
+    results: Dict[str, Any] = {"received": 0, "disconnected": 0, "connect_errors": 0, "lags": []}
+    slow_results: Dict[str, Any] = {"received": 0, "disconnected": 0, "connect_errors": 0, "lags": []}
+
+    print(f"🧪 压测：{args.clients} 个客户端（其中慢客户端 {args.slow}，WS 比例 {args.ws_ratio:.0%}），"
+          f"{args.rate} 帧/秒 × {args.boxes} 框，持续 {args.duration}s")
+    n_ws = int(args.clients * args.ws_ratio)
+    tasks = []
+    for i in range(args.clients):
+        kind = "ws" if i < n_ws else "sse"
+        slow = i >= args.clients - args.slow
+        tasks.append(asyncio.create_task(_sim_client(
+            "127.0.0.1", port, kind, 1.0 if slow else 0.0, slow_results if slow else results, stop)))
+    await asyncio.sleep(1.0)  # 等待连接建立
+
+    background = [asyncio.create_task(_synthetic_frames(gateway, args.rate, args.boxes, stop))]
+    if gateway.coalesce_s > 0:
+        background.append(asyncio.create_task(gateway._coalesce_loop(stop)))
+    await asyncio.sleep(args.duration)
+    # 压测进行中被断开的慢客户端：连接协程必须已经退出
+    stuck = await gateway.check_dropped_handlers()
+    stop.set()
+    await gateway.shutdown()
+    await asyncio.gather(*background, *tasks, return_exceptions=True)
+    server.close()
+    await server.wait_closed()
+
+    lags = sorted(results["lags"])
+    fast = args.clients - args.slow
+    print("\n📊 压测结果:")
+    print(f"  注入帧: {gateway.stats['frames_in']}，广播事件: {gateway.stats['events_out']}")
+    print(f"  正常客户端: 平均收到 {results['received'] / max(fast, 1):.0f} 个事件，断开 {results['disconnected']}")
+    if lags:
+        print(f"  延迟: p50 {lags[len(lags) // 2]:.1f} ms / p95 {lags[int(len(lags) * 0.95)]:.1f} ms / "
+              f"max {lags[-1]:.1f} ms")
+    print(f"  慢客户端: 收到 {slow_results['received']} 个事件，被网关断开 {gateway.stats['slow_disconnects']}")
+    print(f"  丢弃事件: {gateway.stats['dropped']}，连接失败: {results['connect_errors'] + slow_results['connect_errors']}")
+    if stuck:
+        raise SystemExit(f"❌ {stuck} 个被断开的慢客户端连接协程未退出")
+    print("  ✅ 被断开的慢客户端连接协程均已退出")
+
+
+# ========================= 主流程 =========================
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='SSE / WebSocket 检测扇出网关')
+    parser.add_argument('--host', type=str, default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=8090, help='监听端口')
+    parser.add_argument('--redis-host', type=str, default='localhost', help='Redis服务器地址')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
+    parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    parser.add_argument('--channel', type=str, default=UPDATES_CHANNEL, help='订阅频道')
+    parser.add_argument('--coalesce-ms', type=float, default=0.0, help='>0 时每 N ms 合并为一个事件，否则每帧一个')
+    parser.add_argument('--buffer', type=int, default=32, help='每个客户端的发送队列长度')
+    parser.add_argument('--max-drop-ratio', type=float, default=0.5, help='统计窗口内丢弃比例超过该值时断开慢客户端')
+    parser.add_argument('--drop-window', type=int, default=50, help='丢弃比例的统计窗口（事件数）')
+    parser.add_argument('--write-timeout', type=float, default=10.0, help='单次写入等待超过该秒数时断开客户端')
+    parser.add_argument('--load-test', action='store_true', help='本地压测模式（合成数据）')
+    parser.add_argument('--clients', type=int, default=500, help='压测客户端数')
+    parser.add_argument('--slow', type=int, default=10, help='其中慢客户端数（每秒只读一个事件）')
+    parser.add_argument('--ws-ratio', type=float, default=0.5, help='WebSocket 客户端比例')
+    parser.add_argument('--rate', type=float, default=25.0, help='压测帧率')
+    parser.add_argument('--boxes', type=int, default=50, help='压测每帧检测框数')
+    parser.add_argument('--duration', type=float, default=20.0, help='压测时长（秒）')
+    return parser.parse_args()
+
+
+async def run_gateway(args):
+    gateway = FanoutGateway(coalesce_ms=args.coalesce_ms, buffer_size=args.buffer,
+                            max_drop_ratio=args.max_drop_ratio, drop_window=args.drop_window,
+                            write_timeout_s=args.write_timeout)
+    client = aioredis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db,
+                            password=args.redis_password, decode_responses=True)
+    subscriber = AsyncDetectionSubscriber(client, gateway, channel=args.channel)
+    server = await asyncio.start_server(gateway.handle, args.host, args.port)
+    print(f"🌐 网关已启动: http://{args.host}:{args.port}{SSE_PATH}  ws://{args.host}:{args.port}{WS_PATH}")
+    stop = asyncio.Event()
+    tasks = [subscriber.run(stop)]
+    if gateway.coalesce_s > 0:
+        tasks.append(gateway._coalesce_loop(stop))
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), *tasks)
+    finally:
+        await client.aclose()
+
+
+def main():
+    args = parse_arguments()
+    try:
+        asyncio.run(run_load_test(args) if args.load_test else run_gateway(args))
+    except KeyboardInterrupt:
+        print("🔴 网关退出")
+
+
+if __name__ == "__main__":
+    main()
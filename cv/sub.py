@@ -1,64 +1,356 @@
 """
-Redis 订阅端示例：监听 YOLO 检测结果（image_metadata:* 哈希）
-配套发布端：
-- 频道：yolo:image_metadata:updates
-- 消息：{"key": "image_metadata:{timestamp_ms}", "timestamp": 1757403271281}
-- 对应的哈希键：image_metadata:{timestamp_ms}
-  字段：timestamp, center_x, center_y, width, height, confidence(百分比)
+Redis 订阅端（asyncio 高吞吐版）：监听 YOLO 检测结果（image_metadata:* 哈希）
+配套发布端（redis_publisher.py）：
+- 频道：image:metadata:updates
+- 消息：哈希键名 image_metadata:{timestamp_ms}
+  （兼容旧版 pubilish.py 的 JSON 消息 {"key": ..., "timestamp": ...}）
+- 哈希字段：timestamp, center_x, center_y, width, height, confidence(百分比), frame_ts, class_id
+
+处理流程：
+  读取协程 --(键队列)--> 批处理协程 --(流水线 HGETALL，最多 max_in_flight 个并发)--> 帧聚合
+  帧聚合按 frame_ts 归并同一帧的检测，一帧在 frame_linger_ms 内无新数据即视为完整，
+  交给可插拔的 sink（PrintSink / JsonlSink / StatsSink，或任何带 emit(frame) 方法的对象）。
+
+用法：
+    python sub.py                                    # 打印每帧聚合
+    python sub.py --jsonl frames.jsonl               # 写入 JSONL
+    python sub.py --load-test --rate 25 --boxes 200  # 本地压测：吞吐与延迟
+    python sub.py --delta                            # 订阅增量频道 image:metadata:updates:delta，还原完整集合
 """
 
-import redis
+import argparse
+import asyncio
 import json
+import time
+from collections import Counter
+from typing import Dict, Any, Optional, List
 
+import redis.asyncio as aioredis
 
-def main():
-    # 初始化 Redis 客户端
-    r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+from delta_publish import DeltaDecoder, DELTA_CHANNEL
 
-    # 订阅新频道：yolo:image_metadata:updates
-    pubsub = r.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe('yolo:image_metadata:updates')
+UPDATES_CHANNEL = "image:metadata:updates"
 
-    print("📡 已订阅 yolo:image_metadata:updates，等待消息...")
 
-    try:
-        for message in pubsub.listen():
-            # 只处理真正的消息
-            if message.get('type') != 'message':
-                continue
+# ========================= Sink =========================
+class PrintSink:
+    def emit(self, frame: Dict[str, Any]):
+        classes = "，".join(f"类别{k}×{v}" for k, v in sorted(frame.get("classes", {}).items()))
+        print(f"🆕 帧 {frame['frame_ts']}：{frame['count']} 个目标（{classes}），"
+              f"平均置信度 {frame['avg_confidence']:.1f}%，延迟 {frame['lag_ms']:.0f} ms")
 
-            # 解析 JSON 负载
-            try:
-                data = json.loads(message['data'])
-            except Exception as e:
-                print(f"⚠️ 无法解析消息为 JSON：{e}，原始数据：{message['data']}")
-                continue
 
-            key = data.get('key')  # 例如：image_metadata:1757403271281
-            ts = data.get('timestamp')
+class JsonlSink:
+    def __init__(self, path: str):
+        self.f = open(path, "a", encoding="utf-8")
+
+    def emit(self, frame: Dict[str, Any]):
+        self.f.write(json.dumps(frame, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.f.close()
+
 
-            if not key:
-                print(f"⚠️ 消息未包含 key 字段：{data}")
+class StatsSink:
+    """只做统计（压测用）：帧数、检测数、延迟分布"""
+
+    def __init__(self):
+        self.frames = 0
+        self.detections = 0
+        self.lags: List[float] = []
+
+    def emit(self, frame: Dict[str, Any]):
+        self.frames += 1
+        self.detections += frame["count"]
+        self.lags.append(frame["lag_ms"])
+
+    def percentile(self, p: float) -> float:
+        if not self.lags:
+            return 0.0
+        lags = sorted(self.lags)
+        return lags[min(len(lags) - 1, int(len(lags) * p / 100.0))]
+
+
+# ========================= 订阅器 =========================
+class AsyncDetectionSubscriber:
+    def __init__(self, client: aioredis.Redis, sink, channel: str = UPDATES_CHANNEL,
+                 batch_size: int = 200, batch_wait_ms: float = 5.0, max_in_flight: int = 8,
+                 queue_size: int = 50000, frame_linger_ms: float = 50.0,
+                 decoder: Optional[DeltaDecoder] = None):
+        self.client = client
+        self.sink = sink
+        self.channel = channel
+        self.batch_size = batch_size
+        self.batch_wait_s = batch_wait_ms / 1000.0
+        self.frame_linger_s = frame_linger_ms / 1000.0
+        self.key_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.fetch_tasks: set = set()
+        # frame_ts -> {"records": [...], "updated": 本地时间}
+        self.frames: Dict[int, Dict[str, Any]] = {}
+        self.last_ts = 0
+        self.last_frame_ts = 0
+        self.stats = {"messages": 0, "fetched": 0, "missing": 0, "dropped": 0, "frames": 0}
+        self.last_fetch_at = 0.0
+        self.batcher_done = False
+        # 增量发布模式：把 add/move/remove/key 记录还原为完整集合后再交给 sink
+        self.decoder = decoder
+
+    # ---------- 读取 ----------
+    async def _reader(self, stop: asyncio.Event):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        print(f"📡 已订阅 {self.channel}，等待消息...")
+        try:
+            while not stop.is_set():
+                message = await pubsub.get_message(timeout=0.5)
+                if not message or message.get("type") != "message":
+                    continue
+                key = self._parse_key(message["data"])
+                if not key:
+                    continue
+                self.stats["messages"] += 1
+                try:
+                    self.key_queue.put_nowait(key)
+                except asyncio.QueueFull:
+                    # 消费跟不上时丢弃最新的通知，避免内存无限增长
+                    self.stats["dropped"] += 1
+        finally:
+            await pubsub.unsubscribe(self.channel)
+            await pubsub.close()
+
+    @staticmethod
+    def _parse_key(data) -> Optional[str]:
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        if data.startswith("{"):
+            try:
+                return json.loads(data).get("key")
+            except Exception:
+                print(f"⚠️ 无法解析消息：{data}")
+                return None
+        return data
+
+    # ---------- 批量取哈希 ----------
+    async def _batcher(self, stop: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        while not (stop.is_set() and self.key_queue.empty()):
+            try:
+                first = await asyncio.wait_for(self.key_queue.get(), timeout=0.5)
+            except asyncio.TimeoutError:
                 continue
+            batch = [first]
+            deadline = loop.time() + self.batch_wait_s
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.key_queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.key_queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            # 并发请求数受信号量限制
+            await self.in_flight.acquire()
+            task = asyncio.create_task(self._fetch(batch))
+            self.fetch_tasks.add(task)
+            task.add_done_callback(self._on_fetch_done)
+        self.batcher_done = True
 
-            # 读取对应的哈希内容
-            det = r.hgetall(key)
+    def _on_fetch_done(self, task: asyncio.Task):
+        self.fetch_tasks.discard(task)
+        self.in_flight.release()
+        if not task.cancelled() and task.exception():
+            print(f"❌ 批量读取失败: {task.exception()}")
+
+    async def _fetch(self, keys: List[str]):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        rows = await pipe.execute()
+        now = self.last_fetch_at = time.monotonic()
+        for key, det in zip(keys, rows):
             if not det:
-                print(f"⚠️ 找不到哈希键：{key}")
+                self.stats["missing"] += 1
                 continue
+            self.stats["fetched"] += 1
+            self._add_to_frame(det, now)
+
+    # ---------- 帧聚合 ----------
+    def _frame_of(self, det: Dict[str, str]) -> int:
+        ts = int(float(det.get("timestamp", 0)))
+        if "frame_ts" in det:
+            frame_ts = int(float(det["frame_ts"]))
+        elif self.last_frame_ts and 0 <= ts - self.last_ts <= 3:
+            # 旧发布端没有 frame_ts：沿用 Java SseService 的规则，相邻时间戳相差 ≤3ms 视为同一帧
+            frame_ts = self.last_frame_ts
+        else:
+            frame_ts = ts
+        self.last_ts = ts
+        self.last_frame_ts = frame_ts
+        return frame_ts
+
+    def _add_to_frame(self, det: Dict[str, str], now: float):
+        frame_ts = self._frame_of(det)
+        entry = self.frames.get(frame_ts)
+        if entry is None:
+            entry = self.frames[frame_ts] = {"records": [], "updated": now}
+        entry["records"].append(det)
+        entry["updated"] = now
+
+    async def _flusher(self, stop: asyncio.Event):
+        while True:
+            done = self.batcher_done and not self.fetch_tasks
+            await self._flush(force=done)
+            if done:
+                return
+            await asyncio.sleep(self.frame_linger_s / 2)
+
+    async def _flush(self, force: bool = False):
+        now = time.monotonic()
+        ready = [ts for ts, e in self.frames.items() if force or now - e["updated"] >= self.frame_linger_s]
+        for frame_ts in sorted(ready):
+            records = self.frames.pop(frame_ts)["records"]
+            if self.decoder:
+                records = self.decoder.apply(records)
+            confidences = [float(r.get("confidence", 0.0)) for r in records]
+            frame = {
+                "frame_ts": frame_ts,
+                "count": len(records),
+                "avg_confidence": sum(confidences) / len(confidences) if confidences else 0.0,
+                # 旧版发布端不带 class_id，计为 -1
+                "classes": dict(Counter(int(float(r.get("class_id", -1))) for r in records)),
+                "lag_ms": time.time() * 1000.0 - frame_ts,
+                "boxes": [
+                    [float(r["center_x"]), float(r["center_y"]), float(r["width"]), float(r["height"])]
+                    for r in records
+                ],
+            }
+            self.stats["frames"] += 1
+            result = self.sink.emit(frame)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def run(self, stop: asyncio.Event):
+        await asyncio.gather(self._reader(stop), self._batcher(stop), self._flusher(stop))
+
+
+# ========================= 压测 =========================
+async def _load_publisher(client: aioredis.Redis, key_prefix: str, channel: str, rate: float, boxes: int,
+                          duration: float, stop: asyncio.Event) -> int:
+    """按 redis_publisher 的格式以固定帧率写入模拟检测，返回发布的检测条数"""
+    published = 0
+    interval = 1.0 / rate
+    start = time.monotonic()
+    next_tick = start
+    frame = 0
+    while time.monotonic() - start < duration:
+        base_ts_ms = int(time.time() * 1000)
+        pipe = client.pipeline(transaction=False)
+        for idx in range(boxes):
+            key = f"{key_prefix}:{base_ts_ms}-{frame}-{idx}"
+            pipe.hset(key, mapping={"timestamp": base_ts_ms + idx, "center_x": 640.0, "center_y": 360.0,
+                                    "width": 40.0, "height": 90.0, "confidence": 80.0,
+                                    "frame_ts": base_ts_ms})
+            pipe.expire(key, 120)
+            pipe.publish(channel, key)
+        await pipe.execute()
+        published += boxes
+        frame += 1
+        next_tick += interval
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+    stop.set()
+    return published
+
+
+async def run_load_test(args):
+    client = aioredis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db,
+                            password=args.redis_password, decode_responses=True)
+    pub_client = aioredis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db,
+                                password=args.redis_password, decode_responses=True)
+    channel = "loadtest:metadata:updates"
+    sink = StatsSink()
+    subscriber = AsyncDetectionSubscriber(client, sink, channel=channel, batch_size=args.batch_size,
+                                          max_in_flight=args.max_in_flight)
+    sub_stop = asyncio.Event()
+    pub_stop = asyncio.Event()
+    print(f"🧪 压测：{args.rate} 帧/秒 × {args.boxes} 框，持续 {args.duration}s")
 
-            # 友好打印
-            print(f"🆕 新检测到目标（哈希键）：{key}")
-            print(f"    timestamp : {det.get('timestamp', ts)}")
-            print(f"    center_x  : {det.get('center_x')}")
-            print(f"    center_y  : {det.get('center_y')}")
-            print(f"    width     : {det.get('width')}")
-            print(f"    height    : {det.get('height')}")
-            print(f"    confidence: {det.get('confidence')}")
+    sub_task = asyncio.create_task(subscriber.run(sub_stop))
+    await asyncio.sleep(0.5)  # 等待订阅生效
+    t0 = time.monotonic()
+    published = await _load_publisher(pub_client, "loadtest_metadata", channel, args.rate, args.boxes,
+                                      args.duration, pub_stop)
+    pub_elapsed = time.monotonic() - t0
+    # 给订阅端留出追平时间
+    await asyncio.sleep(1.0)
+    sub_stop.set()
+    await sub_task
+    # 消费速率按最后一次取到数据的时刻计算，不含末尾的等待
+    elapsed = max(subscriber.last_fetch_at - t0, 1e-6)
 
+    print("\n📊 压测结果:")
+    print(f"  发布: {published} 条（{published / pub_elapsed:.0f} 条/秒）")
+    print(f"  消费: {subscriber.stats['fetched']} 条（{subscriber.stats['fetched'] / elapsed:.0f} 条/秒），"
+          f"{sink.frames} 帧")
+    print(f"  丢弃: {subscriber.stats['dropped']}，缺失: {subscriber.stats['missing']}")
+    print(f"  延迟: p50 {sink.percentile(50):.1f} ms / p95 {sink.percentile(95):.1f} ms / "
+          f"max {max(sink.lags) if sink.lags else 0.0:.1f} ms")
+    await client.aclose()
+    await pub_client.aclose()
+
+
+# ========================= 主流程 =========================
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Redis 检测结果订阅端（asyncio）')
+    parser.add_argument('--redis-host', type=str, default='localhost', help='Redis服务器地址')
+    parser.add_argument('--redis-port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--redis-db', type=int, default=0, help='Redis DB')
+    parser.add_argument('--redis-password', type=str, default=None, help='Redis密码')
+    parser.add_argument('--channel', type=str, default=None,
+                        help=f'订阅频道（默认 {UPDATES_CHANNEL}，--delta 时为 {DELTA_CHANNEL}）')
+    parser.add_argument('--batch-size', type=int, default=200, help='每次流水线读取的最大键数')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='同时进行的流水线请求上限')
+    parser.add_argument('--delta', action='store_true', help='订阅发布端 --delta 的增量记录，还原完整集合')
+    parser.add_argument('--jsonl', type=str, default=None, help='(可选) 每帧聚合写入 JSONL 文件')
+    parser.add_argument('--load-test', action='store_true', help='本地压测模式')
+    parser.add_argument('--rate', type=float, default=25.0, help='压测发布帧率')
+    parser.add_argument('--boxes', type=int, default=200, help='压测每帧检测框数')
+    parser.add_argument('--duration', type=float, default=20.0, help='压测时长（秒）')
+    return parser.parse_args()
+
+
+async def run_subscriber(args):
+    client = aioredis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db,
+                            password=args.redis_password, decode_responses=True)
+    sink = JsonlSink(args.jsonl) if args.jsonl else PrintSink()
+    channel = args.channel or (DELTA_CHANNEL if args.delta else UPDATES_CHANNEL)
+    subscriber = AsyncDetectionSubscriber(client, sink, channel=channel, batch_size=args.batch_size,
+                                          max_in_flight=args.max_in_flight,
+                                          decoder=DeltaDecoder() if args.delta else None)
+    stop = asyncio.Event()
+    try:
+        await subscriber.run(stop)
+    finally:
+        if isinstance(sink, JsonlSink):
+            sink.close()
+        await client.aclose()
+
+
+def main():
+    args = parse_arguments()
+    try:
+        if args.load_test:
+            asyncio.run(run_load_test(args))
+        else:
+            asyncio.run(run_subscriber(args))
     except KeyboardInterrupt:
         print("🔴 退出订阅")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()